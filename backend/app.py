@@ -1,42 +1,292 @@
+import os
+# With a message queue the app runs as one of several workers; the queue
+# listener needs the cooperative (eventlet) standard library
+if os.environ.get('SOCKETIO_MESSAGE_QUEUE'):
+    import eventlet
+    eventlet.monkey_patch()
+
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 from flask_socketio import SocketIO, emit, join_room
 import pymysql
+import click
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask import send_from_directory
 from flask import request, jsonify
-import math
+import sys
+import json
+import atexit
+import signal
 import uuid
+import queue
 import threading
 import time
+from datetime import datetime, timedelta
+from collections import OrderedDict
+from geo import haversine, rank_by_distance, bounding_box_wkt, combine_helper_searches, find_helpers, LocationGrid
+from friend_graph import FriendGraph
+from rooms import RoomRegistry
+from batching import AppendBuffer
+from location_buffer import LocationWriteBuffer, LocationHistoryBuffer, LocationThrottle, from_e7
+from scheduler import JobScheduler
+from chat_ring import ChatRingBuffer
+from db_pool import ConnectionPool
+from db_router import ReplicaRouter
+from counters import Counters
+from queries import QUERIES, ROLLUP_BUCKETS, QueryRunner
 
 # Initialize the Flask application
 app = Flask(__name__)
 CORS(app)
 
+# Multi-worker mode
+# Set SOCKETIO_MESSAGE_QUEUE (e.g. redis://localhost:6379/0, or any URL
+# Flask-SocketIO accepts: kombu amqp://, zmq+tcp://) to run several workers
+# behind a sticky-session proxy (see backend/run_workers.py and
+# deploy/nginx.conf). Emits from any worker then reach clients on all of
+# them. In-process caches that other workers can't invalidate are trusted
+# for WORKER_CACHE_TTL_S only, and the chat ring is off by default.
+SOCKETIO_MESSAGE_QUEUE = os.environ.get('SOCKETIO_MESSAGE_QUEUE') or None
+MULTI_WORKER = SOCKETIO_MESSAGE_QUEUE is not None
+WORKER_CACHE_TTL_S = float(os.environ.get('WORKER_CACHE_TTL_S', 5)) if MULTI_WORKER else None
+
 # Initialize SocketIO
-socketio = SocketIO(app, cors_allowed_origins="*")
+socketio = SocketIO(app, cors_allowed_origins="*", message_queue=SOCKETIO_MESSAGE_QUEUE)
 
 # Database connection
-def get_db_connection():
+def create_db_connection(host='localhost', port=3306):
     return pymysql.connect(
-        host='localhost',
+        host=host,
+        port=port,
         user='root',  # Replace with your MySQL username
         password='password',  # Replace with your MySQL password
         database='safety_db',
         cursorclass=pymysql.cursors.DictCursor  # Return results as dictionaries
     )
 
-# Calculate distance between two points
-def haversine(lat1, lng1, lat2, lng2):
-    # Earth radius in km
-    R = 6371.0
-    lat1, lng1, lat2, lng2 = map(math.radians, [lat1, lng1, lat2, lng2])
-    dlat = lat2 - lat1
-    dlng = lng2 - lng1
-    a = math.sin(dlat/2)**2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlng/2)**2
-    c = 2 * math.asin(math.sqrt(a))
-    return R * c
+# Connection pool
+# get_db_connection() checks a connection out of the pool; close() puts it
+# back. `with db_connection() as connection:` always returns it.
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 10))
+DB_POOL_TIMEOUT_S = float(os.environ.get('DB_POOL_TIMEOUT_S', 5))
+DB_POOL_MAX_AGE_S = float(os.environ.get('DB_POOL_MAX_AGE_S', 1800))
+DB_POOL_PING_AFTER_S = float(os.environ.get('DB_POOL_PING_AFTER_S', 30))
+db_pool = ConnectionPool(
+    create_db_connection,
+    max_size=DB_POOL_SIZE,
+    timeout_s=DB_POOL_TIMEOUT_S,
+    max_age_s=DB_POOL_MAX_AGE_S,
+    ping_after_s=DB_POOL_PING_AFTER_S,
+    sleep=socketio.sleep
+)
+atexit.register(db_pool.close_idle)
+
+def get_db_connection():
+    return db_pool.checkout()
+
+def db_connection():
+    return db_pool.connection()
+
+# Read replicas
+# Admin and dashboard GET endpoints read through get_read_connection(),
+# which uses a replica from DB_REPLICA_HOSTS ("host[:port],...", same
+# credentials as the primary) unless it is more than DB_REPLICA_MAX_LAG_S
+# behind or the admin just changed the tables it reads (see db_router.py).
+# Everything else, writes included, stays on the primary. Pointing
+# DB_REPLICA_HOSTS at the primary itself exercises the routing with one
+# MySQL instance.
+DB_REPLICA_HOSTS = [h.strip() for h in os.environ.get('DB_REPLICA_HOSTS', '').split(',') if h.strip()]
+DB_REPLICA_MAX_LAG_S = float(os.environ.get('DB_REPLICA_MAX_LAG_S', 5))
+DB_REPLICA_LAG_CHECK_S = float(os.environ.get('DB_REPLICA_LAG_CHECK_S', 2))
+
+def replica_pool(address):
+    host, _, port = address.partition(':')
+    return ConnectionPool(
+        lambda: create_db_connection(host, int(port or 3306)),
+        max_size=DB_POOL_SIZE,
+        timeout_s=DB_POOL_TIMEOUT_S,
+        max_age_s=DB_POOL_MAX_AGE_S,
+        ping_after_s=DB_POOL_PING_AFTER_S,
+        sleep=socketio.sleep
+    )
+
+db_router = ReplicaRouter(
+    db_pool,
+    [(address, replica_pool(address)) for address in DB_REPLICA_HOSTS],
+    max_lag_s=DB_REPLICA_MAX_LAG_S,
+    check_interval_s=DB_REPLICA_LAG_CHECK_S
+)
+for route in db_router.replicas:
+    atexit.register(route['pool'].close_idle)
+
+# tables: what the endpoint reads, so recent admin writes to them are seen
+def get_read_connection(*tables):
+    return db_router.checkout_read(tables)
+
+# In-use/idle connections and checkout wait times
+@app.route('/api/db/pool-stats', methods=['GET'])
+def get_db_pool_stats():
+    return jsonify(db_pool.stats())
+
+# Replica lag/health and how many reads went where
+@app.route('/api/db/replica-stats', methods=['GET'])
+def get_db_replica_stats():
+    return jsonify(db_router.stats())
+
+# Named queries (see queries.py): queries.run(cursor, 'alerts.active_count')
+# executes one and records its latency, rows and errors
+queries = QueryRunner(QUERIES)
+
+# Calls, rows, errors and latency per named query, slowest total first
+@app.route('/api/db/query-stats', methods=['GET'])
+def get_db_query_stats():
+    return jsonify(queries.stats())
+
+# Radius around an alert in which users get notified (km)
+PROXIMITY_RADIUS_KM = 2.0
+
+# Helper search per emergency type. With k set, the k nearest users are
+# notified, searching outward until k are found or max_radius_km is
+# reached. With k None, everyone within max_radius_km is notified.
+# A combined type ("fire, teased") runs each kind of search within its own
+# types' limits (see geo.combine_helper_searches).
+HELPER_SEARCH = {
+    'teased':    {'k': None, 'max_radius_km': PROXIMITY_RADIUS_KM},
+    'attacked':  {'k': 50, 'max_radius_km': 5.0},
+    'kidnapped': {'k': 100, 'max_radius_km': 10.0},
+    'fire':      {'k': 50, 'max_radius_km': 5.0},
+    'accident':  {'k': 30, 'max_radius_km': 5.0},
+    'other':     {'k': 30, 'max_radius_km': 5.0},
+}
+HELPER_SEARCH_DEFAULT = {'k': 50, 'max_radius_km': 5.0}
+
+def helper_search_for(emergency_type):
+    configs = [
+        HELPER_SEARCH[t.strip().lower()] for t in str(emergency_type).split(',')
+        if t.strip().lower() in HELPER_SEARCH
+    ] or [HELPER_SEARCH_DEFAULT]
+    return combine_helper_searches(configs)
+
+# Where proximity queries run:
+#   'grid'  - in-process location grid (single app instance)
+#   'mysql' - spatial index on users.location (several app instances,
+#             needs migrations/001_spatial_location.sql)
+# Each worker's grid only sees the pings that reach that worker, so
+# multi-worker mode defaults to 'mysql' and refuses 'grid' (except with the
+# single-process memory:// queue).
+PROXIMITY_BACKEND = os.environ.get('PROXIMITY_BACKEND', 'mysql' if MULTI_WORKER else 'grid')
+if PROXIMITY_BACKEND == 'grid' and MULTI_WORKER and not SOCKETIO_MESSAGE_QUEUE.startswith('memory://'):
+    raise RuntimeError('PROXIMITY_BACKEND=grid misses helpers with several workers, use PROXIMITY_BACKEND=mysql')
+
+# First radius of the MySQL nearest-helper search (km)
+KNN_START_RADIUS_KM = 0.5
+
+# Rows per multi-row INSERT when adding emergency chat members
+MEMBER_INSERT_CHUNK = 1000
+
+# Process-wide grid of user locations, loaded lazily from the users table
+# and kept up to date by /api/users/location
+user_location_grid = LocationGrid(cell_size_deg=0.02)
+
+def load_user_locations():
+    connection = get_db_connection()
+    try:
+        with connection.cursor() as cursor:
+            return queries.run(cursor, 'users.located').fetchall()
+    finally:
+        connection.close()
+
+# Users within radius_km using the spatial index: MBRContains on the
+# bounding box narrows the rows, ST_Distance_Sphere does the exact check
+def find_nearby_user_ids_mysql(cursor, lat, lng, radius_km, exclude_user_id=None):
+    queries.run(cursor, 'users.nearby', (bounding_box_wkt(lat, lng, radius_km), exclude_user_id or 0, lng, lat, radius_km * 1000))
+    return [row['id'] for row in cursor.fetchall()]
+
+# id, name, email, phone, status of the given users
+def fetch_user_profiles(cursor, user_ids):
+    user_ids = list(user_ids)
+    if not user_ids:
+        return []
+    placeholders = ', '.join(['%s'] * len(user_ids))
+    return queries.run(cursor, 'users.profiles', user_ids, placeholders=placeholders).fetchall()
+
+# The given ids (as given) that still belong to a user. Missing ones are
+# dropped from the proximity grid, where later pings may have put them back.
+def existing_user_ids(cursor, user_ids):
+    user_ids = set(user_ids)
+    if not user_ids:
+        return user_ids
+    placeholders = ', '.join(['%s'] * len(user_ids))
+    rows = queries.run(cursor, 'users.existing', [int(uid) for uid in user_ids], placeholders=placeholders).fetchall()
+    found = {row['id'] for row in rows}
+    for uid in user_ids:
+        if int(uid) not in found:
+            user_location_grid.remove(uid)
+    return {uid for uid in user_ids if int(uid) in found}
+
+def fetch_user_profiles_by_id(user_ids):
+    connection = get_db_connection()
+    try:
+        with connection.cursor() as cursor:
+            return fetch_user_profiles(cursor, user_ids)
+    finally:
+        connection.close()
+
+# Friends rows and profiles around one user, for the friend graph cache
+def load_friend_graph_entry(user_id):
+    connection = get_db_connection()
+    try:
+        with connection.cursor() as cursor:
+            friend_rows = queries.run(cursor, 'friends.of_user', (user_id, user_id)).fetchall()
+            ids = {user_id} | {row['user_id'] for row in friend_rows} | {row['friend_id'] for row in friend_rows}
+            return friend_rows, fetch_user_profiles(cursor, ids)
+    finally:
+        connection.close()
+
+# Process-wide cache of accepted/pending friendships, see friend_graph.py
+friend_graph = FriendGraph(load_friend_graph_entry, ttl_s=WORKER_CACHE_TTL_S)
+
+# k nearest users with the spatial index: the radius doubles from
+# KNN_START_RADIUS_KM until k users are found or max_radius_km is reached
+def find_nearest_user_ids_mysql(cursor, lat, lng, k, max_radius_km, exclude_user_id=None):
+    radius_km = min(KNN_START_RADIUS_KM, max_radius_km)
+    while True:
+        rows = queries.run(cursor, 'users.nearest', (
+            lng, lat, bounding_box_wkt(lat, lng, radius_km), exclude_user_id or 0, radius_km * 1000, k
+        )).fetchall()
+        if len(rows) >= k or radius_km >= max_radius_km:
+            return [row['id'] for row in rows]
+        radius_km = min(radius_km * 2, max_radius_km)
+
+# Ids of the k users nearest to a point within max_radius_km
+def find_nearest_user_ids(cursor, lat, lng, k, max_radius_km, exclude_user_id=None):
+    if PROXIMITY_BACKEND == 'mysql':
+        return find_nearest_user_ids_mysql(cursor, lat, lng, k, max_radius_km, exclude_user_id)
+    user_location_grid.ensure_loaded(load_user_locations)
+    return [uid for uid, _ in user_location_grid.nearest(lat, lng, k, max_radius_km, exclude=exclude_user_id)]
+
+# emergency_chats row by room_id or alert_id, for the room registry
+def load_room(room_id=None, alert_id=None):
+    connection = get_db_connection()
+    try:
+        with connection.cursor() as cursor:
+            if room_id is not None:
+                queries.run(cursor, 'rooms.by_room_id', (room_id,))
+            else:
+                queries.run(cursor, 'rooms.by_alert_id', (alert_id,))
+            return cursor.fetchone()
+    finally:
+        connection.close()
+
+# Process-wide registry of chat rooms (closed flag, victim, alert id)
+room_registry = RoomRegistry(load_room, ttl_s=WORKER_CACHE_TTL_S)
+
+# Ids of users within radius_km of a point, excluding one user
+def find_nearby_user_ids(cursor, lat, lng, radius_km, exclude_user_id=None):
+    if PROXIMITY_BACKEND == 'mysql':
+        return find_nearby_user_ids_mysql(cursor, lat, lng, radius_km, exclude_user_id)
+    user_location_grid.ensure_loaded(load_user_locations)
+    return user_location_grid.query_radius(lat, lng, radius_km, exclude=exclude_user_id)
 
 
 # Serve the main index.html
@@ -76,13 +326,13 @@ def signup():
         cursor = connection.cursor()
 
         # Check if email already exists
-        cursor.execute("SELECT * FROM users WHERE email = %s", (email,))
+        queries.run(cursor, 'users.by_email', (email,))
         if cursor.fetchone():
             return jsonify({'status': 'error', 'message': 'Email already registered'}), 400
 
-        query = "INSERT INTO users (name, email, password, phone) VALUES (%s, %s, %s, %s)"
-        cursor.execute(query, (name, email, hashed_password, phone))
+        queries.run(cursor, 'users.insert', (name, email, hashed_password, phone))
         connection.commit()
+        dashboard_counters.add(users=1)
 
         return jsonify({'status': 'success', 'message': 'User registered successfully!'}), 201
     except Exception as e:
@@ -105,8 +355,7 @@ def signin():
         connection = get_db_connection()
         with connection.cursor() as cursor:
             # Fetch user by email
-            sql = "SELECT id, name, email, password, role, phone FROM users WHERE email = %s"
-            cursor.execute(sql, (email,))
+            queries.run(cursor, 'users.credentials', (email,))
             user = cursor.fetchone()
 
             if user and check_password_hash(user['password'], password):
@@ -152,25 +401,21 @@ def update_profile():
         cursor = connection.cursor()
 
         # Verify current password
-        cursor.execute("SELECT password FROM users WHERE id = %s", (user_id,))
+        queries.run(cursor, 'users.password', (user_id,))
         user_row = cursor.fetchone()
         
         if not user_row or not check_password_hash(user_row['password'], current_password):
             return jsonify({'status': 'error', 'message': 'Current password is incorrect'}), 400
 
         # Check if new email is already taken by another user
-        cursor.execute("SELECT id FROM users WHERE email = %s AND id != %s", (new_email, user_id))
+        queries.run(cursor, 'users.email_taken', (new_email, user_id))
         if cursor.fetchone():
             return jsonify({'status': 'error', 'message': 'Email is already taken by another user'}), 400
 
         # Update user profile
-        query = """
-            UPDATE users 
-            SET name = %s, email = %s, phone = %s 
-            WHERE id = %s
-        """
-        cursor.execute(query, (new_name, new_email, new_phone, user_id))
+        queries.run(cursor, 'users.update_profile', (new_name, new_email, new_phone, user_id))
         connection.commit()
+        friend_graph.invalidate_profile(user_id)
 
         return jsonify({'status': 'success', 'message': 'Profile updated successfully!'})
         
@@ -207,8 +452,7 @@ def change_password():
         hashed_password = generate_password_hash(new_password)
 
         # Update user password
-        query = "UPDATE users SET password = %s WHERE id = %s"
-        cursor.execute(query, (hashed_password, user_id))
+        queries.run(cursor, 'users.update_password', (hashed_password, user_id))
         connection.commit()
 
         if cursor.rowcount == 0:
@@ -242,45 +486,83 @@ def emergency():
 
         if not emergency_type or not location:
             return jsonify({'status': 'error', 'message': 'Missing required fields'}), 400
+        coordinates = valid_location(location.get('lat'), location.get('lng')) if isinstance(location, dict) else None
+        if not coordinates:
+            return jsonify({'status': 'error', 'message': 'Invalid location'}), 400
+        location = {'lat': coordinates[0], 'lng': coordinates[1]}
+
+        idempotency_key = request.headers.get('Idempotency-Key') or data.get('idempotency_key')
+
+        # Caches whose loaders check out connections of their own are read
+        # before this request holds one: nested checkouts can exhaust the
+        # pool when many alerts come in at once.
+        # Victim name and accepted friends from the friend graph cache
+        victim = friend_graph.profile(user_id) if user_id else None
+        user_name = victim['name'] if victim else None
+        friend_user_ids = [str(uid) for uid in friend_graph.accepted_friends(user_id)] if user_id else []
+        if PROXIMITY_BACKEND == 'grid':
+            user_location_grid.ensure_loaded(load_user_locations)
+        else:
+            # The spatial search reads users.location: write this worker's
+            # buffered pings first so helpers' latest positions count
+            flush_user_locations()
+
+        # One submission at a time per user, so double taps can't race
+        submit_lock = alert_submit_lock(user_id)
+        submit_lock.acquire()
 
         connection = get_db_connection()
         cursor = connection.cursor()
-        query = """
-            INSERT INTO emergency_alerts (type, details, latitude, longitude, user_id)
-            VALUES (%s, %s, %s, %s, %s)
-        """
-        cursor.execute(query, (emergency_type, details, location['lat'], location['lng'], user_id))
-        connection.commit()
 
-        alert_id = cursor.lastrowid
+        # Retries and repeat submissions merge into the active alert
+        existing = find_coalescable_alert(cursor, user_id, idempotency_key)
+        if existing:
+            return jsonify({
+                'status': 'success',
+                'message': 'Alert already active',
+                'alert_id': existing['alert_id'],
+                'room_id': existing['room_id'],
+                'notified_count': existing.get('notified_count'),
+                'coalesced': True
+            })
 
-        # Fetch user name from users table
-        cursor.execute("SELECT name FROM users WHERE id = %s", (user_id,))
-        user_row = cursor.fetchone()
-        user_name = user_row['name'] if user_row else None
+        # Everything below runs in one transaction with a fixed number of
+        # round trips, however many people get notified.
 
-        # --- NEW: Notify only nearby users ---
-        # Get all users with location (except the victim)
-        cursor.execute("SELECT id, lat, lng FROM users WHERE id != %s AND lat IS NOT NULL AND lng IS NOT NULL", (user_id,))
-        users = cursor.fetchall()
-        nearby_user_ids = []
-        for user in users:
-            distance = haversine(location['lat'], location['lng'], user['lat'], user['lng'])
-            if distance <= 2.0:  # 2km radius
-                nearby_user_ids.append(str(user['id']))
-
-        # 2. Find friends of the victim
-        cursor.execute("""
-            SELECT friend_id AS friend_user_id FROM friends WHERE user_id = %s AND status = 'accepted'
-            UNION
-            SELECT user_id AS friend_user_id FROM friends WHERE friend_id = %s AND status = 'accepted'
-        """, (user_id, user_id))
-        friends = cursor.fetchall()
-        friend_user_ids = [str(row['friend_user_id']) for row in friends]
+        # 1. Victim name and accepted friends were read above
+
+        # 2. Notify only nearby users
+        # Only users around the alert are looked at (victim excluded)
+        nearby = find_helpers(
+            helper_search_for(emergency_type),
+            lambda radius_km: find_nearby_user_ids(cursor, location['lat'], location['lng'], radius_km, user_id),
+            lambda k, max_radius_km: find_nearest_user_ids(cursor, location['lat'], location['lng'], k, max_radius_km, user_id)
+        )
+        nearby_user_ids = [str(uid) for uid in nearby]
 
         # 3. Combine and deduplicate user IDs
         notify_user_ids = set(nearby_user_ids) | set(friend_user_ids)
         notify_user_ids.discard(str(user_id))  # Don't notify the victim
+        # Deleted users can linger in the grid and friend cache; their member
+        # rows would break the foreign key and roll back the whole alert
+        notify_user_ids = existing_user_ids(cursor, notify_user_ids)
+
+        # 4. Alert, chat room and members
+        queries.run(cursor, 'alerts.insert', (emergency_type, details, location['lat'], location['lng'], user_id))
+        alert_id = cursor.lastrowid
+
+        room_id = str(uuid.uuid4())
+        queries.run(cursor, 'rooms.insert', (alert_id, room_id, user_id))
+        # Add victim and all notified users to emergency_chat_members,
+        # executemany turns each chunk into one multi-row INSERT
+        members = [(room_id, uid) for uid in notify_user_ids | {str(user_id)}]
+        for i in range(0, len(members), MEMBER_INSERT_CHUNK):
+            queries.run_many(cursor, 'rooms.add_member', members[i:i + MEMBER_INSERT_CHUNK])
+        connection.commit()
+        dashboard_counters.add(active_alerts=1)
+        add_alert_rollup(emergency_type, created=1)
+        room_registry.add(room_id, alert_id, user_id)
+        chat_ring.open(room_id)
 
         alert_data = {
             'type': emergency_type,
@@ -290,7 +572,6 @@ def emergency():
             'user_name': user_name,
         }
 
-
         # Optionally, still emit to the victim (so they see their own alert)
         # socketio.emit('emergencyAlert', alert_data, room=str(user_id))
 
@@ -298,36 +579,179 @@ def emergency():
         socketio.emit('newAlert')
         socketio.emit('resolveAlert')
 
-        # New code: After alert is created and notifications are sent:
-        room_id = str(uuid.uuid4())
-        cursor.execute(
-            "INSERT INTO emergency_chats (alert_id, room_id, victim_id) VALUES (%s, %s, %s)",
-            (alert_id, room_id, user_id)
-        )
-        # Add victim and all notified users to emergency_chat_members
-        for uid in notify_user_ids | {str(user_id)}:
-            cursor.execute(
-                "INSERT INTO emergency_chat_members (room_id, user_id) VALUES (%s, %s)",
-                (room_id, uid)
-            )
-        connection.commit()
         # Include room_id in the notification payload
         alert_data['room_id'] = room_id
+        alert_data['alert_id'] = alert_id
         alert_data['notified_count'] = len(notify_user_ids)
-        # Emit to all relevant users with room_id
-        for uid in notify_user_ids | {str(user_id)}:
-            socketio.emit('emergencyAlert', alert_data, room=uid)
-
-        return jsonify({'status': 'success', 'message': 'Alert sent!'})
+        # Hand the emits to the fan-out worker, victim first
+        enqueue_alert_fanout(alert_id, alert_data, [str(user_id)] + sorted(notify_user_ids))
+        remember_alert(user_id, idempotency_key, alert_id, room_id, len(notify_user_ids))
+        if user_id:
+            # Start the victim's location trail at the alert position
+            set_alert_active(user_id, True)
+            location_history.add(user_id, time.time(), location['lat'], location['lng'])
+
+        return jsonify({
+            'status': 'success',
+            'message': 'Alert sent!',
+            'alert_id': alert_id,
+            'room_id': room_id,
+            'notified_count': len(notify_user_ids)
+        })
     except Exception as e:
         print(f"Error saving emergency data to database: {e}")
+        if 'connection' in locals():
+            connection.rollback()
         return jsonify({'status': 'error', 'message': 'Failed to send emergency alert.'}), 500
     finally:
         if 'cursor' in locals():
             cursor.close()
         if 'connection' in locals():
             connection.close()
-
+        if 'submit_lock' in locals():
+            submit_lock.release()
+
+
+# Alert coalescing
+# A repeat submission from the same user within ALERT_COALESCE_WINDOW_SECONDS
+# of an unresolved alert, or a retry with an Idempotency-Key already seen,
+# gets the existing alert back instead of a new insert and fan-out.
+ALERT_COALESCE_WINDOW_SECONDS = int(os.environ.get('ALERT_COALESCE_WINDOW_SECONDS', 120))
+# How long idempotency keys are remembered
+ALERT_IDEMPOTENCY_TTL_SECONDS = 24 * 60 * 60
+recent_alerts_by_user = {}  # user_id (str) -> alert entry
+recent_alerts_by_key = {}   # (user_id (str), idempotency key) -> alert entry
+recent_alerts_lock = threading.Lock()
+alert_submit_locks = [threading.Lock() for _ in range(64)]
+
+def alert_submit_lock(user_id):
+    return alert_submit_locks[hash(str(user_id)) % len(alert_submit_locks)]
+
+def remember_alert(user_id, idempotency_key, alert_id, room_id, notified_count):
+    entry = {'alert_id': alert_id, 'room_id': room_id, 'notified_count': notified_count, 'created': time.time()}
+    with recent_alerts_lock:
+        if user_id:
+            recent_alerts_by_user[str(user_id)] = entry
+        if idempotency_key:
+            recent_alerts_by_key[(str(user_id), idempotency_key)] = entry
+
+# Drop coalescing entries once their alert is resolved
+def forget_alerts(alert_ids):
+    alert_ids = set(alert_ids)
+    with recent_alerts_lock:
+        for entries in (recent_alerts_by_user, recent_alerts_by_key):
+            for key in [k for k, v in entries.items() if v['alert_id'] in alert_ids]:
+                del entries[key]
+
+def find_coalescable_alert(cursor, user_id, idempotency_key):
+    now = time.time()
+    with recent_alerts_lock:
+        for key in [k for k, v in recent_alerts_by_key.items() if now - v['created'] > ALERT_IDEMPOTENCY_TTL_SECONDS]:
+            del recent_alerts_by_key[key]
+        for key in [k for k, v in recent_alerts_by_user.items() if now - v['created'] > ALERT_COALESCE_WINDOW_SECONDS]:
+            del recent_alerts_by_user[key]
+        # Keys are only matched within the same user's submissions
+        if idempotency_key and (str(user_id), idempotency_key) in recent_alerts_by_key:
+            return recent_alerts_by_key[(str(user_id), idempotency_key)]
+        if user_id and str(user_id) in recent_alerts_by_user:
+            return recent_alerts_by_user[str(user_id)]
+    if not user_id or ALERT_COALESCE_WINDOW_SECONDS <= 0:
+        return None
+    # Not known to this process (restart, another instance): ask the database
+    return queries.run(cursor, 'alerts.coalescable', (user_id, ALERT_COALESCE_WINDOW_SECONDS)).fetchone()
+
+
+
+# Alert fan-out stage
+# emergency() persists the alert and room and returns; the per-recipient
+# emits happen on a background worker fed by this queue.
+alert_fanout_queue = queue.Queue()
+alert_fanout_status = OrderedDict()  # alert_id -> progress, oldest first
+alert_fanout_lock = threading.Lock()
+alert_fanout_worker_started = False
+# How many finished alerts keep their progress for the poll endpoint
+FANOUT_STATUS_KEEP = 1000
+# Send a progress event to the victim every N recipients
+FANOUT_PROGRESS_EVERY = 200
+
+# Socket.IO sessions of each connected user, maintained by connect/disconnect
+connected_user_sids = {}  # user_id (str) -> set of sids
+connected_user_sids_lock = threading.Lock()
+
+# Put all live sessions of a user into a room
+def enroll_user_in_room(user_id, room_id):
+    with connected_user_sids_lock:
+        sids = list(connected_user_sids.get(str(user_id), ()))
+    for sid in sids:
+        socketio.server.enter_room(sid, room_id, namespace='/')
+
+def enqueue_alert_fanout(alert_id, alert_data, recipients):
+    global alert_fanout_worker_started
+    with alert_fanout_lock:
+        alert_fanout_status[alert_id] = {
+            'alert_id': alert_id,
+            'room_id': alert_data.get('room_id'),
+            'total': len(recipients),
+            'enrolled': 0,   # recipients put in the alert room (single worker)
+            'notified': 0,   # recipients the alert has been sent to
+            'done': False
+        }
+        while len(alert_fanout_status) > FANOUT_STATUS_KEEP:
+            alert_fanout_status.popitem(last=False)
+        if not alert_fanout_worker_started:
+            socketio.start_background_task(alert_fanout_worker)
+            alert_fanout_worker_started = True
+    alert_fanout_queue.put((alert_id, alert_data, recipients))
+
+def emit_fanout_progress(status, victim_room):
+    socketio.emit('alertFanoutProgress', dict(status), room=victim_room)
+
+def alert_fanout_worker():
+    while True:
+        # Non-blocking get + socketio.sleep so this also cooperates under eventlet
+        try:
+            alert_id, alert_data, recipients = alert_fanout_queue.get_nowait()
+        except queue.Empty:
+            socketio.sleep(0.05)
+            continue
+        status = alert_fanout_status.get(alert_id, {})
+        victim_room = recipients[0]
+        room_id = alert_data['room_id']
+        try:
+            if MULTI_WORKER:
+                # Sessions live on other workers too: send to the
+                # recipients' own rooms, one queue message per chunk
+                for start in range(0, len(recipients), FANOUT_PROGRESS_EVERY):
+                    chunk = recipients[start:start + FANOUT_PROGRESS_EVERY]
+                    socketio.emit('emergencyAlert', alert_data, to=chunk)
+                    status['enrolled'] = status['notified'] = start + len(chunk)
+                    emit_fanout_progress(status, victim_room)
+                    socketio.sleep(0)
+                continue
+            # Enroll every connected recipient's sessions in the alert room,
+            # then send the alert once as a room broadcast; nobody has been
+            # notified until that emit has gone out
+            for count, uid in enumerate(recipients, 1):
+                enroll_user_in_room(uid, room_id)
+                status['enrolled'] = count
+                if count % FANOUT_PROGRESS_EVERY == 0:
+                    emit_fanout_progress(status, victim_room)
+                    socketio.sleep(0)  # let request handlers run
+            socketio.emit('emergencyAlert', alert_data, room=room_id)
+            status['notified'] = len(recipients)
+        except Exception as e:
+            print(f"Error fanning out alert {alert_id}: {e}")
+        finally:
+            status['done'] = True
+            emit_fanout_progress(status, victim_room)
+
+# Poll endpoint for fan-out progress of an alert
+@app.route('/api/alerts/<int:alert_id>/fanout', methods=['GET'])
+def get_alert_fanout_status(alert_id):
+    status = alert_fanout_status.get(alert_id)
+    if not status:
+        return jsonify({'status': 'error', 'message': 'No fan-out found for this alert'}), 404
+    return jsonify(dict(status))
 
 
 # Mark Safe Button Functionality
@@ -340,49 +764,57 @@ def mark_safe():
         if not user_id:
             return jsonify({'status': 'error', 'message': 'Missing user ID'}), 400
 
+        # Queued chat messages go in before the system messages (flushed
+        # before taking a connection, the flush checks out its own)
+        flush_chat_messages()
+
         connection = get_db_connection()
         cursor = connection.cursor()
         
         # Get active emergency rooms for this user before resolving
-        cursor.execute("""
-            SELECT ec.room_id, ea.id as alert_id
-            FROM emergency_chats ec 
-            JOIN emergency_alerts ea ON ec.alert_id = ea.id 
-            WHERE ea.user_id = %s AND ea.resolved = 0
-        """, (user_id,))
-        active_rooms = cursor.fetchall()
+        active_rooms = queries.run(cursor, 'alerts.open_rooms_of', (user_id,)).fetchall()
         
         # Update alerts as resolved
-        query = """
-            UPDATE emergency_alerts
-            SET resolved = 1
-            WHERE user_id = %s AND resolved = 0
-        """
-        cursor.execute(query, (user_id,))
+        resolved = queries.run(cursor, 'alerts.resolve_all_of', (user_id,)).rowcount
         connection.commit()
+        dashboard_counters.add(active_alerts=-resolved, resolved_alerts=resolved)
+        for room in active_rooms:
+            add_alert_rollup(room['type'], resolved=1)
+        forget_alerts([room['alert_id'] for room in active_rooms])
+        # close_chat_on_alert_resolved has closed their chats in the database
+        room_registry.mark_closed(room_ids=[room['room_id'] for room in active_rooms])
+        set_alert_active(user_id, False)
 
         # Send automated message to each active room
+        safe_message = f'The victim has marked themselves as safe. Thank you for your assistance! 🙏\nThis room will be closed in {ROOM_CLOSE_DELAY_S} seconds.'
+        system_messages = []
         for room in active_rooms:
             room_id = room['room_id']
             
             # Insert automated message
-            cursor.execute("""
-                INSERT INTO emergency_chat_messages (room_id, user_id, message)
-                VALUES (%s, %s, %s)
-            """, (room_id, None, 'The victim has marked themselves as safe. Thank you for your assistance! 🙏\nThis room will be closed in 30 seconds.'))
+            queries.run(cursor, 'chat.insert_system', (room_id, None, safe_message))
+            system_messages.append((room_id, chat_ring_message(cursor.lastrowid, None, safe_message)))
             
             # Emit message to all room members
             socketio.emit('emergencyChatMessage', {
                 'room_id': room_id,
                 'user_id': None,
                 'user_name': 'System',
-                'message': 'The victim has marked themselves as safe. Thank you for your assistance! 🙏\nThis room will be closed in 30 seconds.'
+                'message': safe_message
             }, room=room_id)
-            
-            # Start a timer to close the room after 30 seconds
-            threading.Thread(target=close_emergency_room_after_delay, args=(room_id,)).start()
 
         connection.commit()
+        # Give the connection back before scheduling, which saves the jobs
+        # on a connection of its own
+        cursor.close()
+        connection.close()
+        for room_id, message in system_messages:
+            chat_ring.append(room_id, [message])
+
+        # Close the rooms after ROOM_CLOSE_DELAY_S on the job scheduler
+        job_scheduler.schedule_many('close_emergency_room', ROOM_CLOSE_DELAY_S, [
+            (room['room_id'], {'room_id': room['room_id']}) for room in active_rooms
+        ])
 
         # Emit resolveAlert event
         socketio.emit('resolveAlert')
@@ -397,21 +829,24 @@ def mark_safe():
         if 'connection' in locals():
             connection.close()
 
-# Function to close emergency room after a delay
-def close_emergency_room_after_delay(room_id):
-    time.sleep(30)
+# Seconds between a victim marking safe and their rooms closing
+ROOM_CLOSE_DELAY_S = 30
+
+# Close an emergency room (run by the job scheduler after ROOM_CLOSE_DELAY_S)
+def close_emergency_room(room_id):
+    flush_chat_messages()
     try:
         connection = get_db_connection()
         cursor = connection.cursor()
         # Mark the room as closed
-        cursor.execute("UPDATE emergency_chats SET closed = 1 WHERE room_id = %s", (room_id,))
+        queries.run(cursor, 'rooms.close', (room_id,))
         connection.commit()
+        room_registry.mark_closed(room_ids=[room_id])
         # Insert system message into chat history
-        cursor.execute(
-            "INSERT INTO emergency_chat_messages (room_id, user_id, message) VALUES (%s, %s, %s)",
-            (room_id, None, 'This emergency chat has been closed.')
-        )
+        queries.run(cursor, 'chat.insert_system', (room_id, None, 'This emergency chat has been closed.'))
         connection.commit()
+        # Closed rooms are read rarely; their history comes from the database
+        chat_ring.drop(room_id)
         # Notify all room members
         socketio.emit('emergencyRoomClosed', {'room_id': room_id}, room=room_id)
         # Also emit the system message to the chat
@@ -430,6 +865,195 @@ def close_emergency_room_after_delay(room_id):
             connection.close()
 
 
+# Location write-behind
+# Location pings are buffered (latest per user) and written as one batched
+# UPDATE every LOCATION_FLUSH_INTERVAL_MS or once LOCATION_FLUSH_MAX_ENTRIES
+# users are pending. The grid sees new positions immediately; with
+# PROXIMITY_BACKEND=mysql emergency() flushes before searching, so only
+# pings still buffered on other workers lag (by at most one flush interval).
+LOCATION_FLUSH_INTERVAL_MS = int(os.environ.get('LOCATION_FLUSH_INTERVAL_MS', 2000))
+LOCATION_FLUSH_MAX_ENTRIES = int(os.environ.get('LOCATION_FLUSH_MAX_ENTRIES', 500))
+
+# Errors caused by the row itself (bad value, missing foreign key, NULL or
+# duplicate key): retrying the same row can't succeed, so it is dropped.
+# Anything else (missing table or column, lost connection, lock timeout)
+# leaves the batch buffered for the next flush.
+ROW_INTEGRITY_ERRORS = {
+    1048,  # column cannot be null
+    1062,  # duplicate entry
+    1452,  # foreign key: parent row missing
+}
+
+def is_row_error(e):
+    if isinstance(e, pymysql.err.DataError):
+        return True
+    return isinstance(e, pymysql.err.IntegrityError) and bool(e.args) and e.args[0] in ROW_INTEGRITY_ERRORS
+
+def update_user_locations(cursor, rows):
+    values = ' UNION ALL '.join(['SELECT %s AS id, %s AS lat, %s AS lng'] * len(rows))
+    params = [value for row in rows for value in row]
+    queries.run(cursor, 'users.update_locations', params, values=values)
+
+def write_user_locations(rows):
+    connection = get_db_connection()
+    try:
+        with connection.cursor() as cursor:
+            try:
+                update_user_locations(cursor, rows)
+            except pymysql.MySQLError as e:
+                if not is_row_error(e):
+                    raise
+                # One bad row must not hold back everyone's positions (the
+                # buffer would put the batch back on every flush): write
+                # them one by one and drop the ones that fail
+                for row in rows:
+                    try:
+                        update_user_locations(cursor, [row])
+                    except pymysql.MySQLError as row_error:
+                        if not is_row_error(row_error):
+                            raise
+                        print(f"Dropping location of user {row[0]}: {row_error}")
+        connection.commit()
+    finally:
+        connection.close()
+
+location_buffer = LocationWriteBuffer(write_user_locations, max_entries=LOCATION_FLUSH_MAX_ENTRIES)
+location_flusher_started = False
+location_flusher_lock = threading.Lock()
+
+# Location history
+# While a user has an unresolved alert every accepted position is also
+# appended to user_location_history, flushed with the location buffer.
+# Old points are downsampled per LOCATION_HISTORY_TIERS:
+# (older than seconds, keep one point per seconds).
+LOCATION_HISTORY_TIERS = [(60 * 60, 60), (24 * 60 * 60, 10 * 60)]
+LOCATION_HISTORY_RETENTION_S = 30 * 24 * 60 * 60
+LOCATION_HISTORY_COMPACT_INTERVAL_S = 10 * 60
+
+def write_location_history(rows):
+    connection = get_db_connection()
+    try:
+        with connection.cursor() as cursor:
+            queries.run_many(cursor, 'location_history.insert', rows)
+        connection.commit()
+    finally:
+        connection.close()
+
+location_history = LocationHistoryBuffer(write_location_history)
+
+# Users with an unresolved alert, loaded lazily and kept up to date by
+# emergency(), mark_safe() and resolve_alert()
+active_alert_users = set()
+active_alert_users_loaded = False
+active_alert_users_lock = threading.Lock()
+
+def has_active_alert(user_id):
+    global active_alert_users_loaded
+    if not active_alert_users_loaded:
+        with active_alert_users_lock:
+            if not active_alert_users_loaded:
+                connection = get_db_connection()
+                try:
+                    with connection.cursor() as cursor:
+                        rows = queries.run(cursor, 'alerts.active_users').fetchall()
+                        active_alert_users.update(row['user_id'] for row in rows)
+                finally:
+                    connection.close()
+                active_alert_users_loaded = True
+    return int(user_id) in active_alert_users
+
+# Reload the set; alerts raised or resolved on other workers only show up this way
+def refresh_active_alert_users():
+    global active_alert_users_loaded
+    connection = get_db_connection()
+    try:
+        with connection.cursor() as cursor:
+            user_ids = {row['user_id'] for row in queries.run(cursor, 'alerts.active_users').fetchall()}
+    finally:
+        connection.close()
+    with active_alert_users_lock:
+        active_alert_users.clear()
+        active_alert_users.update(user_ids)
+        active_alert_users_loaded = True
+
+def set_alert_active(user_id, active):
+    with active_alert_users_lock:
+        if active:
+            active_alert_users.add(int(user_id))
+        else:
+            active_alert_users.discard(int(user_id))
+
+# Downsample old history points and drop expired ones
+def compact_location_history(now=None):
+    now = int(now or time.time())
+    connection = get_db_connection()
+    try:
+        with connection.cursor() as cursor:
+            deleted = queries.run(cursor, 'location_history.expire', (now - LOCATION_HISTORY_RETENTION_S,)).rowcount
+            for older_than, bucket in LOCATION_HISTORY_TIERS:
+                cutoff = now - older_than
+                deleted += queries.run(cursor, 'location_history.downsample', (bucket, cutoff, bucket, cutoff)).rowcount
+        connection.commit()
+        return deleted
+    finally:
+        connection.close()
+
+def flush_user_locations():
+    try:
+        location_buffer.flush()
+    except Exception as e:
+        print('Error flushing user locations:', e)
+    try:
+        location_history.flush()
+    except Exception as e:
+        print('Error flushing location history:', e)
+
+def location_flusher():
+    while True:
+        socketio.sleep(LOCATION_FLUSH_INTERVAL_MS / 1000.0)
+        flush_user_locations()
+
+def start_location_flusher():
+    global location_flusher_started
+    with location_flusher_lock:
+        if not location_flusher_started:
+            socketio.start_background_task(location_flusher)
+            location_flusher_started = True
+
+# Nothing accepted is lost on a clean shutdown
+atexit.register(flush_user_locations)
+
+# (lat, lng) as floats, or None when they aren't numbers in range
+def valid_location(lat, lng):
+    try:
+        lat, lng = float(lat), float(lng)
+    except (TypeError, ValueError):
+        return None
+    # NaN fails both comparisons
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        return None
+    return lat, lng
+
+def valid_user_id(user_id):
+    try:
+        return int(user_id) > 0
+    except (TypeError, ValueError):
+        return False
+
+# Take a new position into the grid and the write-behind buffer
+# (callers check valid_location() and valid_user_id() first)
+def accept_user_location(user_id, lat, lng):
+    start_location_flusher()
+    # Keep the proximity grid in sync (loaded first so the fresh value
+    # isn't overwritten by the initial load)
+    if PROXIMITY_BACKEND == 'grid':
+        user_location_grid.ensure_loaded(load_user_locations)
+        user_location_grid.update(user_id, lat, lng)
+    if has_active_alert(user_id):
+        location_history.add(user_id, time.time(), lat, lng)
+    if location_buffer.add(user_id, lat, lng):
+        flush_user_locations()
+
 # Update User location on DB Endpoint
 @app.route('/api/users/location', methods=['POST'])
 def update_user_location():
@@ -439,19 +1063,77 @@ def update_user_location():
     lng = data.get('lng')
     if not user_id or lat is None or lng is None:
         return jsonify({'status': 'error', 'message': 'Missing user_id or location'}), 400
+    coordinates = valid_location(lat, lng)
+    if not valid_user_id(user_id) or not coordinates:
+        return jsonify({'status': 'error', 'message': 'Invalid user_id or location'}), 400
     try:
-        connection = get_db_connection()
-        cursor = connection.cursor()
-        cursor.execute("UPDATE users SET lat=%s, lng=%s WHERE id=%s", (lat, lng, user_id))
-        connection.commit()
+        accept_user_location(user_id, *coordinates)
         return jsonify({'status': 'success'})
     except Exception as e:
         print('Error updating user location:', e)
         return jsonify({'status': 'error', 'message': 'Failed to update location'}), 500
+
+# Trail of a user's positions over the last ?minutes= (default 10)
+@app.route('/api/users/<int:user_id>/location-history', methods=['GET'])
+def get_location_history(user_id):
+    minutes = request.args.get('minutes', 10, type=int)
+    try:
+        # Points still in the buffer first, so the trail is up to date
+        location_history.flush()
+        connection = get_db_connection()
+        cursor = connection.cursor()
+        queries.run(cursor, 'location_history.trail', (user_id, int(time.time()) - minutes * 60))
+        points = [
+            {'ts': row['ts'], 'lat': from_e7(row['lat_e7']), 'lng': from_e7(row['lng_e7'])}
+            for row in cursor.fetchall()
+        ]
+        return jsonify(points)
+    except Exception as e:
+        print('Error fetching location history:', e)
+        return jsonify({'status': 'error', 'message': 'Failed to fetch location history'}), 500
     finally:
         if 'cursor' in locals(): cursor.close()
         if 'connection' in locals(): connection.close()
 
+# Location streaming over Socket.IO
+# Clients emit locationUpdate {lat, lng} on their connection; updates that
+# come too soon or barely moved are dropped before touching the buffer.
+LOCATION_STREAM_MIN_MOVE_M = float(os.environ.get('LOCATION_STREAM_MIN_MOVE_M', 25))
+LOCATION_STREAM_MIN_INTERVAL_S = float(os.environ.get('LOCATION_STREAM_MIN_INTERVAL_S', 5))
+location_throttle = LocationThrottle(
+    haversine,
+    min_move_m=LOCATION_STREAM_MIN_MOVE_M,
+    min_interval_s=LOCATION_STREAM_MIN_INTERVAL_S
+)
+
+@socketio.on('locationUpdate')
+def handle_location_update(data):
+    # The user is the one who opened the connection, not whoever the payload names
+    user_id = request.args.get('user_id')
+    lat = data.get('lat') if data else None
+    lng = data.get('lng') if data else None
+    if not user_id or lat is None or lng is None:
+        return {'status': 'error', 'message': 'Missing user_id or location'}
+    coordinates = valid_location(lat, lng)
+    if not valid_user_id(user_id) or not coordinates:
+        return {'status': 'error', 'message': 'Invalid user_id or location'}
+    try:
+        outcome = location_throttle.check(user_id, *coordinates, time.time())
+        if outcome != 'accepted':
+            return {'status': 'dropped', 'reason': outcome}
+        accept_user_location(user_id, *coordinates)
+        return {'status': 'accepted'}
+    except Exception as e:
+        print('Error handling streamed location:', e)
+        return {'status': 'error', 'message': 'Failed to update location'}
+
+# Accepted/dropped counts and rates of the location stream
+@app.route('/api/users/location/stream-stats', methods=['GET'])
+def get_location_stream_stats():
+    stats = location_throttle.stats(time.time())
+    stats['buffered'] = len(location_buffer)
+    return jsonify(stats)
+
 # emergency end
 
 
@@ -469,16 +1151,16 @@ def join_emergency_room(data):
 # Send/Receive Group Messages
 @socketio.on('emergencyChatMessage')
 def handle_emergency_chat_message(data):
-    room_id = data['room_id']
-    user_id = data['user_id']
-    message = data['message']
-
-    # Check if the room is closed
-    connection = get_db_connection()
-    cursor = connection.cursor()
-    cursor.execute("SELECT closed FROM emergency_chats WHERE room_id = %s", (room_id,))
-    result = cursor.fetchone()
-    if result and result.get('closed'):
+    room_id = data.get('room_id') if data else None
+    user_id = data.get('user_id') if data else None
+    message = data.get('message') if data else None
+    # Rejected here, a bad row would otherwise be dropped at flush time
+    if not isinstance(room_id, str) or not valid_user_id(user_id) or not valid_chat_message(message):
+        return {'status': 'error', 'message': 'Invalid room_id, user_id or message'}
+
+    # Check if the room is closed (from the room registry)
+    room = room_registry.get(room_id)
+    if room and room['closed']:
         # Optionally, emit a warning to the sender
         emit('emergencyChatMessage', {
             'room_id': room_id,
@@ -486,36 +1168,253 @@ def handle_emergency_chat_message(data):
             'user_name': 'System',
             'message': 'This emergency chat has been closed. You cannot send messages.'
         }, room=request.sid)
-        cursor.close()
-        connection.close()
         return
 
-    # Save to DB
-    cursor.execute(
-        "INSERT INTO emergency_chat_messages (room_id, user_id, message) VALUES (%s, %s, %s)",
-        (room_id, user_id, message)
-    )
-    cursor.connection.commit()
-    # Broadcast to room
+    if CHAT_DURABILITY == 'sync':
+        # Save to DB, then broadcast
+        write_chat_messages([(room_id, user_id, message, int(time.time()))])
+        socketio.emit('emergencyChatMessage', data, room=room_id)
+        return
+
+    # Broadcast to room right away, the message is saved with the next batch
     socketio.emit('emergencyChatMessage', data, room=room_id)
-    cursor.close()
-    connection.close()
+    start_chat_flusher()
+    if chat_message_buffer.add((room_id, user_id, message, int(time.time()))):
+        flush_chat_messages()
+
+
+# Chat message group commit
+# With CHAT_DURABILITY='batched' messages are broadcast immediately and
+# written in one transaction + commit every CHAT_FLUSH_INTERVAL_MS
+# (or once CHAT_FLUSH_MAX_MESSAGES are queued); a crash can lose at most
+# that window. 'sync' writes and commits each message before broadcasting.
+CHAT_DURABILITY = os.environ.get('CHAT_DURABILITY', 'batched')
+CHAT_FLUSH_INTERVAL_MS = int(os.environ.get('CHAT_FLUSH_INTERVAL_MS', 200))
+CHAT_FLUSH_MAX_MESSAGES = int(os.environ.get('CHAT_FLUSH_MAX_MESSAGES', 200))
+# emergency_chat_messages.message is a TEXT column
+CHAT_MESSAGE_MAX_BYTES = 65535
+
+def valid_chat_message(message):
+    return isinstance(message, str) and message.strip() != '' and len(message.encode('utf-8')) <= CHAT_MESSAGE_MAX_BYTES
+
+# rows are (room_id, user_id, message, sent_at unix seconds).
+# Rows are inserted one by one (for their ids, which the chat ring needs)
+# inside a single transaction, so a batch still costs one commit.
+def write_chat_messages(rows):
+    written = []
+    connection = get_db_connection()
+    try:
+        with connection.cursor() as cursor:
+            for row in rows:
+                try:
+                    queries.run(cursor, 'chat.insert', row)
+                    written.append((row, cursor.lastrowid))
+                except pymysql.MySQLError as e:
+                    # One bad row (deleted user, value too long, ...) must
+                    # not hold back the rest; the buffer would retry the
+                    # whole batch on every flush
+                    if not is_row_error(e):
+                        raise
+                    print(f"Dropping chat message for room {row[0]}: {e}")
+        connection.commit()
+    finally:
+        connection.close()
+    by_room = {}
+    for (room_id, user_id, message, sent_at), message_id in written:
+        by_room.setdefault(room_id, []).append(
+            chat_ring_message(message_id, user_id, message, datetime.fromtimestamp(sent_at))
+        )
+    for room_id, messages in by_room.items():
+        chat_ring.append(room_id, messages)
+
+chat_message_buffer = AppendBuffer(write_chat_messages, max_entries=CHAT_FLUSH_MAX_MESSAGES)
+
+# Recent messages per open room, so joining helpers' history requests
+# don't hit the database. CHAT_RING_SIZE messages per room,
+# CHAT_RING_MAX_MESSAGES across all rooms (least recently used rooms go first).
+# Other workers' messages never reach this process's rings, so they are
+# off in multi-worker mode.
+CHAT_RING_SIZE = int(os.environ.get('CHAT_RING_SIZE', 0 if MULTI_WORKER else 200))
+CHAT_RING_MAX_MESSAGES = int(os.environ.get('CHAT_RING_MAX_MESSAGES', 100000))
+chat_ring = ChatRingBuffer(per_room=CHAT_RING_SIZE, max_messages=CHAT_RING_MAX_MESSAGES)
+
+# A message as returned by the history endpoint
+def chat_ring_message(message_id, user_id, message, sent_at=None):
+    return {
+        'id': message_id,
+        'user_id': user_id,
+        'message': message,
+        'sent_at': sent_at or datetime.now().replace(microsecond=0)
+    }
+chat_flusher_started = False
+chat_flusher_lock = threading.Lock()
+
+def flush_chat_messages():
+    try:
+        chat_message_buffer.flush()
+    except Exception as e:
+        print('Error flushing chat messages:', e)
+
+def chat_flusher():
+    while True:
+        socketio.sleep(CHAT_FLUSH_INTERVAL_MS / 1000.0)
+        flush_chat_messages()
+
+def start_chat_flusher():
+    global chat_flusher_started
+    with chat_flusher_lock:
+        if not chat_flusher_started:
+            socketio.start_background_task(chat_flusher)
+            chat_flusher_started = True
+
+atexit.register(flush_chat_messages)
+
+
+# Delayed jobs
+# Room closures and other timed work go through one scheduler (a deadline
+# heap plus JOB_SCHEDULER_WORKERS workers) instead of a sleeping thread per
+# job. One-shot jobs are kept in scheduled_jobs and picked up again after a
+# restart; overdue ones run as soon as the scheduler starts.
+JOB_SCHEDULER_WORKERS = int(os.environ.get('JOB_SCHEDULER_WORKERS', 4))
+
+def save_scheduled_jobs(rows):
+    connection = get_db_connection()
+    try:
+        with connection.cursor() as cursor:
+            queries.run_many(cursor, 'jobs.save', [
+                (name, key or '', json.dumps(payload), run_at) for name, key, payload, run_at in rows
+            ])
+        connection.commit()
+    finally:
+        connection.close()
+
+def delete_scheduled_job(name, key):
+    connection = get_db_connection()
+    try:
+        with connection.cursor() as cursor:
+            queries.run(cursor, 'jobs.delete', (name, key or ''))
+        connection.commit()
+    finally:
+        connection.close()
+
+def claim_scheduled_job(name, key, run_at):
+    connection = get_db_connection()
+    try:
+        with connection.cursor() as cursor:
+            claimed = queries.run(cursor, 'jobs.claim', (name, key or '', run_at)).rowcount == 1
+        connection.commit()
+        return claimed
+    finally:
+        connection.close()
+
+def load_scheduled_jobs():
+    connection = get_db_connection()
+    try:
+        with connection.cursor() as cursor:
+            queries.run(cursor, 'jobs.pending')
+            return [
+                {'name': row['job_name'], 'key': row['job_key'] or None, 'payload': json.loads(row['payload']), 'run_at': row['run_at']}
+                for row in cursor.fetchall()
+            ]
+    finally:
+        connection.close()
+
+job_scheduler = JobScheduler(
+    socketio.start_background_task, socketio.sleep,
+    save=save_scheduled_jobs, delete=delete_scheduled_job, load=load_scheduled_jobs, claim=claim_scheduled_job,
+    workers=JOB_SCHEDULER_WORKERS
+)
+job_scheduler.register('close_emergency_room', close_emergency_room)
+job_scheduler.register('compact_location_history', compact_location_history)
+job_scheduler.register('refresh_active_alert_users', refresh_active_alert_users)
+
+def start_job_scheduler():
+    if job_scheduler.started:
+        return
+    try:
+        job_scheduler.start()
+        job_scheduler.every('compact_location_history', LOCATION_HISTORY_COMPACT_INTERVAL_S)
+        job_scheduler.every('reconcile_dashboard_counters', DASHBOARD_RECONCILE_S)
+        job_scheduler.every('flush_alert_rollups', ALERT_ROLLUP_FLUSH_S)
+        job_scheduler.every('repair_alert_rollups', ALERT_ROLLUP_REPAIR_S)
+        if MULTI_WORKER:
+            job_scheduler.every('refresh_active_alert_users', WORKER_CACHE_TTL_S)
+    except Exception as e:
+        print('Error starting job scheduler:', e)
+
+# Started with the first request so persisted jobs are resumed after a restart
+@app.before_request
+def ensure_job_scheduler():
+    start_job_scheduler()
+
+# Pending and executed job counts
+@app.route('/api/jobs/stats', methods=['GET'])
+def get_job_stats():
+    return jsonify(job_scheduler.stats())
 
 
 
 # Fetch Message History
+# Keyset paging on the auto-increment id (idx_room_id is (room_id, id) in
+# InnoDB since secondary indexes carry the primary key):
+#   ?after_id=N   messages after N, oldest first (catch-up after reconnect)
+#   ?before_id=N  the `limit` messages before N (older pages)
+#   neither       the newest `limit` messages
+# Results are always returned oldest first and carry an ETag.
+CHAT_HISTORY_DEFAULT_LIMIT = 200
+CHAT_HISTORY_MAX_LIMIT = 1000
+
+# Messages never change once written, so the ids pin the response
+def chat_history_response(room_id, after_id, before_id, limit, messages):
+    first_id = messages[0]['id'] if messages else 0
+    last_id = messages[-1]['id'] if messages else 0
+    response = jsonify(messages)
+    response.set_etag(f"{room_id}:{after_id}:{before_id}:{limit}:{first_id}:{last_id}:{len(messages)}")
+    return response.make_conditional(request)
+
 @app.route('/api/emergency-chat/messages')
 def get_emergency_chat_messages():
     room_id = request.args.get('room_id')
-    cursor = get_db_connection().cursor()
-    cursor.execute(
-        "SELECT user_id, message, sent_at FROM emergency_chat_messages WHERE room_id = %s ORDER BY sent_at ASC",
-        (room_id,)
-    )
-    return jsonify(cursor.fetchall())
+    after_id = request.args.get('after_id', type=int)
+    before_id = request.args.get('before_id', type=int)
+    limit = min(max(request.args.get('limit', CHAT_HISTORY_DEFAULT_LIMIT, type=int), 1), CHAT_HISTORY_MAX_LIMIT)
+    if not room_id:
+        return jsonify({'status': 'error', 'message': 'Missing room_id'}), 400
+    try:
+        # Queued messages first, so the history is complete
+        flush_chat_messages()
+        messages = chat_ring.query(room_id, limit, after_id=after_id, before_id=before_id)
+        if messages is not None:
+            return chat_history_response(room_id, after_id, before_id, limit, messages)
+
+        # Not in the ring: a newest-page read of an open room seeds it
+        room = room_registry.get(room_id) if after_id is None and before_id is None else None
+        seeding = bool(room and not room['closed']) and chat_ring.seed_start(room_id)
+        connection = get_db_connection()
+        cursor = connection.cursor()
+        if after_id is not None:
+            messages = queries.run(cursor, 'chat.after', (room_id, after_id, limit)).fetchall()
+        else:
+            if before_id is not None:
+                queries.run(cursor, 'chat.before', (room_id, before_id, limit))
+            else:
+                queries.run(cursor, 'chat.newest', (room_id, limit))
+            messages = list(reversed(cursor.fetchall()))
+            if seeding:
+                chat_ring.seed_done(room_id, messages, limit)
+                seeding = False
+
+        return chat_history_response(room_id, after_id, before_id, limit, messages)
+    except Exception as e:
+        print('Error fetching emergency chat messages:', e)
+        if locals().get('seeding'):
+            chat_ring.seed_failed(room_id)
+        return jsonify({'status': 'error', 'message': 'Failed to fetch messages'}), 500
+    finally:
+        if 'cursor' in locals(): cursor.close()
+        if 'connection' in locals(): connection.close()
 
 
-        
 
 
 # friends start
@@ -531,12 +1430,13 @@ def send_friend_request():
         connection = get_db_connection()
         cursor = connection.cursor()
         # Check if already friends or pending
-        cursor.execute("SELECT * FROM friends WHERE user_id=%s AND friend_id=%s", (user_id, friend_id))
+        queries.run(cursor, 'friends.row', (user_id, friend_id))
         if cursor.fetchone():
             return jsonify({'status': 'error', 'message': 'Request already exists or already friends'}), 400
         # Insert request (pending)
-        cursor.execute("INSERT INTO friends (user_id, friend_id, status) VALUES (%s, %s, 'pending')", (user_id, friend_id))
+        queries.run(cursor, 'friends.request', (user_id, friend_id))
         connection.commit()
+        friend_graph.invalidate(user_id, friend_id)
         return jsonify({'status': 'success', 'message': 'Friend request sent'})
     except Exception as e:
         print('Error sending friend request:', e)
@@ -557,10 +1457,11 @@ def accept_friend_request():
         connection = get_db_connection()
         cursor = connection.cursor()
         # Update the request to accepted
-        cursor.execute("UPDATE friends SET status='accepted' WHERE user_id=%s AND friend_id=%s AND status='pending'", (friend_id, user_id))
+        queries.run(cursor, 'friends.accept', (friend_id, user_id))
         # Add reciprocal friendship
-        cursor.execute("INSERT IGNORE INTO friends (user_id, friend_id, status) VALUES (%s, %s, 'accepted')", (user_id, friend_id))
+        queries.run(cursor, 'friends.add_accepted', (user_id, friend_id))
         connection.commit()
+        friend_graph.invalidate(user_id, friend_id)
         return jsonify({'status': 'success', 'message': 'Friend request accepted'})
     except Exception as e:
         print('Error accepting friend request:', e)
@@ -580,8 +1481,9 @@ def decline_friend_request():
     try:
         connection = get_db_connection()
         cursor = connection.cursor()
-        cursor.execute("UPDATE friends SET status='declined' WHERE user_id=%s AND friend_id=%s AND status='pending'", (friend_id, user_id))
+        queries.run(cursor, 'friends.decline', (friend_id, user_id))
         connection.commit()
+        friend_graph.invalidate(user_id, friend_id)
         return jsonify({'status': 'success', 'message': 'Friend request declined'})
     except Exception as e:
         print('Error declining friend request:', e)
@@ -601,8 +1503,9 @@ def remove_friend():
     try:
         connection = get_db_connection()
         cursor = connection.cursor()
-        cursor.execute("DELETE FROM friends WHERE (user_id=%s AND friend_id=%s) OR (user_id=%s AND friend_id=%s)", (user_id, friend_id, friend_id, user_id))
+        queries.run(cursor, 'friends.remove', (user_id, friend_id, friend_id, user_id))
         connection.commit()
+        friend_graph.invalidate(user_id, friend_id)
         return jsonify({'status': 'success', 'message': 'Friend removed'})
     except Exception as e:
         print('Error removing friend:', e)
@@ -615,64 +1518,43 @@ def remove_friend():
 @app.route('/api/friends/list/<int:user_id>', methods=['GET'])
 def list_friends(user_id):
     try:
-        connection = get_db_connection()
-        cursor = connection.cursor()
-        cursor.execute("""
-            SELECT u.id, u.name, u.email, u.phone, u.status
-            FROM friends f
-            JOIN users u ON u.id = f.friend_id
-            WHERE f.user_id = %s AND f.status = 'accepted'
-        """, (user_id,))
-        friends = cursor.fetchall()
+        # Served from the friend graph cache
+        friend_ids = sorted(friend_graph.friends_of(user_id))
+        friends = friend_graph.profiles_for(friend_ids, fetch_user_profiles_by_id)
         return jsonify(friends)
     except Exception as e:
         print('Error listing friends:', e)
         return jsonify({'status': 'error', 'message': 'Failed to list friends'}), 500
-    finally:
-        if 'cursor' in locals(): cursor.close()
-        if 'connection' in locals(): connection.close()
 
 # List all incoming friend requests for a user
 @app.route('/api/friends/requests/incoming/<int:user_id>', methods=['GET'])
 def incoming_requests(user_id):
     try:
-        connection = get_db_connection()
-        cursor = connection.cursor()
-        cursor.execute("""
-            SELECT f.user_id as requester_id, u.name, u.email
-            FROM friends f
-            JOIN users u ON u.id = f.user_id
-            WHERE f.friend_id = %s AND f.status = 'pending'
-        """, (user_id,))
-        requests = cursor.fetchall()
+        # Served from the friend graph cache
+        requester_ids = sorted(friend_graph.pending_in(user_id))
+        requests = [
+            {'requester_id': p['id'], 'name': p['name'], 'email': p['email']}
+            for p in friend_graph.profiles_for(requester_ids, fetch_user_profiles_by_id)
+        ]
         return jsonify(requests)
     except Exception as e:
         print('Error fetching incoming requests:', e)
         return jsonify({'status': 'error', 'message': 'Failed to fetch incoming requests'}), 500
-    finally:
-        if 'cursor' in locals(): cursor.close()
-        if 'connection' in locals(): connection.close()
 
 # List all outgoing friend requests for a user
 @app.route('/api/friends/requests/outgoing/<int:user_id>', methods=['GET'])
 def outgoing_requests(user_id):
     try:
-        connection = get_db_connection()
-        cursor = connection.cursor()
-        cursor.execute("""
-            SELECT f.friend_id as requested_id, u.name, u.email
-            FROM friends f
-            JOIN users u ON u.id = f.friend_id
-            WHERE f.user_id = %s AND f.status = 'pending'
-        """, (user_id,))
-        requests = cursor.fetchall()
+        # Served from the friend graph cache
+        requested_ids = sorted(friend_graph.pending_out(user_id))
+        requests = [
+            {'requested_id': p['id'], 'name': p['name'], 'email': p['email']}
+            for p in friend_graph.profiles_for(requested_ids, fetch_user_profiles_by_id)
+        ]
         return jsonify(requests)
     except Exception as e:
         print('Error fetching outgoing requests:', e)
         return jsonify({'status': 'error', 'message': 'Failed to fetch outgoing requests'}), 500
-    finally:
-        if 'cursor' in locals(): cursor.close()
-        if 'connection' in locals(): connection.close()
 
 # Search users to add as friends (excluding already friends and self)
 @app.route('/api/friends/search', methods=['GET'])
@@ -682,20 +1564,12 @@ def search_users():
     if not user_id:
         return jsonify({'status': 'error', 'message': 'Missing user_id'}), 400
     try:
+        # Existing friends and pending requests come from the friend graph cache
+        related = friend_graph.related(user_id)
         connection = get_db_connection()
         cursor = connection.cursor()
-        cursor.execute("""
-            SELECT id, name, email
-            FROM users
-            WHERE (name LIKE %s OR email LIKE %s)
-              AND id != %s
-              AND id NOT IN (
-                SELECT friend_id FROM friends WHERE user_id = %s AND status IN ('pending', 'accepted')
-                UNION
-                SELECT user_id FROM friends WHERE friend_id = %s AND status IN ('pending', 'accepted')
-              )
-        """, (f'%{query}%', f'%{query}%', user_id, user_id, user_id))
-        users = cursor.fetchall()
+        queries.run(cursor, 'users.search', (f'%{query}%', f'%{query}%', user_id))
+        users = [row for row in cursor.fetchall() if row['id'] not in related]
         return jsonify(users)
     except Exception as e:
         print('Error searching users:', e)
@@ -719,10 +1593,7 @@ def send_friend_message():
     try:
         connection = get_db_connection()
         cursor = connection.cursor()
-        cursor.execute(
-            "INSERT INTO friend_messages (sender_id, receiver_id, message, created_at) VALUES (%s, %s, %s, NOW())",
-            (sender_id, receiver_id, message)
-        )
+        queries.run(cursor, 'friend_messages.insert', (sender_id, receiver_id, message))
         connection.commit()
         return jsonify({'status': 'success'})
     except Exception as e:
@@ -733,25 +1604,35 @@ def send_friend_message():
         if 'connection' in locals(): connection.close()
 
 # Fetch messages between two users
+# Newest FRIEND_MESSAGES_DEFAULT_LIMIT first; ?before_id=N loads the page
+# before N. Pages are returned oldest first.
+FRIEND_MESSAGES_DEFAULT_LIMIT = 50
+FRIEND_MESSAGES_MAX_LIMIT = 500
+
 @app.route('/api/friends/messages', methods=['GET'])
 def get_friend_messages():
-    user1 = request.args.get('user1')
-    user2 = request.args.get('user2')
+    user1 = request.args.get('user1', type=int)
+    user2 = request.args.get('user2', type=int)
+    before_id = request.args.get('before_id', type=int)
+    limit = min(max(request.args.get('limit', FRIEND_MESSAGES_DEFAULT_LIMIT, type=int), 1), FRIEND_MESSAGES_MAX_LIMIT)
     if not user1 or not user2:
         return jsonify([])
     try:
+        # Only two senders: names come from the profile cache, not a join
+        # per row (read before checking out, the cache loads on its own
+        # connection)
+        names = {p['id']: p['name'] for p in friend_graph.profiles_for([user1, user2], fetch_user_profiles_by_id)}
         connection = get_db_connection()
-        # cursor = connection.cursor(dictionary=True)
         cursor = connection.cursor()
-        cursor.execute("""
-            SELECT m.*, u.name as sender_name
-            FROM friend_messages m
-            JOIN users u ON u.id = m.sender_id
-            WHERE (sender_id = %s AND receiver_id = %s)
-               OR (sender_id = %s AND receiver_id = %s)
-            ORDER BY m.created_at ASC
-        """, (user1, user2, user2, user1))
-        messages = cursor.fetchall()
+        # Keyset page on idx_conversation_key (conversation_low, conversation_high, id)
+        low, high = min(user1, user2), max(user1, user2)
+        if before_id is not None:
+            queries.run(cursor, 'friend_messages.before', (low, high, before_id, limit))
+        else:
+            queries.run(cursor, 'friend_messages.newest', (low, high, limit))
+        messages = list(reversed(cursor.fetchall()))
+        for message in messages:
+            message['sender_name'] = names.get(message['sender_id'])
         return jsonify(messages)
     except Exception as e:
         print('Error fetching messages:', {e})
@@ -773,10 +1654,11 @@ def block_user():
     try:
         connection = get_db_connection()
         cursor = connection.cursor()
-        cursor.execute("INSERT IGNORE INTO blocked_users (user_id, blocked_user_id) VALUES (%s, %s)", (user_id, blocked_user_id))
+        queries.run(cursor, 'blocked.insert', (user_id, blocked_user_id))
         # Remove friendship if exists
-        cursor.execute("DELETE FROM friends WHERE (user_id=%s AND friend_id=%s) OR (user_id=%s AND friend_id=%s)", (user_id, blocked_user_id, blocked_user_id, user_id))
+        queries.run(cursor, 'friends.remove', (user_id, blocked_user_id, blocked_user_id, user_id))
         connection.commit()
+        friend_graph.invalidate(user_id, blocked_user_id)
         return jsonify({'status': 'success', 'message': 'User blocked'})
     except Exception as e:
         print('Error blocking user:', e)
@@ -796,7 +1678,7 @@ def unblock_user():
     try:
         connection = get_db_connection()
         cursor = connection.cursor()
-        cursor.execute("DELETE FROM blocked_users WHERE user_id=%s AND blocked_user_id=%s", (user_id, blocked_user_id))
+        queries.run(cursor, 'blocked.delete', (user_id, blocked_user_id))
         connection.commit()
         return jsonify({'status': 'success', 'message': 'User unblocked'})
     except Exception as e:
@@ -813,12 +1695,7 @@ def get_blocked_users(user_id):
     try:
         connection = get_db_connection()
         cursor = connection.cursor()
-        cursor.execute("""
-            SELECT u.id, u.name, u.email
-            FROM blocked_users b
-            JOIN users u ON u.id = b.blocked_user_id
-            WHERE b.user_id = %s
-        """, (user_id,))
+        queries.run(cursor, 'blocked.of_user', (user_id,))
         blocked = cursor.fetchall()
         return jsonify(blocked)
     except Exception as e:
@@ -846,10 +1723,7 @@ def handle_friend_chat_message(data):
     try:
         connection = get_db_connection()
         cursor = connection.cursor()
-        cursor.execute(
-            "INSERT INTO friend_messages (sender_id, receiver_id, message, created_at) VALUES (%s, %s, %s, NOW())",
-            (sender_id, receiver_id, message)
-        )
+        queries.run(cursor, 'friend_messages.insert', (sender_id, receiver_id, message))
         connection.commit()
 
         # Emit the message to the specific receiver
@@ -873,10 +1747,24 @@ def test_connect():
     if user_id:
         join_room(str(user_id))
         join_room(f'user_{user_id}')  # this line for consistency
+        with connected_user_sids_lock:
+            connected_user_sids.setdefault(str(user_id), set()).add(request.sid)
         print(f'User {user_id} connected and joined rooms {str(user_id)} and user_{user_id}')
     else:
         print('Anonymous client connected (no user_id provided)')
 
+# Forget the session when a user disconnects
+@socketio.on('disconnect')
+def handle_disconnect():
+    user_id = request.args.get('user_id')
+    if user_id:
+        with connected_user_sids_lock:
+            sids = connected_user_sids.get(str(user_id))
+            if sids:
+                sids.discard(request.sid)
+                if not sids:
+                    del connected_user_sids[str(user_id)]
+
 
 
 
@@ -885,13 +1773,43 @@ def test_connect():
 
 # admin start
 # dashboard start
+# Dashboard counters
+# Users and active/resolved alerts are counted once, then kept up to date
+# by signup, add_user, delete_user, emergency, mark_safe and resolve_alert,
+# and reconciled with COUNT(*) every DASHBOARD_RECONCILE_S (other workers'
+# changes show up then). /api/dashboard/summary serves them from memory.
+DASHBOARD_RECONCILE_S = float(os.environ.get('DASHBOARD_RECONCILE_S', 60 if MULTI_WORKER else 300))
+
+def load_dashboard_counts():
+    with db_connection() as connection, connection.cursor() as cursor:
+        return queries.run(cursor, 'dashboard.counts').fetchone()
+
+dashboard_counters = Counters(load_dashboard_counts)
+
+def reconcile_dashboard_counters():
+    drift = dashboard_counters.reconcile()
+    if drift:
+        print(f"Dashboard counters corrected by {drift}")
+
+job_scheduler.register('reconcile_dashboard_counters', reconcile_dashboard_counters)
+
+# Total users, active and resolved alerts in one call
+@app.route('/api/dashboard/summary', methods=['GET'])
+def get_dashboard_summary():
+    try:
+        counts, reconciled_at = dashboard_counters.snapshot()
+        return jsonify(dict(counts, reconciled_at=reconciled_at))
+    except Exception as e:
+        print(f"Error fetching dashboard summary: {e}")
+        return jsonify({'status': 'error', 'message': 'Failed to fetch dashboard summary'}), 500
+
 # Endpoint to get the total number of users
 @app.route('/api/users/count', methods=['GET'])
 def get_total_users():
     try:
-        connection = get_db_connection()
+        connection = get_read_connection('users')
         cursor = connection.cursor()
-        cursor.execute("SELECT COUNT(*) as count FROM users")
+        queries.run(cursor, 'users.count')
         result = cursor.fetchone()
         return jsonify(result)
     except Exception as e:
@@ -907,11 +1825,10 @@ def get_total_users():
 @app.route('/api/alerts/active', methods=['GET'])
 def get_active_alerts():
     try:
-        connection = get_db_connection()
+        connection = get_read_connection('emergency_alerts')
         cursor = connection.cursor()
-        cursor.execute("SELECT COUNT(*) as count FROM emergency_alerts WHERE resolved = 0")
+        queries.run(cursor, 'alerts.active_count')
         result = cursor.fetchone()
-        print(f"Active alerts count: {result['count']}")  # Add logging
         return jsonify(result)
     except Exception as e:
         print(f"Error fetching active alerts: {e}")
@@ -926,11 +1843,10 @@ def get_active_alerts():
 @app.route('/api/alerts/resolved', methods=['GET'])
 def get_resolved_alerts():
     try:
-        connection = get_db_connection()
+        connection = get_read_connection('emergency_alerts')
         cursor = connection.cursor()
-        cursor.execute("SELECT COUNT(*) as count FROM emergency_alerts WHERE resolved = 1")
+        queries.run(cursor, 'alerts.resolved_count')
         result = cursor.fetchone()
-        print(f"Resolved alerts count: {result['count']}")  # Add logging
         return jsonify(result)
     except Exception as e:
         print(f"Error fetching resolved alerts: {e}")
@@ -941,22 +1857,189 @@ def get_resolved_alerts():
         if 'connection' in locals():
             connection.close()
 
+# Alert rollups
+# Alerts created and resolved per type, per hour and per day, kept in
+# alert_rollups so the over-time chart reads one row per bucket and type
+# instead of grouping emergency_alerts. emergency, mark_safe and
+# resolve_alert add their changes to alert_rollup_buffer, which is written
+# every ALERT_ROLLUP_FLUSH_S. Buckets are in the database's time zone (the
+# app is expected to share it). repair_alert_rollups rebuilds the last day
+# from emergency_alerts every ALERT_ROLLUP_REPAIR_S (other workers' lost
+# buffers, changes made by hand), leaving the last ALERT_ROLLUP_SETTLE_S to
+# the buffers; `flask --app app backfill-alert-rollups` fills in history.
+# Rebuilds hold the MySQL lock alert_rollups_repair, so with several
+# workers the others skip their repair instead of rebuilding the same day.
+ALERT_ROLLUP_FLUSH_S = float(os.environ.get('ALERT_ROLLUP_FLUSH_S', 5))
+ALERT_ROLLUP_REPAIR_S = float(os.environ.get('ALERT_ROLLUP_REPAIR_S', 3600))
+ALERT_ROLLUP_SETTLE_S = float(os.environ.get('ALERT_ROLLUP_SETTLE_S', 300))
+ALERT_ROLLUP_DELTA = 'SELECT %s AS ts, %s AS type, %s AS created, %s AS resolved'
+ALERT_ROLLUP_STEP = {'hour': timedelta(hours=1), 'day': timedelta(days=1)}
+
+def write_alert_rollups(rows):
+    # Changes in the same minute and type go out as one row
+    deltas = {}
+    for ts, alert_type, created, resolved in rows:
+        total = deltas.setdefault((int(ts) // 60 * 60, alert_type), [0, 0])
+        total[0] += created
+        total[1] += resolved
+    params = [value for key, total in deltas.items() for value in key + tuple(total)]
+    fragment = ' UNION ALL '.join([ALERT_ROLLUP_DELTA] * len(deltas))
+    with db_connection() as connection:
+        with connection.cursor() as cursor:
+            for granularity, bucket in ROLLUP_BUCKETS.items():
+                queries.run(cursor, 'rollups.add', [granularity] + params, bucket=bucket, deltas=fragment)
+        connection.commit()
+    db_router.note_write('alert_rollups')
+
+alert_rollup_buffer = AppendBuffer(write_alert_rollups, max_entries=500)
+
+# Only buffers: the callers still hold their connection, and the flush
+# would check out another (the flush job and the endpoint write it)
+def add_alert_rollup(alert_type, created=0, resolved=0):
+    alert_rollup_buffer.add((time.time(), alert_type, created, resolved))
+
+def flush_alert_rollups():
+    try:
+        alert_rollup_buffer.flush()
+    except Exception as e:
+        print('Error flushing alert rollups:', e)
+
+atexit.register(flush_alert_rollups)
+
+def rollup_bucket(moment, granularity):
+    moment = moment.replace(minute=0, second=0, microsecond=0)
+    return moment.replace(hour=0) if granularity == 'day' else moment
+
+# Recount the hour rows in [start, end) and the day rows of the days they
+# touch from emergency_alerts. start goes back to midnight and end to the
+# hour; a partial last day is summed from its recounted hours plus the
+# buffered ones after end.
+# Returns False without touching anything when another process holds the
+# rebuild lock for longer than wait_s. The lock is per MySQL session, so it
+# is taken and released on the connection that runs the rebuild.
+def rebuild_alert_rollups(start, end, wait_s=0):
+    start = rollup_bucket(start, 'day')
+    end = rollup_bucket(end, 'hour')
+    if end <= start:
+        return True
+    day_end = rollup_bucket(end, 'day')
+    if day_end < end:
+        day_end += ALERT_ROLLUP_STEP['day']
+    # Buffered changes would otherwise land on top of the recount
+    flush_alert_rollups()
+    with db_connection() as connection:
+        with connection.cursor() as cursor:
+            if not queries.run(cursor, 'rollups.lock', (wait_s,)).fetchone()['locked']:
+                return False
+            try:
+                queries.run(cursor, 'rollups.clear', ('hour', start, end))
+                queries.run(cursor, 'rollups.rebuild_created_hours', (start, end))
+                queries.run(cursor, 'rollups.rebuild_resolved_hours', (start, end))
+                queries.run(cursor, 'rollups.clear', ('day', start, day_end))
+                queries.run(cursor, 'rollups.rebuild_days', (start, day_end))
+                connection.commit()
+            finally:
+                queries.run(cursor, 'rollups.unlock')
+    db_router.note_write('alert_rollups')
+    return True
+
+def repair_alert_rollups():
+    end = datetime.now() - timedelta(seconds=ALERT_ROLLUP_SETTLE_S)
+    if not rebuild_alert_rollups(end - ALERT_ROLLUP_STEP['day'], end):
+        print("Alert rollup repair skipped, another process is rebuilding")
+
+job_scheduler.register('flush_alert_rollups', flush_alert_rollups)
+job_scheduler.register('repair_alert_rollups', repair_alert_rollups)
+
+# Fill alert_rollups from emergency_alerts one day at a time, e.g. after
+# migration 006: flask --app app backfill-alert-rollups [--from 2024-01-01]
+@app.cli.command('backfill-alert-rollups')
+@click.option('--from', 'start', type=click.DateTime(), help='First day to roll up (default: the oldest alert)')
+@click.option('--to', 'end', type=click.DateTime(), help='Roll up until then (default: ALERT_ROLLUP_SETTLE_S ago)')
+@click.option('--lock-wait', 'wait_s', type=int, default=60, help='Seconds to wait for a running repair (default 60)')
+def backfill_alert_rollups(start, end, wait_s):
+    if start is None:
+        with db_connection() as connection, connection.cursor() as cursor:
+            start = queries.run(cursor, 'alerts.first_created').fetchone()['first']
+        if start is None:
+            click.echo('No alerts to roll up')
+            return
+    end = end or datetime.now() - timedelta(seconds=ALERT_ROLLUP_SETTLE_S)
+    day = rollup_bucket(start, 'day')
+    while day < end:
+        if not rebuild_alert_rollups(day, min(day + ALERT_ROLLUP_STEP['day'], end), wait_s):
+            raise click.ClickException(f"Another process is rebuilding alert_rollups, stopped before {day:%Y-%m-%d}")
+        click.echo(f"Rolled up {day:%Y-%m-%d}")
+        day += ALERT_ROLLUP_STEP['day']
+
 # Endpoint to get alerts over time
+# Created (data) and resolved alerts per bucket, in total and per type,
+# read from alert_rollups only.
+# ?granularity=hour|day (default day)
+# ?from=, ?to= ISO 8601 dates or times in the database's time zone, both
+# buckets included (default: the last OVER_TIME_DEFAULT_RANGE up to now)
+OVER_TIME_DEFAULT_RANGE = {'hour': timedelta(hours=48), 'day': timedelta(days=90)}
+OVER_TIME_LABELS = {'hour': '%Y-%m-%d %H:00', 'day': '%Y-%m-%d'}
+OVER_TIME_MAX_BUCKETS = int(os.environ.get('OVER_TIME_MAX_BUCKETS', 2000))
+
+def parse_over_time_arg(name):
+    value = request.args.get(name)
+    if not value:
+        return None
+    moment = datetime.fromisoformat(value)
+    # Offsets are converted to local (database) time
+    return moment.astimezone().replace(tzinfo=None) if moment.tzinfo else moment
+
 @app.route('/api/alerts/over-time', methods=['GET'])
 def get_alerts_over_time():
     try:
-        connection = get_db_connection()
+        granularity = request.args.get('granularity', 'day')
+        if granularity not in ROLLUP_BUCKETS:
+            return jsonify({'status': 'error', 'message': 'granularity must be hour or day'}), 400
+        try:
+            end = parse_over_time_arg('to') or datetime.now()
+            start = parse_over_time_arg('from') or end - OVER_TIME_DEFAULT_RANGE[granularity]
+        except ValueError:
+            return jsonify({'status': 'error', 'message': 'from and to must be ISO 8601 dates'}), 400
+
+        step = ALERT_ROLLUP_STEP[granularity]
+        start = rollup_bucket(start, granularity)
+        end = rollup_bucket(end, granularity) + step
+        count = (end - start) // step
+        if count <= 0:
+            return jsonify({'status': 'error', 'message': 'from must not be after to'}), 400
+        if count > OVER_TIME_MAX_BUCKETS:
+            return jsonify({'status': 'error', 'message': f'At most {OVER_TIME_MAX_BUCKETS} buckets per request'}), 400
+
+        # This worker's latest alerts show up right away
+        flush_alert_rollups()
+        connection = get_read_connection('alert_rollups')
         cursor = connection.cursor()
-        cursor.execute("""
-            SELECT DATE(created_at) as date, COUNT(*) as count
-            FROM emergency_alerts
-            GROUP BY DATE(created_at)
-            ORDER BY DATE(created_at)
-        """)
-        result = cursor.fetchall()
-        labels = [row['date'].strftime('%Y-%m-%d') for row in result]
-        data = [row['count'] for row in result]
-        return jsonify({'labels': labels, 'data': data})
+        queries.run(cursor, 'rollups.range', (granularity, start, end))
+
+        buckets = [start + step * i for i in range(count)]
+        index = {bucket: i for i, bucket in enumerate(buckets)}
+        created = [0] * count
+        resolved = [0] * count
+        by_type = {}
+        for row in cursor.fetchall():
+            i = index.get(row['bucket_start'])
+            if i is None:
+                continue
+            counts = by_type.setdefault(row['type'], {'created': [0] * count, 'resolved': [0] * count})
+            counts['created'][i] = row['created']
+            counts['resolved'][i] = row['resolved']
+            created[i] += row['created']
+            resolved[i] += row['resolved']
+        return jsonify({
+            'granularity': granularity,
+            'from': start.isoformat(),
+            'to': end.isoformat(),
+            'labels': [bucket.strftime(OVER_TIME_LABELS[granularity]) for bucket in buckets],
+            'data': created,
+            'resolved': resolved,
+            'by_type': by_type
+        })
     except Exception as e:
         print(f"Error fetching alerts over time: {e}")
         return jsonify({'status': 'error', 'message': 'Failed to fetch alerts over time'}), 500
@@ -979,29 +2062,29 @@ def get_users():
         status = request.args.get('status')  # Optional status filter
         search = request.args.get('search')  # Optional search query
 
-        connection = get_db_connection()
+        connection = get_read_connection('users')
         cursor = connection.cursor()
 
-        # Base query
-        query = "SELECT id, name, email, phone, role, status FROM users WHERE 1=1"
+        # Filters for users.list
+        filters = ""
         params = []
 
         # Add filters if provided
         if role:
-            query += " AND role = %s"
+            filters += " AND role = %s"
             params.append(role)
 
         if status:
-            query += " AND status = %s"
+            filters += " AND status = %s"
             params.append(status)
 
         if search:
-            query += " AND (name LIKE %s OR email LIKE %s)"
+            filters += " AND (name LIKE %s OR email LIKE %s)"
             params.append(f"%{search}%")
             params.append(f"%{search}%")
 
         # Execute query
-        cursor.execute(query, params)
+        queries.run(cursor, 'users.list', params, filters=filters)
         users = cursor.fetchall()
 
         return jsonify(users)
@@ -1036,13 +2119,14 @@ def add_user():
         cursor = connection.cursor()
 
         # Check if email already exists
-        cursor.execute("SELECT * FROM users WHERE email = %s", (email,))
+        queries.run(cursor, 'users.by_email', (email,))
         if cursor.fetchone():
             return jsonify({'status': 'error', 'message': 'Email already registered'}), 400
 
-        query = "INSERT INTO users (name, email, password, phone, role, status) VALUES (%s, %s, %s, %s, %s, %s)"
-        cursor.execute(query, (name, email, hashed_password, phone, role, status))
+        queries.run(cursor, 'users.insert_with_role', (name, email, hashed_password, phone, role, status))
         connection.commit()
+        dashboard_counters.add(users=1)
+        db_router.note_write('users')
 
         return jsonify({'status': 'success', 'message': 'User added successfully!'}), 201
     except Exception as e:
@@ -1069,13 +2153,10 @@ def edit_user(user_id):
         connection = get_db_connection()
         cursor = connection.cursor()
 
-        query = """
-            UPDATE users
-            SET name = %s, email = %s, phone = %s, role = %s, status = %s
-            WHERE id = %s
-        """
-        cursor.execute(query, (name, email, phone, role, status, user_id))
+        queries.run(cursor, 'users.update', (name, email, phone, role, status, user_id))
         connection.commit()
+        db_router.note_write('users')
+        friend_graph.invalidate_profile(user_id)
 
         return jsonify({'status': 'success', 'message': 'User updated successfully!'})
     except Exception as e:
@@ -1095,9 +2176,16 @@ def delete_user(user_id):
         connection = get_db_connection()
         cursor = connection.cursor()
 
-        query = "DELETE FROM users WHERE id = %s"
-        cursor.execute(query, (user_id,))
+        # The user's alerts go with them (ON DELETE CASCADE)
+        alerts = queries.run(cursor, 'alerts.counts_of_user', (user_id,)).fetchone()
+        deleted = queries.run(cursor, 'users.delete', (user_id,)).rowcount
         connection.commit()
+        if deleted:
+            dashboard_counters.add(users=-1, active_alerts=-int(alerts['active'] or 0), resolved_alerts=-int(alerts['resolved'] or 0))
+        db_router.note_write('users')
+        user_location_grid.remove(user_id)
+        location_throttle.forget(user_id)
+        friend_graph.forget_user(user_id)
 
         return jsonify({'status': 'success', 'message': 'User deleted successfully!'})
     except Exception as e:
@@ -1135,14 +2223,13 @@ def add_service():
         cursor = connection.cursor()
 
         # Check if email already exists
-        cursor.execute("SELECT * FROM services WHERE email = %s", (email,))
+        queries.run(cursor, 'services.by_email', (email,))
         if cursor.fetchone():
             return jsonify({'status': 'error', 'message': 'Email already registered'}), 400
 
         hashed_password = generate_password_hash(password)
 
-        query = "INSERT INTO services (company_name, email, password, service_type, phone, lat, lng) VALUES (%s, %s, %s, %s, %s, %s, %s)"
-        cursor.execute(query, (company_name, email, hashed_password, service_type, phone, latitude, longitude))
+        queries.run(cursor, 'services.insert', (company_name, email, hashed_password, service_type, phone, latitude, longitude))
         connection.commit()
 
         return jsonify({'status': 'success', 'message': 'Service added successfully!'}), 201
@@ -1175,7 +2262,7 @@ def fire_service_login():
 
         connection = get_db_connection()
         cursor = connection.cursor(pymysql.cursors.DictCursor)
-        cursor.execute("SELECT id, company_name, email, password, service_type FROM services WHERE email = %s", (email,))
+        queries.run(cursor, 'services.credentials', (email,))
         service = cursor.fetchone()
 
         if service and check_password_hash(service['password'], password):
@@ -1214,13 +2301,10 @@ def get_fire_service_profile():
         if not email:
             return jsonify({'status': 'error', 'message': 'Email is required.'}), 400
 
-        connection = get_db_connection()
-        cursor = connection.cursor(pymysql.cursors.DictCursor)
-        # Ensure your services table has lat and lng columns
-        cursor.execute("SELECT id, company_name, email, service_type, phone, lat, lng FROM services WHERE email = %s", (email,))
-        service = cursor.fetchone()
-        cursor.close()
-        connection.close()
+        with db_connection() as connection, connection.cursor(pymysql.cursors.DictCursor) as cursor:
+            # Ensure your services table has lat and lng columns
+            queries.run(cursor, 'services.profile', (email,))
+            service = cursor.fetchone()
 
         if service:
             return jsonify({
@@ -1243,18 +2327,14 @@ def get_fire_service_profile():
 #fire endpoint to return all unresolved fire alerts
 @app.route('/api/fire/alerts', methods=['GET'])
 def get_unresolved_fire_alerts():
-    connection = get_db_connection()
-    cursor = connection.cursor()
-    cursor.execute("""
-        SELECT ea.id, ea.type, ea.details, ea.latitude, ea.longitude, ea.user_id, u.name as user_name
-        FROM emergency_alerts ea
-        LEFT JOIN users u ON ea.user_id = u.id
-        WHERE ea.type = 'fire' AND (ea.resolved = 0 OR ea.resolved IS NULL)
-        ORDER BY ea.id DESC
-    """)
-    alerts = cursor.fetchall()
-    cursor.close()
-    connection.close()
+    with db_connection() as connection, connection.cursor() as cursor:
+        queries.run(cursor, 'alerts.open_fire')
+        alerts = cursor.fetchall()
+    # Optional ?lat=&lng= sorts the alerts nearest first
+    origin_lat = request.args.get('lat', type=float)
+    origin_lng = request.args.get('lng', type=float)
+    if origin_lat is not None and origin_lng is not None:
+        alerts = rank_by_distance(alerts, origin_lat, origin_lng, 'latitude', 'longitude')
     # Format for frontend
     return jsonify([
         {
@@ -1263,7 +2343,8 @@ def get_unresolved_fire_alerts():
             'details': alert['details'],
             'location': {'lat': alert['latitude'], 'lng': alert['longitude']},
             'user_id': alert['user_id'],
-            'user_name': alert['user_name']
+            'user_name': alert['user_name'],
+            'distance_km': alert.get('distance_km')
         }
         for alert in alerts
     ])
@@ -1288,12 +2369,9 @@ def medical_service_login():
         if not email or not password:
             return jsonify({'status': 'error', 'message': 'Email and password are required.'}), 400
 
-        connection = get_db_connection()
-        cursor = connection.cursor(pymysql.cursors.DictCursor)
-        cursor.execute("SELECT * FROM services WHERE email = %s AND service_type = 'hospital'", (email,))
-        service = cursor.fetchone()
-        cursor.close()
-        connection.close()
+        with db_connection() as connection, connection.cursor(pymysql.cursors.DictCursor) as cursor:
+            queries.run(cursor, 'services.hospital_by_email', (email,))
+            service = cursor.fetchone()
 
         if service and check_password_hash(service['password'], password):
             return jsonify({'status': 'success', 'message': 'Login successful!'}), 200
@@ -1313,12 +2391,9 @@ def get_medical_service_profile():
         if not email:
             return jsonify({'status': 'error', 'message': 'Email is required.'}), 400
 
-        connection = get_db_connection()
-        cursor = connection.cursor(pymysql.cursors.DictCursor)
-        cursor.execute("SELECT id, company_name, email, service_type, phone, lat, lng FROM services WHERE email = %s AND service_type = 'hospital'", (email,))
-        service = cursor.fetchone()
-        cursor.close()
-        connection.close()
+        with db_connection() as connection, connection.cursor(pymysql.cursors.DictCursor) as cursor:
+            queries.run(cursor, 'services.hospital_profile', (email,))
+            service = cursor.fetchone()
 
         if service:
             return jsonify({
@@ -1341,18 +2416,15 @@ def get_medical_service_profile():
 @app.route('/api/medical/alerts', methods=['GET'])
 def get_unresolved_medical_alerts():
     try:
-        connection = get_db_connection()
-        cursor = connection.cursor(pymysql.cursors.DictCursor)
-        cursor.execute("""
-            SELECT ea.id, ea.type, ea.details, ea.latitude, ea.longitude, ea.user_id, ea.created_at, u.name as user_name
-            FROM emergency_alerts ea
-            LEFT JOIN users u ON ea.user_id = u.id
-            WHERE ea.resolved = 0 AND (ea.type LIKE '%accident%' OR ea.type LIKE '%fire%')
-            ORDER BY ea.created_at DESC
-        """)
-        alerts = cursor.fetchall()
-        cursor.close()
-        connection.close()
+        with db_connection() as connection, connection.cursor(pymysql.cursors.DictCursor) as cursor:
+            queries.run(cursor, 'alerts.open_medical')
+            alerts = cursor.fetchall()
+
+        # Optional ?lat=&lng= sorts the alerts nearest first
+        origin_lat = request.args.get('lat', type=float)
+        origin_lng = request.args.get('lng', type=float)
+        if origin_lat is not None and origin_lng is not None:
+            alerts = rank_by_distance(alerts, origin_lat, origin_lng, 'latitude', 'longitude')
 
         # Format alerts for frontend
         formatted_alerts = []
@@ -1367,7 +2439,8 @@ def get_unresolved_medical_alerts():
                 },
                 'user_id': alert['user_id'],
                 'user_name': alert['user_name'],
-                'created_at': alert['created_at'].isoformat() if alert['created_at'] else None
+                'created_at': alert['created_at'].isoformat() if alert['created_at'] else None,
+                'distance_km': alert.get('distance_km')
             })
 
         return jsonify(formatted_alerts), 200
@@ -1390,15 +2463,15 @@ def handle_service_responded(data, callback=None):
     service_name = data.get('service_name')
     
     try:
+        # Find the actual room_id for this alert (from the room registry,
+        # whose loader checks out its own connection, so before ours)
+        room_result = room_registry.get_by_alert(alert_id) if alert_id is not None else None
+
         connection = get_db_connection()
         cursor = connection.cursor()
         
-        # Find the actual room_id for this alert from emergency_chats table
-        cursor.execute("SELECT room_id FROM emergency_chats WHERE alert_id = %s", (alert_id,))
-        room_result = cursor.fetchone()
-        
         # Get the service phone number from the services table
-        cursor.execute("SELECT phone FROM services WHERE company_name = %s AND service_type = %s", (service_name, service_type))
+        queries.run(cursor, 'services.phone', (service_name, service_type))
         service_result = cursor.fetchone()
         phone = service_result['phone'] if service_result and service_result['phone'] else 'Not available'
         
@@ -1448,28 +2521,22 @@ def get_alerts():
         status = request.args.get('status')
         search = request.args.get('search')
 
-        connection = get_db_connection()
+        connection = get_read_connection('emergency_alerts', 'users')
         cursor = connection.cursor()
-        query = """
-            SELECT a.*, u.name as user_name
-            FROM emergency_alerts a
-            LEFT JOIN users u ON a.user_id = u.id
-            WHERE 1=1
-        """
+        filters = ""
         params = []
         if type_:
-            query += " AND a.type = %s"
+            filters += " AND a.type = %s"
             params.append(type_)
         if status:
             if status == 'active':
-                query += " AND a.resolved = 0"
+                filters += " AND a.resolved = 0"
             elif status == 'resolved':
-                query += " AND a.resolved = 1"
+                filters += " AND a.resolved = 1"
         if search:
-            query += " AND (a.type LIKE %s OR u.name LIKE %s OR a.details LIKE %s)"
+            filters += " AND (a.type LIKE %s OR u.name LIKE %s OR a.details LIKE %s)"
             params.extend([f"%{search}%", f"%{search}%", f"%{search}%"])
-        query += " ORDER BY a.created_at DESC"
-        cursor.execute(query, params)
+        queries.run(cursor, 'alerts.list', params, filters=filters)
         alerts = cursor.fetchall()
         return jsonify(alerts)
     except Exception as e:
@@ -1487,13 +2554,7 @@ def get_alert(alert_id):
     try:
         connection = get_db_connection()
         cursor = connection.cursor()
-        query = """
-            SELECT a.*, u.name as user_name
-            FROM emergency_alerts a
-            LEFT JOIN users u ON a.user_id = u.id
-            WHERE a.id = %s
-        """
-        cursor.execute(query, (alert_id,))
+        queries.run(cursor, 'alerts.by_id', (alert_id,))
         alert = cursor.fetchone()
         return jsonify(alert)
     except Exception as e:
@@ -1511,9 +2572,19 @@ def resolve_alert(alert_id):
     try:
         connection = get_db_connection()
         cursor = connection.cursor()
-        query = "UPDATE emergency_alerts SET resolved = 1 WHERE id = %s"
-        cursor.execute(query, (alert_id,))
+        resolved = queries.run(cursor, 'alerts.resolve', (alert_id,)).rowcount
         connection.commit()
+        dashboard_counters.add(active_alerts=-resolved, resolved_alerts=resolved)
+        db_router.note_write('emergency_alerts')
+        forget_alerts([alert_id])
+        # close_chat_on_alert_resolved has closed the chat in the database
+        room_registry.mark_closed(alert_ids=[alert_id])
+        # Stop the location trail once the user has no unresolved alert left
+        row = queries.run(cursor, 'alerts.owner_open_count', (alert_id,)).fetchone()
+        if row and resolved:
+            add_alert_rollup(row['type'], resolved=1)
+        if row and row['open_alerts'] == 0:
+            set_alert_active(row['user_id'], False)
         # Emit resolveAlert event
         socketio.emit('resolveAlert')
         return jsonify({'status': 'success', 'message': 'Alert resolved'})
@@ -1536,9 +2607,9 @@ def assign_alert(alert_id):
             return jsonify({'status': 'error', 'message': 'Missing service_id'}), 400
         connection = get_db_connection()
         cursor = connection.cursor()
-        query = "UPDATE emergency_alerts SET assigned_service_id = %s WHERE id = %s"
-        cursor.execute(query, (service_id, alert_id))
+        queries.run(cursor, 'alerts.assign', (service_id, alert_id))
         connection.commit()
+        db_router.note_write('emergency_alerts')
         return jsonify({'status': 'success', 'message': 'Alert assigned'})
     except Exception as e:
         print(f"Error assigning alert: {e}")
@@ -1565,8 +2636,7 @@ def create_report():
 
         connection = get_db_connection()
         cursor = connection.cursor()
-        query = "INSERT INTO reports (text, user_id, status, created_at) VALUES (%s, %s, %s, NOW())"
-        cursor.execute(query, (text, user_id, 'pending'))
+        queries.run(cursor, 'reports.insert', (text, user_id, 'pending'))
         connection.commit()
 
         return jsonify({'status': 'success', 'message': 'Report submitted successfully!'}), 201
@@ -1584,15 +2654,9 @@ def create_report():
 @app.route('/api/reports', methods=['GET'])
 def get_reports():
     try:
-        connection = get_db_connection()
+        connection = get_read_connection('reports', 'users')
         cursor = connection.cursor()
-        query = """
-            SELECT r.id, r.text, r.status, r.created_at, u.name as user_name
-            FROM reports r
-            LEFT JOIN users u ON r.user_id = u.id
-            ORDER BY r.created_at DESC
-        """
-        cursor.execute(query)
+        queries.run(cursor, 'reports.list')
         reports = cursor.fetchall()
         return jsonify(reports)
     except Exception as e:
@@ -1615,9 +2679,9 @@ def update_report_status(report_id):
             return jsonify({'status': 'error', 'message': 'Invalid status'}), 400
         connection = get_db_connection()
         cursor = connection.cursor()
-        query = "UPDATE reports SET status = %s WHERE id = %s"
-        cursor.execute(query, (status, report_id))
+        queries.run(cursor, 'reports.update_status', (status, report_id))
         connection.commit()
+        db_router.note_write('reports')
         return jsonify({'status': 'success', 'message': 'Report status updated'})
     except Exception as e:
         print(f"Error updating report status: {e}")
@@ -1650,4 +2714,12 @@ def handle_chat_message(data):
 
 # Run the Flask app with WebSocket support
 if __name__ == '__main__':
-    socketio.run(app, debug=True)
\ No newline at end of file
+    # Turn SIGTERM into a normal exit so the atexit flushes run
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    # Workers started by run_workers.py get their own PORT and no reloader
+    socketio.run(
+        app,
+        host=os.environ.get('HOST', '127.0.0.1'),
+        port=int(os.environ.get('PORT', 5000)),
+        debug=not MULTI_WORKER
+    )
\ No newline at end of file
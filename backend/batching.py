@@ -0,0 +1,37 @@
+import threading
+
+
+# Append-only write buffer.
+# Rows are collected in order and flush() hands them to writer(rows) in one
+# call. A failed batch is put back in front of anything added meanwhile.
+class AppendBuffer:
+    def __init__(self, writer, max_entries=500):
+        self.writer = writer
+        self.max_entries = max_entries
+        self.pending = []
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+
+    # Buffer a row, returns True when the buffer is full enough to flush
+    def add(self, row):
+        with self.lock:
+            self.pending.append(row)
+            return len(self.pending) >= self.max_entries
+
+    def __len__(self):
+        return len(self.pending)
+
+    # Write out everything buffered so far, returns the number of rows
+    def flush(self):
+        with self.flush_lock:
+            with self.lock:
+                batch, self.pending = self.pending, []
+            if not batch:
+                return 0
+            try:
+                self.writer(batch)
+            except Exception:
+                with self.lock:
+                    self.pending[:0] = batch
+                raise
+            return len(batch)
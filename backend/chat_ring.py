@@ -0,0 +1,130 @@
+import bisect
+import threading
+from collections import OrderedDict
+
+
+# Recent emergency chat messages per room, kept in process memory.
+# Each room holds its last per_room messages (id, user_id, message,
+# sent_at) in id order, together with known_after: every message of the
+# room with an id above it is in the ring. Only committed messages are
+# added, so a ring never shows something the database doesn't have.
+# Commit order isn't id order (a system message can commit after a later
+# batch), so late messages are inserted at their place by id.
+# Rooms are evicted when they close, and least recently used rooms are
+# dropped once all rings together hold more than max_messages.
+# per_room=0 turns the rings off (every query misses).
+class ChatRingBuffer:
+    def __init__(self, per_room=200, max_messages=100000):
+        self.per_room = per_room
+        self.max_messages = max_messages
+        self.rooms = OrderedDict()  # room_id -> {'messages': list by id, 'known_after': id, 'seeding': list or None}
+        self.total = 0
+        self.lock = threading.Lock()
+
+    # Start an empty ring for a room created in this process
+    def open(self, room_id):
+        if self.per_room <= 0:
+            return
+        with self.lock:
+            self.rooms[room_id] = {'messages': [], 'known_after': 0, 'seeding': None}
+            self._trim()
+
+    # Add committed messages (dicts with id) to the room's ring, if it has one
+    def append(self, room_id, messages):
+        with self.lock:
+            ring = self.rooms.get(room_id)
+            if ring is None:
+                return
+            if ring['seeding'] is not None:
+                # Seed query in flight, merged in seed_done()
+                ring['seeding'].extend(messages)
+                return
+            self._add(ring, messages)
+            self.rooms.move_to_end(room_id)
+            self._trim()
+
+    def _add(self, ring, messages):
+        buf = ring['messages']
+        for message in sorted(messages, key=lambda m: m['id']):
+            if message['id'] <= ring['known_after']:
+                # Older than what the ring covers, the database has it
+                continue
+            if not buf or message['id'] > buf[-1]['id']:
+                buf.append(message)
+            else:
+                i = bisect.bisect_left([m['id'] for m in buf], message['id'])
+                if buf[i]['id'] == message['id']:
+                    continue
+                buf.insert(i, message)
+            self.total += 1
+            if len(buf) > self.per_room:
+                ring['known_after'] = buf.pop(0)['id']
+                self.total -= 1
+
+    # Seeding a room from the database: call seed_start() before the query
+    # and seed_done() with its newest-first page afterwards, so messages
+    # committed while the query runs are not lost.
+    def seed_start(self, room_id):
+        if self.per_room <= 0:
+            return False
+        with self.lock:
+            if room_id in self.rooms:
+                return False
+            self.rooms[room_id] = {'messages': [], 'known_after': 0, 'seeding': []}
+            return True
+
+    # page: the newest `limit` messages of the room, oldest first
+    def seed_done(self, room_id, page, limit):
+        with self.lock:
+            ring = self.rooms.get(room_id)
+            if ring is None or ring['seeding'] is None:
+                return
+            # A full page may have older messages before it
+            ring['known_after'] = page[0]['id'] - 1 if len(page) >= limit else 0
+            pending, ring['seeding'] = ring['seeding'], None
+            self._add(ring, list(page) + pending)
+            self._trim()
+
+    def seed_failed(self, room_id):
+        with self.lock:
+            ring = self.rooms.get(room_id)
+            if ring is not None and ring['seeding'] is not None:
+                del self.rooms[room_id]
+
+    def drop(self, room_id):
+        with self.lock:
+            ring = self.rooms.pop(room_id, None)
+            if ring is not None:
+                self.total -= len(ring['messages'])
+
+    def _trim(self):
+        while self.total > self.max_messages and self.rooms:
+            _, ring = self.rooms.popitem(last=False)
+            self.total -= len(ring['messages'])
+
+    # Answer a history request from the ring, or None when it doesn't
+    # hold everything the request needs:
+    #   after_id  - messages after it, oldest first
+    #   before_id - the `limit` messages before it (newest when None)
+    def query(self, room_id, limit, after_id=None, before_id=None):
+        with self.lock:
+            ring = self.rooms.get(room_id)
+            if ring is None or ring['seeding'] is not None:
+                return None
+            self.rooms.move_to_end(room_id)
+            messages = list(ring['messages'])
+            known_after = ring['known_after']
+        if after_id is not None:
+            if after_id < known_after:
+                return None
+            return [m for m in messages if m['id'] > after_id][:limit]
+        if before_id is not None:
+            messages = [m for m in messages if m['id'] < before_id]
+        if len(messages) < limit and known_after > 0:
+            return None
+        return messages[-limit:]
+
+    def stats(self):
+        with self.lock:
+            return {'rooms': len(self.rooms), 'messages': self.total,
+                    'per_room': self.per_room, 'max_messages': self.max_messages}
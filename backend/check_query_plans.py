@@ -0,0 +1,386 @@
+import os
+import sys
+import json
+import time
+import argparse
+from datetime import datetime, timedelta
+import pymysql
+from geo import bounding_box_wkt
+from queries import QUERIES, ROLLUP_BUCKETS
+
+# Query plan check for every statement in queries.py.
+# Builds a scratch database with the schema of PLAN_CHECK_SOURCE_DB
+# (CREATE TABLE ... LIKE, so indexes and generated columns match), fills it
+# with a synthetic dataset, then runs EXPLAIN FORMAT=JSON on each named
+# query and times the SELECTs. A query fails when it reads more than
+# PLAN_CHECK_MAX_SCAN_ROWS rows with a full table or index scan, or sorts
+# more than that many rows with a filesort. Exits with 1 on any failure,
+# so it can run in CI after schema or query changes.
+#
+#   python check_query_plans.py --seed     # (re)create and fill the scratch database
+#   python check_query_plans.py            # check against the existing one
+#
+# Plain INSERT ... VALUES have no plan to check (INSERT ... SELECT is
+# checked like a SELECT, without being run). A new query without entry in
+# SAMPLE_PARAMS fails until it gets one.
+DB_HOST = os.environ.get('DB_HOST', 'localhost')
+DB_USER = os.environ.get('DB_USER', 'root')
+DB_PASSWORD = os.environ.get('DB_PASSWORD', 'password')
+PLAN_CHECK_SOURCE_DB = os.environ.get('PLAN_CHECK_SOURCE_DB', 'safety_db')
+PLAN_CHECK_DB = os.environ.get('PLAN_CHECK_DB', 'safety_db_plans')
+PLAN_CHECK_MAX_SCAN_ROWS = int(os.environ.get('PLAN_CHECK_MAX_SCAN_ROWS', 1000))
+
+# Rows per table in the synthetic dataset (--scale multiplies them)
+DATASET = {
+    'users': 100000,
+    'services': 500,
+    'emergency_alerts': 300000,
+    'emergency_chat_messages': 1000000,
+    'user_location_history': 500000,
+    'scheduled_jobs': 200,
+    'friends': 500000,
+    'friend_messages': 500000,
+    'blocked_users': 5000,
+    'reports': 20000,
+}
+
+# Users 1..TRAIL_USERS have location history
+TRAIL_USERS = 1000
+
+# Queries that read a whole table by design, and why
+EXPECTED_SCANS = {
+    'users.located': 'loads every located user into the proximity grid once per process',
+    'users.search': "substring search (LIKE '%q%') can't use a B-tree index",
+    'users.list': 'admin user list returns the whole table when unfiltered',
+    'users.count': 'InnoDB counts rows by scanning the smallest index',
+    'dashboard.counts': 'exact counts for reconciling the dashboard counters every few minutes',
+    'alerts.list': 'admin alert list returns the whole table when unfiltered',
+    'reports.list': 'admin report list returns the whole table',
+}
+
+# Synthetic rows, one INSERT ... SELECT over a generated sequence each.
+# {n} is the table's row count, {seq} the CTE numbering rows 1..n, and
+# other tables' counts are available by name.
+SEQ = "WITH RECURSIVE seq(n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM seq WHERE n < {n})"
+SEED_STATEMENTS = [
+    ('users', """
+        INSERT INTO users (name, email, password, phone, lat, lng, role, status)
+        {seq}
+        SELECT CONCAT('User ', n), CONCAT('user', n, '@plans.test'), 'x', CONCAT('+1-555-', n),
+               IF(n % 10 = 0, NULL, 40.5 + (n % 1000) / 2000),
+               IF(n % 10 = 0, NULL, -74.2 + (n DIV 1000 % 1000) / 2000),
+               IF(n % 1000 = 0, 'admin', 'user'), IF(n % 100 = 0, 'inactive', 'active')
+        FROM seq
+    """),
+    ('services', """
+        INSERT INTO services (company_name, email, password, service_type, phone, lat, lng)
+        {seq}
+        SELECT CONCAT('Service ', n), CONCAT('service', n, '@plans.test'), 'x',
+               ELT(1 + n % 4, 'fire', 'police', 'hospital', 'medical'), CONCAT('+1-555-', n),
+               40.5 + (n % 100) / 200, -74.2 + (n DIV 100) / 200
+        FROM seq
+    """),
+    # 2% of alerts are open, one per minute back from now, the others
+    # resolved 10 minutes later (LIKE doesn't copy the resolved_at trigger)
+    ('emergency_alerts', """
+        INSERT INTO emergency_alerts (user_id, type, details, latitude, longitude, resolved, created_at, resolved_at)
+        {seq}
+        SELECT 1 + (n * 7919) % {users}, ELT(1 + n % 6, 'teased', 'attacked', 'kidnapped', 'fire', 'accident', 'fire, accident'),
+               CONCAT('Alert ', n), 40.5 + (n % 1000) / 2000, -74.2 + (n DIV 1000 % 1000) / 2000,
+               IF(n % 50 = 0, 0, 1), NOW() - INTERVAL ({n} - n) MINUTE,
+               IF(n % 50 = 0, NULL, NOW() - INTERVAL ({n} - n - 10) MINUTE)
+        FROM seq
+    """),
+    # Hour and day rollups of the alerts above (created only)
+    ('alert_rollups', """
+        INSERT INTO alert_rollups (granularity, bucket_start, type, created, resolved)
+        SELECT 'hour', DATE_FORMAT(created_at, '%Y-%m-%d %H:00:00'), type, COUNT(*), 0
+        FROM emergency_alerts
+        GROUP BY DATE_FORMAT(created_at, '%Y-%m-%d %H:00:00'), type
+    """),
+    ('alert_rollups', """
+        INSERT INTO alert_rollups (granularity, bucket_start, type, created, resolved)
+        SELECT 'day', DATE(bucket_start), type, SUM(created), 0
+        FROM alert_rollups
+        WHERE granularity = 'hour'
+        GROUP BY DATE(bucket_start), type
+    """),
+    ('emergency_chats', """
+        INSERT INTO emergency_chats (alert_id, room_id, victim_id, closed)
+        SELECT id, CONCAT('room-', id), user_id, resolved FROM emergency_alerts
+    """),
+    ('emergency_chat_messages', """
+        INSERT INTO emergency_chat_messages (room_id, user_id, message, sent_at)
+        {seq}
+        SELECT CONCAT('room-', 1 + n % {emergency_alerts}), 1 + n % {users}, CONCAT('Message ', n),
+               NOW() - INTERVAL ({n} - n) SECOND
+        FROM seq
+    """),
+    ('user_location_history', """
+        INSERT INTO user_location_history (user_id, ts, lat_e7, lng_e7)
+        {seq}
+        SELECT 1 + n % {trail_users}, UNIX_TIMESTAMP() - (n DIV {trail_users}) * 5,
+               405000000 + n % 100000, -742000000 + n % 100000
+        FROM seq
+    """),
+    ('scheduled_jobs', """
+        INSERT INTO scheduled_jobs (job_name, job_key, payload, run_at)
+        {seq}
+        SELECT 'close_emergency_room', CONCAT('room-', n), JSON_OBJECT('room_id', CONCAT('room-', n)), UNIX_TIMESTAMP() + n
+        FROM seq
+    """),
+    # Row n links user (n-1) % users to the user k + 1 places after it, k = (n-1) DIV users
+    ('friends', """
+        INSERT INTO friends (user_id, friend_id, status)
+        {seq}
+        SELECT 1 + (n - 1) % {users}, 1 + ((n - 1) % {users} + 1 + (n - 1) DIV {users}) % {users},
+               IF(n % 10 = 0, 'pending', 'accepted')
+        FROM seq
+    """),
+    ('friend_messages', """
+        INSERT INTO friend_messages (sender_id, receiver_id, message, created_at)
+        {seq}
+        SELECT 1 + n % 5000, 1 + (n DIV 5000 + n) % 5000, CONCAT('Message ', n), NOW() - INTERVAL ({n} - n) SECOND
+        FROM seq
+    """),
+    ('blocked_users', """
+        INSERT INTO blocked_users (user_id, blocked_user_id)
+        {seq}
+        SELECT n, 1 + n % {users} FROM seq
+    """),
+    ('reports', """
+        INSERT INTO reports (user_id, text, status, created_at)
+        {seq}
+        SELECT 1 + n % {users}, CONCAT('Report ', n), ELT(1 + n % 3, 'pending', 'reviewed', 'resolved'),
+               NOW() - INTERVAL ({n} - n) MINUTE
+        FROM seq
+    """),
+]
+
+# Parameters (and fragments) to EXPLAIN each query with, from the sample
+# ids picked out of the dataset
+def user_location_rows(s):
+    rows = [(s['user_id'], 40.71, -74.0), (s['other_user_id'], 40.72, -74.01)]
+    values = ' UNION ALL '.join(['SELECT %s AS id, %s AS lat, %s AS lng'] * len(rows))
+    return [value for row in rows for value in row], {'values': values}
+
+def rollup_deltas(s):
+    rows = [(int(time.time()), 'fire', 1, 0), (int(time.time()), 'accident', 0, 1)]
+    deltas = ' UNION ALL '.join(['SELECT %s AS ts, %s AS type, %s AS created, %s AS resolved'] * len(rows))
+    return ['hour'] + [value for row in rows for value in row], {'bucket': ROLLUP_BUCKETS['hour'], 'deltas': deltas}
+
+def last_day():
+    return (datetime.now() - timedelta(days=1), datetime.now())
+
+SAMPLE_PARAMS = {
+    'users.located': lambda s: (None, {}),
+    'users.nearby': lambda s: ((bounding_box_wkt(40.7, -74.0, 2.0), s['user_id'], -74.0, 40.7, 2000), {}),
+    'users.nearest': lambda s: ((-74.0, 40.7, bounding_box_wkt(40.7, -74.0, 5.0), s['user_id'], 5000, 50), {}),
+    'users.profiles': lambda s: ([s['user_id'], s['other_user_id']], {'placeholders': '%s, %s'}),
+    'users.existing': lambda s: ([s['user_id'], s['other_user_id']], {'placeholders': '%s, %s'}),
+    'users.by_email': lambda s: ((s['email'],), {}),
+    'users.credentials': lambda s: ((s['email'],), {}),
+    'users.password': lambda s: ((s['user_id'],), {}),
+    'users.email_taken': lambda s: ((s['email'], s['user_id']), {}),
+    'users.update_profile': lambda s: (('Name', s['email'], '+1-555-0', s['user_id']), {}),
+    'users.update_password': lambda s: (('x', s['user_id']), {}),
+    'users.update': lambda s: (('Name', s['email'], '+1-555-0', 'user', 'active', s['user_id']), {}),
+    'users.delete': lambda s: ((s['user_id'],), {}),
+    'users.update_locations': user_location_rows,
+    'users.search': lambda s: (('%user1%', '%user1%', s['user_id']), {}),
+    'users.list': lambda s: ([], {'filters': ''}),
+    'users.count': lambda s: (None, {}),
+    'alerts.coalescable': lambda s: ((s['alert_user_id'], 120), {}),
+    'alerts.open_rooms_of': lambda s: ((s['alert_user_id'],), {}),
+    'alerts.resolve_all_of': lambda s: ((s['alert_user_id'],), {}),
+    'alerts.resolve': lambda s: ((s['alert_id'],), {}),
+    'alerts.owner_open_count': lambda s: ((s['alert_id'],), {}),
+    'alerts.counts_of_user': lambda s: ((s['alert_user_id'],), {}),
+    'alerts.active_users': lambda s: (None, {}),
+    'alerts.active_count': lambda s: (None, {}),
+    'alerts.resolved_count': lambda s: (None, {}),
+    'alerts.first_created': lambda s: (None, {}),
+    'alerts.open_fire': lambda s: (None, {}),
+    'alerts.open_medical': lambda s: (None, {}),
+    'alerts.list': lambda s: ([], {'filters': ''}),
+    'alerts.by_id': lambda s: ((s['alert_id'],), {}),
+    'alerts.assign': lambda s: ((1, s['alert_id']), {}),
+    'dashboard.counts': lambda s: (None, {}),
+    'rollups.add': rollup_deltas,
+    'rollups.range': lambda s: (('hour',) + last_day(), {}),
+    'rollups.clear': lambda s: (('hour',) + last_day(), {}),
+    'rollups.rebuild_created_hours': lambda s: (last_day(), {}),
+    'rollups.rebuild_resolved_hours': lambda s: (last_day(), {}),
+    'rollups.rebuild_days': lambda s: (last_day(), {}),
+    'rollups.lock': lambda s: ((0,), {}),
+    'rollups.unlock': lambda s: (None, {}),
+    'rooms.by_room_id': lambda s: ((s['room_id'],), {}),
+    'rooms.by_alert_id': lambda s: ((s['alert_id'],), {}),
+    'rooms.close': lambda s: ((s['room_id'],), {}),
+    'chat.after': lambda s: ((s['room_id'], 0, 200), {}),
+    'chat.newest': lambda s: ((s['room_id'], 200), {}),
+    'chat.before': lambda s: ((s['room_id'], 2 ** 31 - 1, 200), {}),
+    'location_history.expire': lambda s: ((int(time.time()) - 30 * 24 * 60 * 60,), {}),
+    'location_history.downsample': lambda s: ((60, int(time.time()) - 3600, 60, int(time.time()) - 3600), {}),
+    'location_history.trail': lambda s: ((1, int(time.time()) - 600), {}),
+    'jobs.delete': lambda s: (('close_emergency_room', 'room-1'), {}),
+    'jobs.claim': lambda s: (('close_emergency_room', 'room-1', time.time()), {}),
+    'jobs.pending': lambda s: (None, {}),
+    'friends.of_user': lambda s: ((s['user_id'], s['user_id']), {}),
+    'friends.row': lambda s: ((s['user_id'], s['other_user_id']), {}),
+    'friends.accept': lambda s: ((s['other_user_id'], s['user_id']), {}),
+    'friends.decline': lambda s: ((s['other_user_id'], s['user_id']), {}),
+    'friends.remove': lambda s: ((s['user_id'], s['other_user_id'], s['other_user_id'], s['user_id']), {}),
+    'friend_messages.newest': lambda s: ((1, 2, 50), {}),
+    'friend_messages.before': lambda s: ((1, 2, 2 ** 31 - 1, 50), {}),
+    'blocked.delete': lambda s: ((s['user_id'], s['other_user_id']), {}),
+    'blocked.of_user': lambda s: ((s['user_id'],), {}),
+    'services.by_email': lambda s: ((s['service_email'],), {}),
+    'services.credentials': lambda s: ((s['service_email'],), {}),
+    'services.profile': lambda s: ((s['service_email'],), {}),
+    'services.hospital_by_email': lambda s: ((s['service_email'],), {}),
+    'services.hospital_profile': lambda s: ((s['service_email'],), {}),
+    'services.phone': lambda s: ((s['company_name'], s['service_type']), {}),
+    'reports.list': lambda s: (None, {}),
+    'reports.update_status': lambda s: (('reviewed', 1), {}),
+}
+
+def connect(database=None):
+    return pymysql.connect(
+        host=DB_HOST, user=DB_USER, password=DB_PASSWORD, database=database,
+        cursorclass=pymysql.cursors.DictCursor, autocommit=True
+    )
+
+# Recreate PLAN_CHECK_DB with the source schema and fill it
+def seed(scale):
+    if PLAN_CHECK_DB == PLAN_CHECK_SOURCE_DB:
+        sys.exit('PLAN_CHECK_DB must not be the source database')
+    counts = {table: max(int(rows * scale), 1) for table, rows in DATASET.items()}
+    connection = connect()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT table_name AS name FROM information_schema.tables WHERE table_schema = %s AND table_type = 'BASE TABLE'",
+                           (PLAN_CHECK_SOURCE_DB,))
+            tables = [row['name'] for row in cursor.fetchall()]
+            if not tables:
+                sys.exit(f'No tables in {PLAN_CHECK_SOURCE_DB}; run database_setup.sql and the migrations first')
+            cursor.execute(f"DROP DATABASE IF EXISTS `{PLAN_CHECK_DB}`")
+            cursor.execute(f"CREATE DATABASE `{PLAN_CHECK_DB}`")
+            cursor.execute(f"USE `{PLAN_CHECK_DB}`")
+            # LIKE copies columns and indexes but not foreign keys or
+            # triggers, which keeps the bulk load simple
+            for table in tables:
+                cursor.execute(f"CREATE TABLE `{table}` LIKE `{PLAN_CHECK_SOURCE_DB}`.`{table}`")
+            cursor.execute("SET SESSION cte_max_recursion_depth = %s", (max(counts.values()) + 1,))
+            for table, statement in SEED_STATEMENTS:
+                started = time.time()
+                n = counts.get(table, 0)
+                cursor.execute(statement.format(
+                    seq=SEQ.format(n=n), n=n, trail_users=min(TRAIL_USERS, counts['users']), **counts
+                ))
+                print(f'{table}: {cursor.rowcount} rows in {time.time() - started:.1f}s')
+            for table in tables:
+                cursor.execute(f"ANALYZE TABLE `{table}`")
+                cursor.fetchall()
+    finally:
+        connection.close()
+
+# Ids and values the sample parameters refer to
+def pick_samples(cursor):
+    cursor.execute("SELECT id, email FROM users WHERE id = (SELECT MIN(user_id) FROM friends)")
+    user = cursor.fetchone()
+    cursor.execute("SELECT friend_id FROM friends WHERE user_id = %s LIMIT 1", (user['id'],))
+    friend = cursor.fetchone()
+    cursor.execute("SELECT id, user_id FROM emergency_alerts WHERE resolved = 0 ORDER BY id LIMIT 1")
+    alert = cursor.fetchone()
+    cursor.execute("SELECT room_id FROM emergency_chats WHERE alert_id = %s", (alert['id'],))
+    room = cursor.fetchone()
+    cursor.execute("SELECT email, company_name, service_type FROM services ORDER BY id LIMIT 1")
+    service = cursor.fetchone()
+    return {
+        'user_id': user['id'], 'email': user['email'], 'other_user_id': friend['friend_id'],
+        'alert_id': alert['id'], 'alert_user_id': alert['user_id'], 'room_id': room['room_id'],
+        'service_email': service['email'], 'company_name': service['company_name'],
+        'service_type': service['service_type'],
+    }
+
+# Problems in an EXPLAIN FORMAT=JSON plan: large full scans and filesorts
+def plan_problems(node, max_rows, problems=None):
+    problems = [] if problems is None else problems
+    if isinstance(node, dict):
+        table = node.get('table')
+        # Derived and temporary tables (<derived2>, <union1,2>) are sized by the query itself
+        if isinstance(table, dict) and not str(table.get('table_name', '')).startswith('<'):
+            rows = int(table.get('rows_examined_per_scan') or 0)
+            if table.get('access_type') in ('ALL', 'index') and rows > max_rows:
+                kind = 'full table scan' if table['access_type'] == 'ALL' else 'full index scan'
+                problems.append(f"{kind} on {table['table_name']} ({rows} rows)")
+        if node.get('using_filesort'):
+            rows = max(sorted_rows(node), default=0)
+            if rows > max_rows:
+                problems.append(f'filesort of {rows} rows')
+        for value in node.values():
+            plan_problems(value, max_rows, problems)
+    elif isinstance(node, list):
+        for value in node:
+            plan_problems(value, max_rows, problems)
+    return problems
+
+def sorted_rows(node):
+    if isinstance(node, dict):
+        table = node.get('table')
+        if isinstance(table, dict):
+            yield int(table.get('rows_produced_per_join') or 0)
+        for value in node.values():
+            yield from sorted_rows(value)
+    elif isinstance(node, list):
+        for value in node:
+            yield from sorted_rows(value)
+
+def check(max_rows):
+    connection = connect(PLAN_CHECK_DB)
+    failures = 0
+    try:
+        with connection.cursor() as cursor:
+            samples = pick_samples(cursor)
+            for name, sql in QUERIES.items():
+                if sql.lstrip().upper().startswith('INSERT') and 'SELECT' not in sql.upper():
+                    continue
+                if name not in SAMPLE_PARAMS:
+                    print(f'FAIL    {name}: no sample parameters in SAMPLE_PARAMS')
+                    failures += 1
+                    continue
+                params, fragments = SAMPLE_PARAMS[name](samples)
+                statement = sql.format(**fragments) if fragments else sql
+                cursor.execute('EXPLAIN FORMAT=JSON ' + statement, params)
+                plan = json.loads(cursor.fetchone()['EXPLAIN'])
+                problems = plan_problems(plan, max_rows)
+                elapsed = ''
+                if statement.lstrip().upper().startswith('SELECT'):
+                    started = time.perf_counter()
+                    cursor.execute(statement, params)
+                    cursor.fetchall()
+                    elapsed = f' [{(time.perf_counter() - started) * 1000:.1f} ms]'
+                if not problems:
+                    print(f'ok      {name}{elapsed}')
+                elif name in EXPECTED_SCANS:
+                    print(f'allowed {name}{elapsed}: {"; ".join(problems)} ({EXPECTED_SCANS[name]})')
+                else:
+                    print(f'FAIL    {name}{elapsed}: {"; ".join(problems)}')
+                    failures += 1
+    finally:
+        connection.close()
+    return failures
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='EXPLAIN every named query against a seeded dataset')
+    parser.add_argument('--seed', action='store_true', help=f'recreate and fill {PLAN_CHECK_DB} first')
+    parser.add_argument('--scale', type=float, default=1.0, help='multiplier for the dataset row counts')
+    parser.add_argument('--max-rows', type=int, default=PLAN_CHECK_MAX_SCAN_ROWS,
+                        help='largest full scan or filesort allowed')
+    args = parser.parse_args()
+    if args.seed:
+        seed(args.scale)
+    failures = check(args.max_rows)
+    print(f'{failures} failing queries' if failures else 'All query plans ok')
+    sys.exit(1 if failures else 0)
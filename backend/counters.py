@@ -0,0 +1,46 @@
+import threading
+import time
+
+
+# Running totals kept in memory and adjusted by the code that changes them,
+# so reading them costs nothing however big the tables get.
+# load() returns the exact values ({name: count}); it runs on the first read
+# and on every reconcile(), which also reports how far the running totals
+# had drifted (writes by other processes, cascading deletes, ...).
+# Changes made before the first load are ignored, the load counts them.
+class Counters:
+    def __init__(self, load):
+        self.load = load
+        self.values = None
+        self.reconciled_at = None
+        self.lock = threading.Lock()
+        self.load_lock = threading.Lock()
+
+    def add(self, **deltas):
+        with self.lock:
+            if self.values is None:
+                return
+            for name, delta in deltas.items():
+                self.values[name] = self.values.get(name, 0) + delta
+
+    # Replace the running totals with exact ones; returns {name: drift}
+    def reconcile(self):
+        with self.load_lock:
+            return self._reload()
+
+    def _reload(self):
+        values = {name: int(value or 0) for name, value in self.load().items()}
+        with self.lock:
+            previous, self.values = self.values, values
+            self.reconciled_at = time.time()
+        if previous is None:
+            return {}
+        return {name: previous.get(name, 0) - value for name, value in values.items() if previous.get(name, 0) != value}
+
+    def snapshot(self):
+        if self.values is None:
+            with self.load_lock:
+                if self.values is None:
+                    self._reload()
+        with self.lock:
+            return dict(self.values), self.reconciled_at
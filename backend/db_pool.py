@@ -0,0 +1,170 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from pymysql.constants import SERVER_STATUS
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+# Bounded pool of database connections made with connect().
+# checkout() hands out a PooledConnection whose close() puts the
+# connection back, so code written against plain connections keeps working;
+# connection() is the context-manager form. Connections idle for longer
+# than ping_after_s are pinged before reuse, and connections older than
+# max_age_s are replaced. When all max_size connections are in use,
+# checkout() waits up to timeout_s (polling with sleep, so it also
+# cooperates under eventlet) and then raises PoolTimeout.
+class ConnectionPool:
+    def __init__(self, connect, max_size=10, timeout_s=5.0, max_age_s=1800.0, ping_after_s=30.0, sleep=time.sleep):
+        self.connect = connect
+        self.max_size = max_size
+        self.timeout_s = timeout_s
+        self.max_age_s = max_age_s
+        self.ping_after_s = ping_after_s
+        self.sleep = sleep
+        self.idle = deque()   # (connection, created, last_used), most recently used last
+        self.in_use = 0
+        self.lock = threading.Lock()
+        self.totals = {'checkouts': 0, 'created': 0, 'discarded': 0, 'ping_failures': 0,
+                       'timeouts': 0, 'waits': 0, 'wait_ms_total': 0.0, 'wait_ms_max': 0.0}
+
+    def checkout(self):
+        started = time.time()
+        waited = False
+        while True:
+            with self.lock:
+                # in_use + idle never exceeds max_size
+                if self.in_use < self.max_size:
+                    entry = self.idle.pop() if self.idle else None
+                    self.in_use += 1
+                    break
+            if time.time() - started >= self.timeout_s:
+                with self.lock:
+                    self.totals['timeouts'] += 1
+                raise PoolTimeout(f'No database connection free after {self.timeout_s}s ({self.max_size} in use)')
+            waited = True
+            self.sleep(0.005)
+        if waited:
+            self._record_wait((time.time() - started) * 1000)
+        try:
+            conn, created = self._usable(entry)
+        except Exception:
+            with self.lock:
+                self.in_use -= 1
+            raise
+        with self.lock:
+            self.totals['checkouts'] += 1
+        return PooledConnection(self, conn, created)
+
+    # The idle connection if it is still good, otherwise a new one
+    def _usable(self, entry):
+        now = time.time()
+        if entry is not None:
+            conn, created, last_used = entry
+            if now - created >= self.max_age_s:
+                self._discard(conn)
+            elif now - last_used >= self.ping_after_s:
+                try:
+                    conn.ping(reconnect=False)
+                    return conn, created
+                except Exception:
+                    with self.lock:
+                        self.totals['ping_failures'] += 1
+                    self._discard(conn)
+            else:
+                return conn, created
+        conn = self.connect()
+        with self.lock:
+            self.totals['created'] += 1
+        return conn, time.time()
+
+    def _record_wait(self, wait_ms):
+        with self.lock:
+            self.totals['waits'] += 1
+            self.totals['wait_ms_total'] += wait_ms
+            self.totals['wait_ms_max'] = max(self.totals['wait_ms_max'], wait_ms)
+
+    def _discard(self, conn):
+        with self.lock:
+            self.totals['discarded'] += 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def release(self, conn, created, broken=False):
+        try:
+            # Never hand an open transaction to the next user
+            if not broken and conn.open and conn.server_status & SERVER_STATUS.SERVER_STATUS_IN_TRANS:
+                conn.rollback()
+        except Exception:
+            broken = True
+        keep = not broken and conn.open and time.time() - created < self.max_age_s
+        with self.lock:
+            self.in_use -= 1
+            if keep:
+                self.idle.append((conn, created, time.time()))
+        if not keep:
+            self._discard(conn)
+
+    @contextmanager
+    def connection(self):
+        conn = self.checkout()
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def close_idle(self):
+        with self.lock:
+            idle, self.idle = list(self.idle), deque()
+        for conn, _, _ in idle:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def stats(self):
+        with self.lock:
+            totals = dict(self.totals)
+            stats = dict(totals, in_use=self.in_use, idle=len(self.idle), max_size=self.max_size)
+        stats['wait_ms_avg'] = round(totals['wait_ms_total'] / totals['waits'], 3) if totals['waits'] else 0.0
+        stats['wait_ms_total'] = round(totals['wait_ms_total'], 3)
+        stats['wait_ms_max'] = round(totals['wait_ms_max'], 3)
+        return stats
+
+
+# A checked-out connection. Everything but close() goes to the pymysql
+# connection; close() returns it to the pool (once). A connection that is
+# dropped without close() is returned when the wrapper is collected.
+class PooledConnection:
+    def __init__(self, pool, conn, created):
+        self._pool = pool
+        self._conn = conn
+        self._created = created
+
+    def __getattr__(self, name):
+        conn = self.__dict__.get('_conn')
+        if conn is None:
+            raise AttributeError(name)
+        return getattr(conn, name)
+
+    def close(self):
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            self._pool.release(conn, self._created)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
@@ -0,0 +1,103 @@
+import itertools
+import threading
+import time
+
+
+# Sends reads that can tolerate a little staleness to replica pools.
+# checkout_read() hands out a connection from the next healthy replica
+# (round robin) and falls back to the primary pool when:
+#   - there are no replicas, or none is healthy,
+#   - a replica is more than max_lag_s behind (SHOW REPLICA STATUS), or its
+#     replication threads are stopped, or it can't be reached,
+#   - one of the request's tables was written by this process through
+#     note_write() in the last max_lag_s seconds (read-your-own-writes).
+# Lag is checked lazily, at most every check_interval_s per replica. A
+# server that isn't a replica reports no status and counts as lag 0, so
+# the primary itself can stand in as the "replica" for local testing.
+class ReplicaRouter:
+    def __init__(self, primary, replicas=(), max_lag_s=5.0, check_interval_s=2.0):
+        self.primary = primary
+        self.replicas = [
+            {'name': name, 'pool': pool, 'lag_s': None, 'healthy': False, 'checked': 0.0, 'error': None, 'reads': 0}
+            for name, pool in replicas
+        ]
+        self.max_lag_s = max_lag_s
+        self.check_interval_s = check_interval_s
+        self.order = itertools.cycle(range(len(self.replicas))) if self.replicas else None
+        self.written = {}  # table -> time of the last write noted
+        self.lock = threading.Lock()
+        self.totals = {'replica_reads': 0, 'primary_reads': 0, 'pinned_reads': 0, 'lagging_fallbacks': 0}
+
+    # A write to tables, so reads of them stay on the primary for a while
+    def note_write(self, *tables):
+        now = time.time()
+        with self.lock:
+            for table in tables:
+                self.written[table] = now
+
+    def _pinned(self, tables):
+        now = time.time()
+        with self.lock:
+            return any(now - self.written.get(table, 0) < self.max_lag_s for table in tables)
+
+    def checkout_read(self, tables=()):
+        if not self.replicas:
+            return self._primary('primary_reads')
+        if self._pinned(tables):
+            return self._primary('pinned_reads')
+        for _ in range(len(self.replicas)):
+            with self.lock:
+                replica = self.replicas[next(self.order)]
+            if not self._healthy(replica):
+                continue
+            try:
+                conn = replica['pool'].checkout()
+            except Exception as e:
+                self._mark(replica, None, e)
+                continue
+            with self.lock:
+                replica['reads'] += 1
+                self.totals['replica_reads'] += 1
+            return conn
+        return self._primary('lagging_fallbacks')
+
+    def _primary(self, reason):
+        with self.lock:
+            self.totals[reason] += 1
+        return self.primary.checkout()
+
+    def _healthy(self, replica):
+        if time.time() - replica['checked'] >= self.check_interval_s:
+            self._check(replica)
+        return replica['healthy']
+
+    def _check(self, replica):
+        try:
+            with replica['pool'].connection() as conn, conn.cursor() as cursor:
+                cursor.execute("SHOW REPLICA STATUS")
+                status = cursor.fetchone()
+        except Exception as e:
+            self._mark(replica, None, e)
+            return
+        if status is None:
+            # Not a replica (e.g. the primary standing in for one)
+            self._mark(replica, 0, None)
+        else:
+            lag = status.get('Seconds_Behind_Source')
+            self._mark(replica, lag, None if lag is not None else 'replication stopped')
+
+    def _mark(self, replica, lag_s, error):
+        with self.lock:
+            replica['lag_s'] = lag_s
+            replica['healthy'] = lag_s is not None and lag_s <= self.max_lag_s
+            replica['error'] = str(error) if error else None
+            replica['checked'] = time.time()
+
+    def stats(self):
+        with self.lock:
+            replicas = [
+                {'name': r['name'], 'lag_s': r['lag_s'], 'healthy': r['healthy'], 'error': r['error'],
+                 'reads': r['reads'], 'pool': r['pool'].stats()}
+                for r in self.replicas
+            ]
+            return dict(self.totals, max_lag_s=self.max_lag_s, replicas=replicas)
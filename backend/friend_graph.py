@@ -0,0 +1,130 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+# In-process cache of the friends table as adjacency sets.
+# A user's relationships are loaded lazily on first use with loader(user_id),
+# which returns (friend rows, profile rows):
+#   friend rows  - every friends row with user_id or friend_id = user_id
+#   profile rows - id, name, email, phone, status of the user and the
+#                  people in those rows
+# Write endpoints invalidate the users they touch. Invalidations only
+# reach this process, so with several workers ttl_s bounds how long an
+# entry or a cached profile is trusted.
+class FriendGraph:
+    def __init__(self, loader, max_users=50000, ttl_s=None):
+        self.loader = loader
+        self.max_users = max_users
+        self.ttl_s = ttl_s
+        self.entries = OrderedDict()  # user id -> adjacency sets, LRU order
+        self.profiles = {}            # user id -> (profile dict, loaded_at)
+        self.lock = threading.RLock()
+
+    def _entry(self, user_id):
+        user_id = int(user_id)
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry is not None and self._fresh(entry['loaded_at']):
+                self.entries.move_to_end(user_id)
+                return entry
+        friend_rows, profile_rows = self.loader(user_id)
+        entry = {
+            'accepted_out': set(),  # user_id -> friend accepted
+            'accepted_in': set(),   # friend -> user_id accepted
+            'pending_out': set(),   # requests user_id sent
+            'pending_in': set(),    # requests user_id received
+            'loaded_at': time.time(),
+        }
+        for row in friend_rows:
+            if row['user_id'] == user_id:
+                key = 'accepted_out' if row['status'] == 'accepted' else 'pending_out' if row['status'] == 'pending' else None
+                other = row['friend_id']
+            else:
+                key = 'accepted_in' if row['status'] == 'accepted' else 'pending_in' if row['status'] == 'pending' else None
+                other = row['user_id']
+            if key:
+                entry[key].add(other)
+        with self.lock:
+            for row in profile_rows:
+                self.profiles[row['id']] = (dict(row), entry['loaded_at'])
+            self.entries[user_id] = entry
+            while len(self.entries) > self.max_users:
+                self.entries.popitem(last=False)
+        return entry
+
+    def _fresh(self, loaded_at):
+        return self.ttl_s is None or time.time() - loaded_at < self.ttl_s
+
+    # Cached profile, or None when missing or older than ttl_s
+    def _cached_profile(self, user_id):
+        with self.lock:
+            cached = self.profiles.get(user_id)
+        if cached is not None and self._fresh(cached[1]):
+            return cached[0]
+        return None
+
+    # Accepted friends in either direction (who gets the victim's alerts)
+    def accepted_friends(self, user_id):
+        entry = self._entry(user_id)
+        return entry['accepted_out'] | entry['accepted_in']
+
+    # Friends as listed by /api/friends/list (rows owned by user_id)
+    def friends_of(self, user_id):
+        return set(self._entry(user_id)['accepted_out'])
+
+    def pending_out(self, user_id):
+        return set(self._entry(user_id)['pending_out'])
+
+    def pending_in(self, user_id):
+        return set(self._entry(user_id)['pending_in'])
+
+    # Everyone with a pending or accepted relationship to user_id
+    def related(self, user_id):
+        entry = self._entry(user_id)
+        return entry['accepted_out'] | entry['accepted_in'] | entry['pending_out'] | entry['pending_in']
+
+    def profile(self, user_id):
+        user_id = int(user_id)
+        profile = self._cached_profile(user_id)
+        if profile is None:
+            # Reload the entry, which also brings back the user's own profile
+            self.invalidate(user_id)
+            self._entry(user_id)
+            profile = self._cached_profile(user_id)
+        return profile
+
+    # Profiles for ids, fetching the missing ones with fetch(ids)
+    def profiles_for(self, user_ids, fetch):
+        user_ids = [int(uid) for uid in user_ids]
+        found = {uid: self._cached_profile(uid) for uid in user_ids}
+        missing = [uid for uid, profile in found.items() if profile is None]
+        if missing:
+            rows = fetch(missing)
+            loaded_at = time.time()
+            with self.lock:
+                for row in rows:
+                    self.profiles[row['id']] = (dict(row), loaded_at)
+                    found[row['id']] = dict(row)
+        return [found[uid] for uid in user_ids if found.get(uid) is not None]
+
+    # Drop cached relationships after a write to the friends table
+    def invalidate(self, *user_ids):
+        with self.lock:
+            for user_id in user_ids:
+                self.entries.pop(int(user_id), None)
+
+    # Drop a cached profile after the user row changed
+    def invalidate_profile(self, user_id):
+        with self.lock:
+            self.profiles.pop(int(user_id), None)
+
+    # Remove every trace of a deleted user
+    def forget_user(self, user_id):
+        user_id = int(user_id)
+        with self.lock:
+            self.entries.pop(user_id, None)
+            self.profiles.pop(user_id, None)
+            for entry in self.entries.values():
+                for key in ('accepted_out', 'accepted_in', 'pending_out', 'pending_in'):
+                    entry[key].discard(user_id)
@@ -0,0 +1,240 @@
+import math
+import threading
+import numpy as np
+
+# Earth radius in km
+EARTH_RADIUS_KM = 6371.0
+# Length of one degree of latitude in km, on the same sphere as haversine()
+# so bounding boxes always contain the whole search circle
+KM_PER_DEG_LAT = EARTH_RADIUS_KM * math.pi / 180
+
+
+# Calculate distance between two points
+def haversine(lat1, lng1, lat2, lng2):
+    R = EARTH_RADIUS_KM
+    lat1, lng1, lat2, lng2 = map(math.radians, [lat1, lng1, lat2, lng2])
+    dlat = lat2 - lat1
+    dlng = lng2 - lng1
+    a = math.sin(dlat/2)**2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlng/2)**2
+    c = 2 * math.asin(math.sqrt(a))
+    return R * c
+
+
+# Vectorized haversine: distances (km) from one origin to arrays of points.
+# haversine() above stays the scalar reference for this.
+def haversine_many(lat, lng, lats, lngs):
+    lat, lng = math.radians(float(lat)), math.radians(float(lng))
+    lats = np.radians(np.asarray(lats, dtype=np.float64))
+    lngs = np.radians(np.asarray(lngs, dtype=np.float64))
+    a = np.sin((lats - lat) / 2)**2 + math.cos(lat) * np.cos(lats) * np.sin((lngs - lng) / 2)**2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+# Boolean mask of the points within radius_km of the origin
+def within_radius(lat, lng, lats, lngs, radius_km):
+    return haversine_many(lat, lng, lats, lngs) <= radius_km
+
+# Sort rows by distance from the origin, adding a distance_km field to each.
+# Rows without coordinates go last.
+def rank_by_distance(rows, lat, lng, lat_key='lat', lng_key='lng'):
+    located = [row for row in rows if row.get(lat_key) is not None and row.get(lng_key) is not None]
+    missing = [row for row in rows if row.get(lat_key) is None or row.get(lng_key) is None]
+    if located:
+        distances = haversine_many(
+            lat, lng,
+            [float(row[lat_key]) for row in located],
+            [float(row[lng_key]) for row in located],
+        )
+        for row, distance in zip(located, distances):
+            row['distance_km'] = round(float(distance), 3)
+        located.sort(key=lambda row: row['distance_km'])
+    for row in missing:
+        row['distance_km'] = None
+    return located + missing
+
+
+# Helper search for a (possibly combined) alert type, from the per-type
+# settings {'k': n or None, 'max_radius_km': km}. Each kind of search keeps
+# its own types' limits, so a combination never notifies more than its
+# types would together:
+#   radius_km            - everyone within the largest radius of the k None types
+#   k, k_max_radius_km   - the largest k of the other types, within their largest radius
+# Either part is None when no type asks for it.
+def combine_helper_searches(configs):
+    radius_only = [c['max_radius_km'] for c in configs if c['k'] is None]
+    bounded = [c for c in configs if c['k'] is not None]
+    return {
+        'radius_km': max(radius_only) if radius_only else None,
+        'k': max(c['k'] for c in bounded) if bounded else None,
+        'k_max_radius_km': max(c['max_radius_km'] for c in bounded) if bounded else None,
+    }
+
+# Ids to notify for a combined search, given the backend's searches:
+# within(radius_km) -> ids, nearest(k, max_radius_km) -> ids nearest first.
+# Nearest first, then the rest of the radius search.
+def find_helpers(search, within, nearest):
+    ids = list(nearest(search['k'], search['k_max_radius_km'])) if search['k'] else []
+    if search['radius_km'] is not None:
+        seen = set(ids)
+        ids.extend(uid for uid in within(search['radius_km']) if uid not in seen)
+    return ids
+
+
+# Lat/lng degree spans of the box enclosing a circle of radius_km
+def bounding_box(lat, lng, radius_km):
+    lat, lng = float(lat), float(lng)
+    dlat = radius_km / KM_PER_DEG_LAT
+    cos_lat = max(math.cos(math.radians(lat)), 1e-6)
+    dlng = min(radius_km / (KM_PER_DEG_LAT * cos_lat), 180.0)
+    return lat - dlat, lng - dlng, lat + dlat, lng + dlng
+
+# WKT polygon (long-lat axis order) of the bounding box, for MBRContains
+def bounding_box_wkt(lat, lng, radius_km):
+    min_lat, min_lng, max_lat, max_lng = bounding_box(lat, lng, radius_km)
+    corners = [(min_lng, min_lat), (max_lng, min_lat), (max_lng, max_lat), (min_lng, max_lat), (min_lng, min_lat)]
+    return 'POLYGON((' + ','.join(f'{x:.8f} {y:.8f}' for x, y in corners) + '))'
+
+
+# Uniform lat/lng cell grid of user positions kept in process memory.
+# A radius query only visits the cells overlapping the search box and then
+# runs an exact haversine check on the users found there.
+class LocationGrid:
+    def __init__(self, cell_size_deg=0.02):
+        self.cell_size = cell_size_deg
+        self.cells = {}       # (row, col) -> set of user ids
+        self.positions = {}   # user id -> (lat, lng, (row, col))
+        self.loaded = False
+        self.lock = threading.RLock()
+
+    def _cell(self, lat, lng):
+        return (math.floor(lat / self.cell_size), math.floor(lng / self.cell_size))
+
+    # Fill the grid once from (id, lat, lng) rows returned by loader()
+    def ensure_loaded(self, loader):
+        if self.loaded:
+            return
+        with self.lock:
+            if self.loaded:
+                return
+            for row in loader():
+                self._put(row['id'], row['lat'], row['lng'])
+            self.loaded = True
+
+    def _put(self, user_id, lat, lng):
+        user_id = int(user_id)
+        lat, lng = float(lat), float(lng)
+        cell = self._cell(lat, lng)
+        old = self.positions.get(user_id)
+        if old and old[2] != cell:
+            members = self.cells.get(old[2])
+            if members is not None:
+                members.discard(user_id)
+                if not members:
+                    del self.cells[old[2]]
+        self.cells.setdefault(cell, set()).add(user_id)
+        self.positions[user_id] = (lat, lng, cell)
+
+    # Insert or move a user
+    def update(self, user_id, lat, lng):
+        if lat is None or lng is None:
+            self.remove(user_id)
+            return
+        with self.lock:
+            self._put(user_id, lat, lng)
+
+    def remove(self, user_id):
+        with self.lock:
+            old = self.positions.pop(int(user_id), None)
+            if old:
+                members = self.cells.get(old[2])
+                if members is not None:
+                    members.discard(int(user_id))
+                    if not members:
+                        del self.cells[old[2]]
+
+    def get(self, user_id):
+        pos = self.positions.get(int(user_id))
+        return (pos[0], pos[1]) if pos else None
+
+    # Users whose cell overlaps the bounding box of the radius
+    def candidates(self, lat, lng, radius_km):
+        min_lat, min_lng, max_lat, max_lng = bounding_box(lat, lng, radius_km)
+        row_min, col_min = self._cell(min_lat, min_lng)
+        row_max, col_max = self._cell(max_lat, max_lng)
+        found = []
+        with self.lock:
+            for row in range(row_min, row_max + 1):
+                for col in range(col_min, col_max + 1):
+                    for user_id in self.cells.get((row, col), ()):
+                        pos = self.positions[user_id]
+                        found.append((user_id, pos[0], pos[1]))
+        return found
+
+    # Up to k nearest users within max_radius_km, nearest first, as
+    # (user id, distance km). Cells are searched in rings around the
+    # point's cell, stopping once k users are known to be closer than
+    # anything in the unsearched rings.
+    def nearest(self, lat, lng, k, max_radius_km, exclude=None):
+        lat, lng = float(lat), float(lng)
+        exclude = int(exclude) if exclude is not None else None
+        center_row, center_col = self._cell(lat, lng)
+        min_lat, min_lng, max_lat, max_lng = bounding_box(lat, lng, max_radius_km)
+        row_min, col_min = self._cell(min_lat, min_lng)
+        row_max, col_max = self._cell(max_lat, max_lng)
+        max_ring = max(center_row - row_min, row_max - center_row, center_col - col_min, col_max - center_col)
+
+        ids, distances = [], []
+        ring = 0
+        while ring <= max_ring:
+            found = []
+            with self.lock:
+                for row, col in self._ring_cells(center_row, center_col, ring):
+                    if row_min <= row <= row_max and col_min <= col <= col_max:
+                        for user_id in self.cells.get((row, col), ()):
+                            if user_id != exclude:
+                                pos = self.positions[user_id]
+                                found.append((user_id, pos[0], pos[1]))
+            if found:
+                found_ids, lats, lngs = zip(*found)
+                ids.extend(found_ids)
+                distances.extend(haversine_many(lat, lng, lats, lngs).tolist())
+            covered_km = min(self._covered_km(lat, lng, center_row, center_col, ring), max_radius_km)
+            if sum(1 for d in distances if d <= covered_km) >= k:
+                break
+            ring += 1
+
+        ranked = sorted((d, user_id) for user_id, d in zip(ids, distances) if d <= max_radius_km)
+        return [(user_id, d) for d, user_id in ranked[:k]]
+
+    # Cells at Chebyshev distance ring from the center cell
+    def _ring_cells(self, center_row, center_col, ring):
+        if ring == 0:
+            return [(center_row, center_col)]
+        cells = []
+        for col in range(center_col - ring, center_col + ring + 1):
+            cells.append((center_row - ring, col))
+            cells.append((center_row + ring, col))
+        for row in range(center_row - ring + 1, center_row + ring):
+            cells.append((row, center_col - ring))
+            cells.append((row, center_col + ring))
+        return cells
+
+    # Distance (km) from the point to the edge of the searched block of cells
+    def _covered_km(self, lat, lng, center_row, center_col, ring):
+        south = lat - (center_row - ring) * self.cell_size
+        north = (center_row + ring + 1) * self.cell_size - lat
+        west = lng - (center_col - ring) * self.cell_size
+        east = (center_col + ring + 1) * self.cell_size - lng
+        # Longitude degrees are shortest at the edge farthest from the equator
+        far_lat = max(abs((center_row - ring) * self.cell_size), abs((center_row + ring + 1) * self.cell_size))
+        cos_lat = max(math.cos(math.radians(min(far_lat, 90.0))), 1e-6)
+        return min(min(south, north) * KM_PER_DEG_LAT, min(west, east) * KM_PER_DEG_LAT * cos_lat)
+
+    # Ids of users within radius_km of (lat, lng)
+    def query_radius(self, lat, lng, radius_km, exclude=None):
+        exclude = int(exclude) if exclude is not None else None
+        found = [c for c in self.candidates(lat, lng, radius_km) if c[0] != exclude]
+        if not found:
+            return []
+        ids, lats, lngs = zip(*found)
+        mask = within_radius(lat, lng, lats, lngs, radius_km)
+        return [user_id for user_id, keep in zip(ids, mask) if keep]
@@ -0,0 +1,122 @@
+import threading
+from batching import AppendBuffer
+
+
+# Write-behind buffer for user locations.
+# Only the latest position per user is kept; flush() hands the whole batch
+# to writer(rows) with rows as (user_id, lat, lng). A failed batch is put
+# back unless a newer position arrived for the same user meanwhile.
+class LocationWriteBuffer:
+    def __init__(self, writer, max_entries=500):
+        self.writer = writer
+        self.max_entries = max_entries
+        self.pending = {}  # user_id -> (lat, lng)
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+
+    # Buffer a position, returns True when the buffer is full enough to flush
+    def add(self, user_id, lat, lng):
+        with self.lock:
+            self.pending[int(user_id)] = (float(lat), float(lng))
+            return len(self.pending) >= self.max_entries
+
+    def get(self, user_id):
+        return self.pending.get(int(user_id))
+
+    def __len__(self):
+        return len(self.pending)
+
+    # Write out everything buffered so far, returns the number of rows
+    def flush(self):
+        with self.flush_lock:
+            with self.lock:
+                batch, self.pending = self.pending, {}
+            if not batch:
+                return 0
+            try:
+                self.writer([(user_id, lat, lng) for user_id, (lat, lng) in batch.items()])
+            except Exception:
+                with self.lock:
+                    for user_id, position in batch.items():
+                        self.pending.setdefault(user_id, position)
+                raise
+            return len(batch)
+
+
+# Fixed-point encoding used by the location history table (1e-7 degrees, ~1 cm)
+def to_e7(degrees):
+    return int(round(float(degrees) * 10**7))
+
+def from_e7(value):
+    return value / 10.0**7
+
+
+# Location history points, stored as (user_id, ts, lat_e7, lng_e7) rows
+class LocationHistoryBuffer(AppendBuffer):
+    def __init__(self, writer, max_entries=5000):
+        AppendBuffer.__init__(self, writer, max_entries)
+
+    def add(self, user_id, ts, lat, lng):
+        return AppendBuffer.add(self, (int(user_id), int(ts), to_e7(lat), to_e7(lng)))
+
+
+# Server-side throttle for streamed location updates.
+# An update is dropped when it arrives less than min_interval_s after the
+# user's last accepted one, or moved less than min_move_m from it.
+# Accepted/dropped counts are kept per second for rate reporting.
+class LocationThrottle:
+    def __init__(self, distance_km, min_move_m=25.0, min_interval_s=5.0, window_s=60):
+        self.distance_km = distance_km
+        self.min_move_m = min_move_m
+        self.min_interval_s = min_interval_s
+        self.window_s = window_s
+        self.last = {}     # user_id -> (lat, lng, ts) of the last accepted update
+        self.buckets = {}  # int(ts) -> {'accepted': n, 'dropped_interval': n, 'dropped_distance': n}
+        self.totals = {'accepted': 0, 'dropped_interval': 0, 'dropped_distance': 0}
+        self.lock = threading.Lock()
+
+    # Returns 'accepted', 'dropped_interval' or 'dropped_distance'
+    def check(self, user_id, lat, lng, now):
+        user_id, lat, lng = int(user_id), float(lat), float(lng)
+        with self.lock:
+            last = self.last.get(user_id)
+            if last and now - last[2] < self.min_interval_s:
+                outcome = 'dropped_interval'
+            elif last and self.distance_km(last[0], last[1], lat, lng) * 1000 < self.min_move_m:
+                outcome = 'dropped_distance'
+            else:
+                outcome = 'accepted'
+                self.last[user_id] = (lat, lng, now)
+            self._count(outcome, now)
+        return outcome
+
+    def forget(self, user_id):
+        with self.lock:
+            self.last.pop(int(user_id), None)
+
+    def _count(self, outcome, now):
+        self.totals[outcome] += 1
+        second = int(now)
+        bucket = self.buckets.get(second)
+        if bucket is None:
+            bucket = self.buckets[second] = {'accepted': 0, 'dropped_interval': 0, 'dropped_distance': 0}
+            for old in [s for s in self.buckets if s <= second - self.window_s]:
+                del self.buckets[old]
+        bucket[outcome] += 1
+
+    # Totals plus per-second rates over the last window_s seconds
+    def stats(self, now):
+        with self.lock:
+            recent = [b for s, b in self.buckets.items() if s > int(now) - self.window_s]
+            rates = {
+                key + '_per_s': round(sum(b[key] for b in recent) / float(self.window_s), 3)
+                for key in self.totals
+            }
+            return {
+                'totals': dict(self.totals),
+                'rates': rates,
+                'window_s': self.window_s,
+                'tracked_users': len(self.last),
+                'min_move_m': self.min_move_m,
+                'min_interval_s': self.min_interval_s
+            }
@@ -0,0 +1,374 @@
+import threading
+import time
+from collections import deque
+
+
+# Every SQL statement the app runs, by name.
+# {fragment} placeholders are filled by QueryRunner.sql() with SQL built
+# by the app itself (IN lists, optional filters), never with user input;
+# values always go through %s parameters.
+QUERIES = {
+    # users
+    'users.located': "SELECT id, lat, lng FROM users WHERE lat IS NOT NULL AND lng IS NOT NULL",
+    # MBRContains on the bounding box narrows the rows, ST_Distance_Sphere does the exact check
+    # (on geo.py's 6371 km sphere; MySQL's default radius is 6370.986 km)
+    'users.nearby': """
+        SELECT id FROM users
+        WHERE MBRContains(ST_GeomFromText(%s, 4326, 'axis-order=long-lat'), location)
+          AND lat IS NOT NULL AND lng IS NOT NULL
+          AND id != %s
+          AND ST_Distance_Sphere(location, ST_SRID(POINT(%s, %s), 4326), 6371000) <= %s
+    """,
+    'users.nearest': """
+        SELECT id, ST_Distance_Sphere(location, ST_SRID(POINT(%s, %s), 4326), 6371000) AS distance_m
+        FROM users
+        WHERE MBRContains(ST_GeomFromText(%s, 4326, 'axis-order=long-lat'), location)
+          AND lat IS NOT NULL AND lng IS NOT NULL
+          AND id != %s
+        HAVING distance_m <= %s
+        ORDER BY distance_m
+        LIMIT %s
+    """,
+    'users.profiles': "SELECT id, name, email, phone, status FROM users WHERE id IN ({placeholders})",
+    'users.existing': "SELECT id FROM users WHERE id IN ({placeholders})",
+    'users.by_email': "SELECT * FROM users WHERE email = %s",
+    'users.credentials': "SELECT id, name, email, password, role, phone FROM users WHERE email = %s",
+    'users.password': "SELECT password FROM users WHERE id = %s",
+    'users.email_taken': "SELECT id FROM users WHERE email = %s AND id != %s",
+    'users.insert': "INSERT INTO users (name, email, password, phone) VALUES (%s, %s, %s, %s)",
+    'users.insert_with_role': "INSERT INTO users (name, email, password, phone, role, status) VALUES (%s, %s, %s, %s, %s, %s)",
+    'users.update_profile': """
+        UPDATE users
+        SET name = %s, email = %s, phone = %s
+        WHERE id = %s
+    """,
+    'users.update_password': "UPDATE users SET password = %s WHERE id = %s",
+    'users.update': """
+        UPDATE users
+        SET name = %s, email = %s, phone = %s, role = %s, status = %s
+        WHERE id = %s
+    """,
+    'users.delete': "DELETE FROM users WHERE id = %s",
+    # {values}: one "SELECT %s AS id, %s AS lat, %s AS lng" per row, UNION ALL'ed
+    'users.update_locations': """
+        UPDATE users u
+        JOIN ({values}) v ON u.id = v.id
+        SET u.lat = v.lat, u.lng = v.lng
+    """,
+    'users.search': """
+        SELECT id, name, email
+        FROM users
+        WHERE (name LIKE %s OR email LIKE %s)
+          AND id != %s
+    """,
+    'users.list': "SELECT id, name, email, phone, role, status FROM users WHERE 1=1{filters}",
+    'users.count': "SELECT COUNT(*) as count FROM users",
+
+    # alerts
+    'alerts.insert': """
+        INSERT INTO emergency_alerts (type, details, latitude, longitude, user_id)
+        VALUES (%s, %s, %s, %s, %s)
+    """,
+    'alerts.coalescable': """
+        SELECT ea.id AS alert_id, ec.room_id
+        FROM emergency_alerts ea
+        JOIN emergency_chats ec ON ec.alert_id = ea.id
+        WHERE ea.user_id = %s AND ea.resolved = 0
+          AND ea.created_at >= NOW() - INTERVAL %s SECOND
+        ORDER BY ea.id DESC
+        LIMIT 1
+    """,
+    'alerts.open_rooms_of': """
+        SELECT ec.room_id, ea.id as alert_id, ea.type
+        FROM emergency_chats ec
+        JOIN emergency_alerts ea ON ec.alert_id = ea.id
+        WHERE ea.user_id = %s AND ea.resolved = 0
+    """,
+    'alerts.resolve_all_of': """
+        UPDATE emergency_alerts
+        SET resolved = 1
+        WHERE user_id = %s AND resolved = 0
+    """,
+    'alerts.resolve': "UPDATE emergency_alerts SET resolved = 1 WHERE id = %s AND resolved = 0",
+    'alerts.owner_open_count': """
+        SELECT ea.user_id, ea.type,
+               (SELECT COUNT(*) FROM emergency_alerts o WHERE o.user_id = ea.user_id AND o.resolved = 0) AS open_alerts
+        FROM emergency_alerts ea WHERE ea.id = %s
+    """,
+    'alerts.counts_of_user': """
+        SELECT SUM(resolved = 0) AS active, SUM(resolved = 1) AS resolved
+        FROM emergency_alerts WHERE user_id = %s
+    """,
+    'alerts.active_users': "SELECT DISTINCT user_id FROM emergency_alerts WHERE resolved = 0",
+    'alerts.active_count': "SELECT COUNT(*) as count FROM emergency_alerts WHERE resolved = 0",
+    'alerts.resolved_count': "SELECT COUNT(*) as count FROM emergency_alerts WHERE resolved = 1",
+    'alerts.first_created': "SELECT MIN(created_at) AS first FROM emergency_alerts",
+    'alerts.open_fire': """
+        SELECT ea.id, ea.type, ea.details, ea.latitude, ea.longitude, ea.user_id, u.name as user_name
+        FROM emergency_alerts ea
+        LEFT JOIN users u ON ea.user_id = u.id
+        WHERE ea.type = 'fire' AND (ea.resolved = 0 OR ea.resolved IS NULL)
+        ORDER BY ea.id DESC
+    """,
+    # No parameters: run without args so the LIKE patterns' % stay literal
+    'alerts.open_medical': """
+        SELECT ea.id, ea.type, ea.details, ea.latitude, ea.longitude, ea.user_id, ea.created_at, u.name as user_name
+        FROM emergency_alerts ea
+        LEFT JOIN users u ON ea.user_id = u.id
+        WHERE ea.resolved = 0 AND (ea.type LIKE '%accident%' OR ea.type LIKE '%fire%')
+        ORDER BY ea.created_at DESC
+    """,
+    'alerts.list': """
+        SELECT a.*, u.name as user_name
+        FROM emergency_alerts a
+        LEFT JOIN users u ON a.user_id = u.id
+        WHERE 1=1{filters}
+        ORDER BY a.created_at DESC
+    """,
+    'alerts.by_id': """
+        SELECT a.*, u.name as user_name
+        FROM emergency_alerts a
+        LEFT JOIN users u ON a.user_id = u.id
+        WHERE a.id = %s
+    """,
+    'alerts.assign': "UPDATE emergency_alerts SET assigned_service_id = %s WHERE id = %s",
+
+    # dashboard
+    'dashboard.counts': """
+        SELECT (SELECT COUNT(*) FROM users) AS users,
+               (SELECT COUNT(*) FROM emergency_alerts WHERE resolved = 0) AS active_alerts,
+               (SELECT COUNT(*) FROM emergency_alerts WHERE resolved = 1) AS resolved_alerts
+    """,
+
+    # alert rollups (hourly and daily created/resolved counts per type)
+    # {deltas}: one "SELECT %s AS ts, %s AS type, %s AS created, %s AS resolved"
+    # per row, UNION ALL'ed; {bucket}: the bucket of d.ts (ROLLUP_BUCKETS)
+    # (GROUP BY in a derived table, ON DUPLICATE KEY UPDATE can't follow one directly)
+    'rollups.add': """
+        INSERT INTO alert_rollups (granularity, bucket_start, type, created, resolved)
+        SELECT * FROM (
+            SELECT %s AS granularity, {bucket} AS bucket_start, d.type, SUM(d.created) AS created, SUM(d.resolved) AS resolved
+            FROM ({deltas}) d
+            GROUP BY {bucket}, d.type
+        ) g
+        ON DUPLICATE KEY UPDATE created = alert_rollups.created + VALUES(created),
+                                resolved = alert_rollups.resolved + VALUES(resolved)
+    """,
+    'rollups.range': """
+        SELECT bucket_start, type, created, resolved FROM alert_rollups
+        WHERE granularity = %s AND bucket_start >= %s AND bucket_start < %s
+        ORDER BY bucket_start
+    """,
+    'rollups.clear': "DELETE FROM alert_rollups WHERE granularity = %s AND bucket_start >= %s AND bucket_start < %s",
+    'rollups.rebuild_created_hours': """
+        INSERT INTO alert_rollups (granularity, bucket_start, type, created, resolved)
+        SELECT * FROM (
+            SELECT 'hour' AS granularity, DATE_FORMAT(created_at, '%%Y-%%m-%%d %%H:00:00') AS bucket_start,
+                   type, COUNT(*) AS created, 0 AS resolved
+            FROM emergency_alerts
+            WHERE created_at >= %s AND created_at < %s
+            GROUP BY DATE_FORMAT(created_at, '%%Y-%%m-%%d %%H:00:00'), type
+        ) g
+        ON DUPLICATE KEY UPDATE created = VALUES(created)
+    """,
+    'rollups.rebuild_resolved_hours': """
+        INSERT INTO alert_rollups (granularity, bucket_start, type, created, resolved)
+        SELECT * FROM (
+            SELECT 'hour' AS granularity, DATE_FORMAT(resolved_at, '%%Y-%%m-%%d %%H:00:00') AS bucket_start,
+                   type, 0 AS created, COUNT(*) AS resolved
+            FROM emergency_alerts
+            WHERE resolved_at >= %s AND resolved_at < %s
+            GROUP BY DATE_FORMAT(resolved_at, '%%Y-%%m-%%d %%H:00:00'), type
+        ) g
+        ON DUPLICATE KEY UPDATE resolved = VALUES(resolved)
+    """,
+    'rollups.rebuild_days': """
+        INSERT INTO alert_rollups (granularity, bucket_start, type, created, resolved)
+        SELECT * FROM (
+            SELECT 'day' AS granularity, DATE(bucket_start) AS bucket_start, type,
+                   SUM(created) AS created, SUM(resolved) AS resolved
+            FROM alert_rollups
+            WHERE granularity = 'hour' AND bucket_start >= %s AND bucket_start < %s
+            GROUP BY DATE(bucket_start), type
+        ) g
+        ON DUPLICATE KEY UPDATE created = VALUES(created), resolved = VALUES(resolved)
+    """,
+    # Only one process rebuilds at a time (session lock, waits up to %s seconds)
+    'rollups.lock': "SELECT GET_LOCK('alert_rollups_repair', %s) AS locked",
+    'rollups.unlock': "SELECT RELEASE_LOCK('alert_rollups_repair')",
+
+    # emergency chat rooms and messages
+    'rooms.by_room_id': "SELECT room_id, alert_id, victim_id, closed FROM emergency_chats WHERE room_id = %s",
+    'rooms.by_alert_id': "SELECT room_id, alert_id, victim_id, closed FROM emergency_chats WHERE alert_id = %s",
+    'rooms.insert': "INSERT INTO emergency_chats (alert_id, room_id, victim_id) VALUES (%s, %s, %s)",
+    'rooms.close': "UPDATE emergency_chats SET closed = 1 WHERE room_id = %s",
+    'rooms.add_member': "INSERT INTO emergency_chat_members (room_id, user_id) VALUES (%s, %s)",
+    'chat.insert_system': "INSERT INTO emergency_chat_messages (room_id, user_id, message) VALUES (%s, %s, %s)",
+    'chat.insert': "INSERT INTO emergency_chat_messages (room_id, user_id, message, sent_at) VALUES (%s, %s, %s, FROM_UNIXTIME(%s))",
+    # Keyset pages on idx_room_id (room_id, id)
+    'chat.after': "SELECT id, user_id, message, sent_at FROM emergency_chat_messages WHERE room_id = %s AND id > %s ORDER BY id ASC LIMIT %s",
+    'chat.newest': "SELECT id, user_id, message, sent_at FROM emergency_chat_messages WHERE room_id = %s ORDER BY id DESC LIMIT %s",
+    'chat.before': "SELECT id, user_id, message, sent_at FROM emergency_chat_messages WHERE room_id = %s AND id < %s ORDER BY id DESC LIMIT %s",
+
+    # location history
+    'location_history.insert': "INSERT IGNORE INTO user_location_history (user_id, ts, lat_e7, lng_e7) VALUES (%s, %s, %s, %s)",
+    'location_history.expire': "DELETE FROM user_location_history WHERE ts < %s",
+    # Keep the first point of each bucket
+    'location_history.downsample': """
+        DELETE h FROM user_location_history h
+        JOIN (
+            SELECT user_id, ts DIV %s AS bucket, MIN(ts) AS keep_ts
+            FROM user_location_history
+            WHERE ts < %s
+            GROUP BY user_id, bucket
+        ) k ON h.user_id = k.user_id AND h.ts DIV %s = k.bucket
+        WHERE h.ts < %s AND h.ts > k.keep_ts
+    """,
+    'location_history.trail': """
+        SELECT ts, lat_e7, lng_e7 FROM user_location_history
+        WHERE user_id = %s AND ts >= %s
+        ORDER BY ts
+    """,
+
+    # scheduled jobs
+    'jobs.save': """
+        INSERT INTO scheduled_jobs (job_name, job_key, payload, run_at)
+        VALUES (%s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE payload = VALUES(payload), run_at = VALUES(run_at)
+    """,
+    'jobs.delete': "DELETE FROM scheduled_jobs WHERE job_name = %s AND job_key = %s",
+    'jobs.claim': "DELETE FROM scheduled_jobs WHERE job_name = %s AND job_key = %s AND run_at = %s",
+    'jobs.pending': "SELECT job_name, job_key, payload, run_at FROM scheduled_jobs ORDER BY run_at",
+
+    # friends
+    # Rows in both directions; the friend graph derives accepted/pending from them
+    'friends.of_user': """
+        SELECT user_id, friend_id, status FROM friends WHERE user_id = %s
+        UNION ALL
+        SELECT user_id, friend_id, status FROM friends WHERE friend_id = %s
+    """,
+    'friends.row': "SELECT * FROM friends WHERE user_id=%s AND friend_id=%s",
+    'friends.request': "INSERT INTO friends (user_id, friend_id, status) VALUES (%s, %s, 'pending')",
+    'friends.accept': "UPDATE friends SET status='accepted' WHERE user_id=%s AND friend_id=%s AND status='pending'",
+    'friends.add_accepted': "INSERT IGNORE INTO friends (user_id, friend_id, status) VALUES (%s, %s, 'accepted')",
+    'friends.decline': "UPDATE friends SET status='declined' WHERE user_id=%s AND friend_id=%s AND status='pending'",
+    'friends.remove': "DELETE FROM friends WHERE (user_id=%s AND friend_id=%s) OR (user_id=%s AND friend_id=%s)",
+    'friend_messages.insert': "INSERT INTO friend_messages (sender_id, receiver_id, message, created_at) VALUES (%s, %s, %s, NOW())",
+    # Keyset pages on idx_conversation_key (conversation_low, conversation_high, id)
+    'friend_messages.newest': """
+        SELECT id, sender_id, receiver_id, message, created_at, read_at
+        FROM friend_messages
+        WHERE conversation_low = %s AND conversation_high = %s
+        ORDER BY id DESC LIMIT %s
+    """,
+    'friend_messages.before': """
+        SELECT id, sender_id, receiver_id, message, created_at, read_at
+        FROM friend_messages
+        WHERE conversation_low = %s AND conversation_high = %s AND id < %s
+        ORDER BY id DESC LIMIT %s
+    """,
+    'blocked.insert': "INSERT IGNORE INTO blocked_users (user_id, blocked_user_id) VALUES (%s, %s)",
+    'blocked.delete': "DELETE FROM blocked_users WHERE user_id=%s AND blocked_user_id=%s",
+    'blocked.of_user': """
+        SELECT u.id, u.name, u.email
+        FROM blocked_users b
+        JOIN users u ON u.id = b.blocked_user_id
+        WHERE b.user_id = %s
+    """,
+
+    # services
+    'services.by_email': "SELECT * FROM services WHERE email = %s",
+    'services.insert': "INSERT INTO services (company_name, email, password, service_type, phone, lat, lng) VALUES (%s, %s, %s, %s, %s, %s, %s)",
+    'services.credentials': "SELECT id, company_name, email, password, service_type FROM services WHERE email = %s",
+    'services.profile': "SELECT id, company_name, email, service_type, phone, lat, lng FROM services WHERE email = %s",
+    'services.hospital_by_email': "SELECT * FROM services WHERE email = %s AND service_type = 'hospital'",
+    'services.hospital_profile': "SELECT id, company_name, email, service_type, phone, lat, lng FROM services WHERE email = %s AND service_type = 'hospital'",
+    'services.phone': "SELECT phone FROM services WHERE company_name = %s AND service_type = %s",
+
+    # reports
+    'reports.insert': "INSERT INTO reports (text, user_id, status, created_at) VALUES (%s, %s, %s, NOW())",
+    'reports.list': """
+        SELECT r.id, r.text, r.status, r.created_at, u.name as user_name
+        FROM reports r
+        LEFT JOIN users u ON r.user_id = u.id
+        ORDER BY r.created_at DESC
+    """,
+    'reports.update_status': "UPDATE reports SET status = %s WHERE id = %s",
+}
+
+# Bucket of d.ts (unix seconds) in rollups.add, computed in the database's
+# time zone like the rebuild queries
+ROLLUP_BUCKETS = {
+    'hour': "DATE_FORMAT(FROM_UNIXTIME(d.ts), '%%Y-%%m-%%d %%H:00:00')",
+    'day': "DATE(FROM_UNIXTIME(d.ts))",
+}
+
+
+# Runs named queries on a cursor and keeps per-query call, row, error and
+# latency counts. PyMySQL has no server-side prepared statements, so
+# statements are still sent as text; the catalog is what gives every
+# query one name to measure and optimize.
+class QueryRunner:
+    def __init__(self, queries, samples=256):
+        self.queries = queries
+        self.samples = samples
+        self.per_query = {}  # name -> counters and recent latencies
+        self.lock = threading.Lock()
+
+    def sql(self, name, **fragments):
+        sql = self.queries[name]
+        return sql.format(**fragments) if fragments else sql
+
+    # cursor.execute() of a named query; returns the cursor
+    def run(self, cursor, name, params=None, **fragments):
+        sql = self.sql(name, **fragments)
+        started = time.perf_counter()
+        try:
+            cursor.execute(sql, params)
+        except Exception:
+            self._record(name, started, 0, error=True)
+            raise
+        self._record(name, started, max(cursor.rowcount, 0))
+        return cursor
+
+    # cursor.executemany() of a named query; returns the cursor
+    def run_many(self, cursor, name, rows):
+        started = time.perf_counter()
+        try:
+            cursor.executemany(self.queries[name], rows)
+        except Exception:
+            self._record(name, started, 0, error=True)
+            raise
+        self._record(name, started, max(cursor.rowcount, 0))
+        return cursor
+
+    def _record(self, name, started, rows, error=False):
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        with self.lock:
+            entry = self.per_query.get(name)
+            if entry is None:
+                entry = self.per_query[name] = {
+                    'calls': 0, 'errors': 0, 'rows': 0, 'total_ms': 0.0, 'max_ms': 0.0,
+                    'recent_ms': deque(maxlen=self.samples)
+                }
+            entry['calls'] += 1
+            entry['errors'] += 1 if error else 0
+            entry['rows'] += rows
+            entry['total_ms'] += elapsed_ms
+            entry['max_ms'] = max(entry['max_ms'], elapsed_ms)
+            entry['recent_ms'].append(elapsed_ms)
+
+    # Per-query counters, slowest total time first
+    def stats(self):
+        with self.lock:
+            entries = [(name, dict(e, recent_ms=sorted(e['recent_ms']))) for name, e in self.per_query.items()]
+        result = []
+        for name, e in sorted(entries, key=lambda item: -item[1]['total_ms']):
+            recent = e.pop('recent_ms')
+            e['avg_ms'] = round(e['total_ms'] / e['calls'], 3)
+            e['p50_ms'] = round(recent[len(recent) // 2], 3) if recent else None
+            e['p95_ms'] = round(recent[min(int(len(recent) * 0.95), len(recent) - 1)], 3) if recent else None
+            e['total_ms'] = round(e['total_ms'], 3)
+            e['max_ms'] = round(e['max_ms'], 3)
+            result.append(dict(e, name=name))
+        return result
@@ -0,0 +1,60 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+# In-process registry of emergency chat rooms, keyed by room_id and alert_id.
+# Rooms are added by emergency() when they are created; anything else is
+# looked up once with loader(room_id=..., alert_id=...), which returns the
+# emergency_chats row (room_id, alert_id, victim_id, closed) or None.
+# mark_closed() only reaches this process; with several workers, open rooms
+# are looked up again once they are older than ttl_s.
+class RoomRegistry:
+    def __init__(self, loader, max_rooms=100000, ttl_s=None):
+        self.loader = loader
+        self.max_rooms = max_rooms
+        self.ttl_s = ttl_s
+        self.rooms = OrderedDict()  # room_id -> room dict, LRU order
+        self.by_alert_id = {}       # alert_id -> room_id
+        self.lock = threading.Lock()
+
+    def add(self, room_id, alert_id, victim_id, closed=False):
+        alert_id = int(alert_id)
+        room = {'room_id': room_id, 'alert_id': alert_id, 'victim_id': victim_id, 'closed': bool(closed), 'loaded_at': time.time()}
+        with self.lock:
+            self.rooms[room_id] = room
+            self.rooms.move_to_end(room_id)
+            self.by_alert_id[alert_id] = room_id
+            while len(self.rooms) > self.max_rooms:
+                _, old = self.rooms.popitem(last=False)
+                self.by_alert_id.pop(old['alert_id'], None)
+        return room
+
+    def get(self, room_id):
+        with self.lock:
+            room = self.rooms.get(room_id)
+            if room and (room['closed'] or self.ttl_s is None or time.time() - room['loaded_at'] < self.ttl_s):
+                self.rooms.move_to_end(room_id)
+                return room
+        row = self.loader(room_id=room_id)
+        return self.add(row['room_id'], row['alert_id'], row['victim_id'], row['closed']) if row else None
+
+    def get_by_alert(self, alert_id):
+        alert_id = int(alert_id)
+        room_id = self.by_alert_id.get(alert_id)
+        if room_id is not None:
+            room = self.get(room_id)
+            if room:
+                return room
+        row = self.loader(alert_id=alert_id)
+        return self.add(row['room_id'], row['alert_id'], row['victim_id'], row['closed']) if row else None
+
+    # Mark rooms closed without going back to the database
+    def mark_closed(self, room_ids=(), alert_ids=()):
+        with self.lock:
+            alert_ids = [int(a) for a in alert_ids]
+            room_ids = set(room_ids) | {self.by_alert_id[a] for a in alert_ids if a in self.by_alert_id}
+            for room_id in room_ids:
+                room = self.rooms.get(room_id)
+                if room:
+                    room['closed'] = True
@@ -0,0 +1,40 @@
+import os
+import sys
+import signal
+import subprocess
+import time
+
+# Start several app workers sharing one Socket.IO message queue.
+# Worker i listens on BASE_PORT + i; put a sticky-session proxy in front
+# (deploy/nginx.conf listens on 5000 and balances by client IP).
+#
+#   SOCKETIO_MESSAGE_QUEUE=redis://localhost:6379/0 WORKERS=4 python run_workers.py
+#
+# Any Redis-protocol server works as the queue for local testing
+# (redis-server, valkey-server, keydb-server). SOCKETIO_MESSAGE_QUEUE=memory://
+# (kombu's in-process transport) runs the multi-worker code paths in a
+# single worker without any server.
+WORKERS = int(os.environ.get('WORKERS', 4))
+BASE_PORT = int(os.environ.get('BASE_PORT', 5001))
+SOCKETIO_MESSAGE_QUEUE = os.environ.get('SOCKETIO_MESSAGE_QUEUE', 'redis://localhost:6379/0')
+
+if __name__ == '__main__':
+    workers = 1 if SOCKETIO_MESSAGE_QUEUE.startswith('memory://') else WORKERS
+    app_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app.py')
+    processes = []
+    for i in range(workers):
+        env = dict(os.environ, SOCKETIO_MESSAGE_QUEUE=SOCKETIO_MESSAGE_QUEUE, PORT=str(BASE_PORT + i))
+        processes.append(subprocess.Popen([sys.executable, app_path], env=env))
+        print(f'Worker {i} started on port {BASE_PORT + i} (pid {processes[-1].pid})')
+
+    def stop(signum, frame):
+        # Workers turn SIGTERM into a clean exit and flush their buffers
+        for process in processes:
+            if process.poll() is None:
+                process.terminate()
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    # Exit once every worker has stopped
+    while any(process.poll() is None for process in processes):
+        time.sleep(0.5)
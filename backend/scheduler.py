@@ -0,0 +1,167 @@
+import heapq
+import itertools
+import queue
+import threading
+import time
+
+
+# Timer scheduler for delayed jobs.
+# One dispatcher keeps pending deadlines in a heap and hands due jobs to a
+# small pool of workers. A job is (name, key, payload): handlers are
+# registered per name and called as handler(**payload), and scheduling a
+# (name, key) that is already pending replaces it.
+# One-shot jobs are persisted through four callables so they survive a
+# restart:
+#   save(rows)                 rows of (name, key, payload, run_at)
+#   delete(name, key)
+#   load()                     rows with name, key, payload, run_at
+#   claim(name, key, run_at)   remove the row, True if this call removed it
+# A due job only runs once claimed, so when several processes loaded the
+# same rows exactly one of them runs it. A failed job is retried after
+# retry_base_s, doubling up to retry_max_s per attempt, and saved again
+# with its new run_at so a restart picks it up too. A retry whose save
+# failed (e.g. the database is down) runs without a claim, since no other
+# process has a row for it.
+# Recurring jobs (every()) are not persisted; they are set up again at
+# startup. spawn/sleep are socketio.start_background_task/socketio.sleep so
+# the scheduler also cooperates under eventlet.
+class JobScheduler:
+    def __init__(self, spawn, sleep, save=None, delete=None, load=None, claim=None, workers=4, tick_s=0.25,
+                 retry_base_s=5.0, retry_max_s=300.0):
+        self.spawn = spawn
+        self.sleep = sleep
+        self.save = save
+        self.delete = delete
+        self.load = load
+        self.claim = claim
+        self.workers = workers
+        self.tick_s = tick_s
+        self.retry_base_s = retry_base_s
+        self.retry_max_s = retry_max_s
+        self.handlers = {}
+        self.heap = []     # (run_at, seq, name, key)
+        self.jobs = {}     # (name, key) -> (run_at, seq, payload, every)
+        self.retries = {}  # (name, key) -> (failed attempts, saved) of a pending retry
+        self.due = queue.Queue()
+        self.counter = itertools.count()
+        self.lock = threading.Lock()
+        self.start_lock = threading.Lock()
+        self.started = False
+        self.totals = {'scheduled': 0, 'run': 0, 'failed': 0, 'skipped': 0, 'retries': 0}
+
+    def register(self, name, handler):
+        self.handlers[name] = handler
+
+    # Run handler name once after delay_s seconds
+    def schedule(self, name, delay_s, key=None, **payload):
+        self.schedule_many(name, delay_s, [(key, payload)])
+
+    # Same as schedule() for several (key, payload) jobs, persisted in one write
+    def schedule_many(self, name, delay_s, jobs):
+        run_at = time.time() + delay_s
+        if not jobs:
+            return
+        if self.save:
+            self.save([(name, key, payload, run_at) for key, payload in jobs])
+        for key, payload in jobs:
+            with self.lock:
+                self.retries.pop((name, key), None)
+            self._push(name, key, payload, run_at, None)
+
+    # Run handler name every interval_s seconds
+    def every(self, name, interval_s, key=None, **payload):
+        self._push(name, key, payload, time.time() + interval_s, interval_s)
+
+    def cancel(self, name, key=None):
+        with self.lock:
+            self.jobs.pop((name, key), None)
+            self.retries.pop((name, key), None)
+        if self.delete:
+            self.delete(name, key)
+
+    def _push(self, name, key, payload, run_at, every):
+        with self.lock:
+            seq = next(self.counter)
+            self.jobs[(name, key)] = (run_at, seq, payload, every)
+            heapq.heappush(self.heap, (run_at, seq, name, key))
+            self.totals['scheduled'] += 1
+
+    # Reload persisted jobs (overdue ones run right away) and start the
+    # dispatcher and workers
+    def start(self):
+        with self.start_lock:
+            if self.started:
+                return
+            if self.load:
+                for row in self.load():
+                    self._push(row['name'], row['key'], row['payload'], row['run_at'], None)
+            self.spawn(self._dispatch)
+            for _ in range(self.workers):
+                self.spawn(self._work)
+            self.started = True
+
+    def _dispatch(self):
+        while True:
+            now = time.time()
+            with self.lock:
+                while self.heap and self.heap[0][0] <= now:
+                    run_at, seq, name, key = heapq.heappop(self.heap)
+                    job = self.jobs.get((name, key))
+                    # Skip entries that were replaced or cancelled
+                    if job is None or job[1] != seq:
+                        continue
+                    del self.jobs[(name, key)]
+                    self.due.put((name, key, job[2], job[3], run_at))
+                wait = self.heap[0][0] - now if self.heap else self.tick_s
+            # Wake up at least every tick_s to pick up earlier new deadlines
+            self.sleep(min(max(wait, 0), self.tick_s))
+
+    def _work(self):
+        while True:
+            # Non-blocking get + sleep, like the alert fan-out worker
+            try:
+                name, key, payload, every, run_at = self.due.get_nowait()
+            except queue.Empty:
+                self.sleep(0.05)
+                continue
+            with self.lock:
+                attempts, saved = self.retries.pop((name, key), (0, True)) if every is None else (0, False)
+            try:
+                if every is None and saved and self.claim and not self.claim(name, key, run_at):
+                    # Another process ran it, or it was rescheduled
+                    self.totals['skipped'] += 1
+                    continue
+                self.handlers[name](**payload)
+                self.totals['run'] += 1
+            except Exception as e:
+                self.totals['failed'] += 1
+                print(f"Scheduled job {name} ({key}) failed: {e}")
+                if every is None:
+                    self._retry(name, key, payload, attempts + 1)
+            finally:
+                if every is not None:
+                    self._push(name, key, payload, time.time() + every, every)
+
+    def _retry(self, name, key, payload, attempts):
+        retry_at = time.time() + min(self.retry_base_s * 2 ** (attempts - 1), self.retry_max_s)
+        saved = False
+        if self.save:
+            try:
+                self.save([(name, key, payload, retry_at)])
+                saved = True
+            except Exception as e:
+                print(f"Could not keep failed job {name} ({key}): {e}")
+        with self.lock:
+            if (name, key) in self.jobs:
+                # Scheduled again meanwhile, the new run replaces the retry
+                return
+            self.retries[(name, key)] = (attempts, saved)
+        self._push(name, key, payload, retry_at, None)
+        self.totals['retries'] += 1
+
+    def stats(self):
+        with self.lock:
+            pending = len(self.jobs)
+            next_run_in = max(self.heap[0][0] - time.time(), 0) if self.heap else None
+        return dict(self.totals, pending=pending, due=self.due.qsize(),
+                    next_run_in_s=round(next_run_in, 3) if next_run_in is not None else None)
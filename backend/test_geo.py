@@ -0,0 +1,78 @@
+import math
+import random
+import pytest
+from geo import (haversine, haversine_many, within_radius, combine_helper_searches, find_helpers,
+                 LocationGrid, EARTH_RADIUS_KM, KM_PER_DEG_LAT)
+
+
+def assert_matches_scalar(lat, lng, points):
+    lats, lngs = zip(*points)
+    vectorized = haversine_many(lat, lng, lats, lngs)
+    for (p_lat, p_lng), distance in zip(points, vectorized):
+        assert distance == pytest.approx(haversine(lat, lng, p_lat, p_lng), rel=1e-9, abs=1e-6)
+
+
+def test_haversine_many_matches_scalar_on_random_points():
+    rng = random.Random(42)
+    for _ in range(50):
+        lat, lng = rng.uniform(-90, 90), rng.uniform(-180, 180)
+        points = [(rng.uniform(-90, 90), rng.uniform(-180, 180)) for _ in range(200)]
+        assert_matches_scalar(lat, lng, points)
+
+
+def test_haversine_many_matches_scalar_on_nearby_points():
+    rng = random.Random(7)
+    lat, lng = 40.7128, -74.0060
+    points = [(lat + rng.uniform(-0.05, 0.05), lng + rng.uniform(-0.05, 0.05)) for _ in range(500)]
+    assert_matches_scalar(lat, lng, points)
+
+
+def test_haversine_many_antipodes_and_poles():
+    half_circumference = math.pi * EARTH_RADIUS_KM
+    points = [(-10.0, -160.0), (-90.0, 0.0), (90.0, 0.0), (90.0, 123.0), (10.0, 20.0), (0.0, 200.0)]
+    assert_matches_scalar(10.0, 20.0, points)
+    # Antipodal point and pole to pole are half the circumference apart
+    assert haversine_many(10.0, 20.0, [-10.0], [-160.0])[0] == pytest.approx(half_circumference)
+    assert haversine_many(90.0, 0.0, [-90.0], [45.0])[0] == pytest.approx(half_circumference)
+    # All longitudes meet at the pole
+    assert haversine_many(90.0, 0.0, [90.0, 90.0], [-180.0, 77.0]) == pytest.approx([0.0, 0.0], abs=1e-6)
+
+
+def test_within_radius_agrees_with_scalar():
+    rng = random.Random(3)
+    lat, lng = 1.98, 10.0
+    points = [(lat + rng.uniform(-0.03, 0.03), lng + rng.uniform(-0.03, 0.03)) for _ in range(500)]
+    lats, lngs = zip(*points)
+    mask = within_radius(lat, lng, lats, lngs, 2.0)
+    expected = [haversine(lat, lng, p_lat, p_lng) <= 2.0 for p_lat, p_lng in points]
+    assert list(mask) == expected
+
+
+# Users due north of the origin at the given distances (km)
+def grid_with_users_at(lat, lng, distances_km):
+    grid = LocationGrid()
+    for user_id, distance in enumerate(distances_km, 1):
+        grid.update(user_id, lat + distance / KM_PER_DEG_LAT, lng)
+    return grid
+
+
+def test_mixed_helper_search_keeps_each_types_limits():
+    teased = {'k': None, 'max_radius_km': 2.0}
+    fire = {'k': 2, 'max_radius_km': 5.0}
+    kidnapped = {'k': 3, 'max_radius_km': 10.0}
+    assert combine_helper_searches([fire, teased]) == {'radius_km': 2.0, 'k': 2, 'k_max_radius_km': 5.0}
+    assert combine_helper_searches([teased]) == {'radius_km': 2.0, 'k': None, 'k_max_radius_km': None}
+    assert combine_helper_searches([fire, kidnapped]) == {'radius_km': None, 'k': 3, 'k_max_radius_km': 10.0}
+
+    lat, lng = 40.7, -74.0
+    grid = grid_with_users_at(lat, lng, [0.5, 1.0, 1.5, 3.0, 4.0, 8.0])
+    within = lambda radius_km: grid.query_radius(lat, lng, radius_km)
+    nearest = lambda k, max_radius_km: [uid for uid, _ in grid.nearest(lat, lng, k, max_radius_km)]
+
+    # fire alone: the 2 nearest; teased alone: everyone within 2 km
+    assert find_helpers(combine_helper_searches([fire]), within, nearest) == [1, 2]
+    assert sorted(find_helpers(combine_helper_searches([teased]), within, nearest)) == [1, 2, 3]
+    # Together: the union of both, not everyone within 5 km
+    assert sorted(find_helpers(combine_helper_searches([fire, teased]), within, nearest)) == [1, 2, 3]
+    # teased + kidnapped: everyone within 2 km plus the 3 nearest within 10 km
+    assert sorted(find_helpers(combine_helper_searches([teased, kidnapped]), within, nearest)) == [1, 2, 3]
@@ -18,10 +18,14 @@ CREATE TABLE users (
     phone VARCHAR(20),
     lat DECIMAL(10, 8),
     lng DECIMAL(11, 8),
+    -- Spatial copy of lat/lng, kept in sync by MySQL (see migrations/001_spatial_location.sql)
+    location POINT SRID 4326
+        GENERATED ALWAYS AS (ST_SRID(POINT(COALESCE(lng, 0), COALESCE(lat, 0)), 4326)) STORED NOT NULL,
     role VARCHAR(50) DEFAULT 'user',
     status VARCHAR(50) DEFAULT 'active',
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    SPATIAL INDEX idx_users_location (location)
 );
 
 -- ============================================
@@ -36,9 +40,12 @@ CREATE TABLE services (
     phone VARCHAR(20),
     lat DECIMAL(10, 8),
     lng DECIMAL(11, 8),
+    location POINT SRID 4326
+        GENERATED ALWAYS AS (ST_SRID(POINT(COALESCE(lng, 0), COALESCE(lat, 0)), 4326)) STORED NOT NULL,
     status VARCHAR(50) DEFAULT 'active',
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    SPATIAL INDEX idx_services_location (location)
 );
 
 -- ============================================
@@ -51,6 +58,8 @@ CREATE TABLE emergency_alerts (
     details TEXT,
     latitude DECIMAL(10, 8) NOT NULL,
     longitude DECIMAL(11, 8) NOT NULL,
+    location POINT SRID 4326
+        GENERATED ALWAYS AS (ST_SRID(POINT(longitude, latitude), 4326)) STORED NOT NULL,
     resolved TINYINT(1) DEFAULT 0,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     resolved_at TIMESTAMP NULL,
@@ -58,7 +67,8 @@ CREATE TABLE emergency_alerts (
     INDEX idx_user_id (user_id),
     INDEX idx_resolved (resolved),
     INDEX idx_created_at (created_at),
-    INDEX idx_location (latitude, longitude)
+    INDEX idx_location (latitude, longitude),
+    SPATIAL INDEX idx_alerts_location_point (location)
 );
 
 -- ============================================
@@ -112,6 +122,49 @@ CREATE TABLE emergency_chat_members (
     INDEX idx_user_id (user_id)
 );
 
+-- ============================================
+-- USER LOCATION HISTORY TABLE
+-- ============================================
+-- Trail of positions while a user has an active alert.
+-- Coordinates are degrees * 1e7, ts is unix seconds.
+CREATE TABLE user_location_history (
+    user_id INT NOT NULL,
+    ts INT UNSIGNED NOT NULL,
+    lat_e7 INT NOT NULL,
+    lng_e7 INT NOT NULL,
+    PRIMARY KEY (user_id, ts),
+    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+    INDEX idx_ts (ts)
+);
+
+-- ============================================
+-- SCHEDULED JOBS TABLE
+-- ============================================
+-- Pending one-shot jobs of the app's scheduler (run_at is unix seconds)
+CREATE TABLE scheduled_jobs (
+    job_name VARCHAR(64) NOT NULL,
+    job_key VARCHAR(255) NOT NULL DEFAULT '',
+    payload JSON NOT NULL,
+    run_at DOUBLE NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (job_name, job_key),
+    INDEX idx_run_at (run_at)
+);
+
+-- ============================================
+-- ALERT ROLLUPS TABLE
+-- ============================================
+-- Alerts created/resolved per type and hour or day (database time zone),
+-- maintained by the backend and read by /api/alerts/over-time
+CREATE TABLE alert_rollups (
+    granularity ENUM('hour', 'day') NOT NULL,
+    bucket_start DATETIME NOT NULL,
+    type VARCHAR(100) NOT NULL,
+    created INT NOT NULL DEFAULT 0,
+    resolved INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (granularity, bucket_start, type)
+);
+
 -- ============================================
 -- FRIENDS TABLE
 -- ============================================
@@ -140,12 +193,16 @@ CREATE TABLE friend_messages (
     message TEXT NOT NULL,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     read_at TIMESTAMP NULL,
+    -- Same pair for both directions of a conversation
+    conversation_low INT GENERATED ALWAYS AS (LEAST(sender_id, receiver_id)) STORED,
+    conversation_high INT GENERATED ALWAYS AS (GREATEST(sender_id, receiver_id)) STORED,
     FOREIGN KEY (sender_id) REFERENCES users(id) ON DELETE CASCADE,
     FOREIGN KEY (receiver_id) REFERENCES users(id) ON DELETE CASCADE,
     INDEX idx_sender_id (sender_id),
     INDEX idx_receiver_id (receiver_id),
     INDEX idx_created_at (created_at),
-    INDEX idx_conversation (sender_id, receiver_id, created_at)
+    INDEX idx_conversation (sender_id, receiver_id, created_at),
+    INDEX idx_conversation_key (conversation_low, conversation_high, id)
 );
 
 -- ============================================
@@ -214,6 +271,13 @@ CREATE INDEX idx_alerts_location_resolved ON emergency_alerts(latitude, longitud
 CREATE INDEX idx_friends_user_status ON friends(user_id, status);
 CREATE INDEX idx_messages_conversation_time ON friend_messages(sender_id, receiver_id, created_at);
 CREATE INDEX idx_chat_messages_room_time ON emergency_chat_messages(room_id, sent_at);
+-- Checked by backend/check_query_plans.py (see migrations/005_query_plan_indexes.sql)
+CREATE INDEX idx_alerts_user_open ON emergency_alerts(user_id, resolved, created_at);
+CREATE INDEX idx_alerts_open_created ON emergency_alerts(resolved, created_at);
+CREATE INDEX idx_alerts_type_open ON emergency_alerts(type, resolved);
+CREATE INDEX idx_services_name_type ON services(company_name, service_type);
+-- Alert rollup repair and backfill (see migrations/006_alert_rollups.sql)
+CREATE INDEX idx_alerts_resolved_at ON emergency_alerts(resolved_at);
 
 -- ============================================
 -- VIEWS FOR COMMON QUERIES (OPTIONAL)
@@ -250,6 +314,8 @@ WHERE f.status = 'accepted';
 DELIMITER //
 
 -- Procedure to get nearby users for emergency alerts
+-- The bounding box goes through the spatial index, then the exact
+-- distance is checked with ST_Distance_Sphere
 CREATE PROCEDURE GetNearbyUsers(
     IN alert_lat DECIMAL(10,8),
     IN alert_lng DECIMAL(11,8),
@@ -257,28 +323,36 @@ CREATE PROCEDURE GetNearbyUsers(
     IN exclude_user_id INT
 )
 BEGIN
+    DECLARE origin GEOMETRY;
+    DECLARE dlat DOUBLE;
+    DECLARE dlng DOUBLE;
+    SET origin = ST_SRID(POINT(alert_lng, alert_lat), 4326);
+    -- Degree spans on a 6371 km sphere, the radius the distances use too
+    SET dlat = radius_km / (6371 * PI() / 180);
+    SET dlng = dlat / GREATEST(COS(RADIANS(alert_lat)), 0.000001);
     SELECT 
         id,
         name,
         email,
         lat,
         lng,
-        (
-            6371 * acos(
-                cos(radians(alert_lat)) * 
-                cos(radians(lat)) * 
-                cos(radians(lng) - radians(alert_lng)) + 
-                sin(radians(alert_lat)) * 
-                sin(radians(lat))
-            )
-        ) AS distance_km
+        ST_Distance_Sphere(location, origin, 6371000) / 1000 AS distance_km
     FROM users 
     WHERE 
-        id != exclude_user_id 
+        MBRContains(
+            ST_GeomFromText(CONCAT('POLYGON((',
+                alert_lng - dlng, ' ', alert_lat - dlat, ',',
+                alert_lng + dlng, ' ', alert_lat - dlat, ',',
+                alert_lng + dlng, ' ', alert_lat + dlat, ',',
+                alert_lng - dlng, ' ', alert_lat + dlat, ',',
+                alert_lng - dlng, ' ', alert_lat - dlat, '))'), 4326, 'axis-order=long-lat'),
+            location
+        )
+        AND id != exclude_user_id 
         AND lat IS NOT NULL 
         AND lng IS NOT NULL
         AND status = 'active'
-    HAVING distance_km <= radius_km
+        AND ST_Distance_Sphere(location, origin, 6371000) <= radius_km * 1000
     ORDER BY distance_km;
 END //
 
@@ -40,36 +40,15 @@ document.addEventListener('DOMContentLoaded', () => {
 
     async function fetchDashboardData() {
         try {
-            // Fetch users
-            const [usersResponse, activeAlertsResponse, resolvedAlertsResponse] = await Promise.all([
-                fetch('http://localhost:5000/api/users/count'),
-                fetch('http://localhost:5000/api/alerts/active'),
-                fetch('http://localhost:5000/api/alerts/resolved')
-            ]);
-
-            // Update user count
-            if (!usersResponse.ok) {
-                throw new Error('Failed to fetch total users');
+            // Counters come from one summary call
+            const summaryResponse = await fetch('http://localhost:5000/api/dashboard/summary');
+            if (!summaryResponse.ok) {
+                throw new Error('Failed to fetch dashboard summary');
             }
-            const usersData = await usersResponse.json();
-            console.log('Total Users:', usersData);
-            document.getElementById('total-users').textContent = usersData.count;
-
-            // Update active alerts
-            if (!activeAlertsResponse.ok) {
-                throw new Error('Failed to fetch active alerts');
-            }
-            const activeAlertsData = await activeAlertsResponse.json();
-            console.log('Active Alerts:', activeAlertsData);
-            document.getElementById('active-alerts').textContent = activeAlertsData.count || 0;
-
-            // Update resolved alerts
-            if (!resolvedAlertsResponse.ok) {
-                throw new Error('Failed to fetch resolved alerts');
-            }
-            const resolvedAlertsData = await resolvedAlertsResponse.json();
-            console.log('Resolved Alerts:', resolvedAlertsData);
-            document.getElementById('resolved-alerts').textContent = resolvedAlertsData.count || 0;
+            const summary = await summaryResponse.json();
+            document.getElementById('total-users').textContent = summary.users;
+            document.getElementById('active-alerts').textContent = summary.active_alerts || 0;
+            document.getElementById('resolved-alerts').textContent = summary.resolved_alerts || 0;
 
             // Handle chart
             const alertsOverTimeResponse = await fetch('http://localhost:5000/api/alerts/over-time');
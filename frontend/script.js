@@ -200,6 +200,9 @@ document.getElementById('emergency-chat-button').addEventListener('click', () =>
 
 
 
+// Messages per history request (the server's default limit)
+const EMERGENCY_CHAT_PAGE_SIZE = 200;
+
 function openEmergencyChatRoom(roomId) {
   currentEmergencyRoomId = roomId;
   const room = activeEmergencyRooms[roomId];
@@ -212,9 +215,25 @@ function openEmergencyChatRoom(roomId) {
   showActiveChat(room.alertData);
   renderEmergencyAlertsList();
 
-  // Fetch message history from backend and REPLACE in-memory messages
-  fetch(`http://localhost:5000/api/emergency-chat/messages?room_id=${roomId}`)
-    .then(res => res.json())
+  // Fetch message history from backend; if we already have saved messages
+  // only ask for the ones after the last id we saw
+  const savedMessages = activeEmergencyRooms[roomId].messages.filter(m => m.id);
+  const lastSeenId = savedMessages.length ? savedMessages[savedMessages.length - 1].id : null;
+  const historyUrl = `http://localhost:5000/api/emergency-chat/messages?room_id=${roomId}&limit=${EMERGENCY_CHAT_PAGE_SIZE}`;
+  // Catch-up pages come oldest first: keep asking after the last id
+  // received until a page comes back short
+  const fetchAfter = (afterId, collected) =>
+    fetch(`${historyUrl}&after_id=${afterId}`)
+      .then(res => res.json())
+      .then(messages => {
+        collected = collected.concat(messages);
+        if (messages.length < EMERGENCY_CHAT_PAGE_SIZE) return collected;
+        return fetchAfter(messages[messages.length - 1].id, collected);
+      });
+  const history = lastSeenId
+    ? fetchAfter(lastSeenId, savedMessages)
+    : fetch(historyUrl).then(res => res.json());
+  history
     .then(messages => {
       // Replace in-memory messages with backend messages
       activeEmergencyRooms[roomId].messages = messages;
@@ -575,6 +594,18 @@ updateUserLocationOnBackend();
 // Call every 20 minutes (120000 ms)
 setInterval(updateUserLocationOnBackend, 1200000);
 
+// Stream position changes over the socket in between; the server drops
+// updates that come too often or barely moved
+if (navigator.geolocation && user && user.id) {
+  navigator.geolocation.watchPosition((position) => {
+    if (!socket) return;
+    socket.emit('locationUpdate', {
+      lat: position.coords.latitude,
+      lng: position.coords.longitude
+    });
+  });
+}
+
 
 
 // Tutorial button event listener
@@ -811,27 +842,58 @@ document.getElementById('send-friend-chat').addEventListener('click', () => {
 });
 
 // Load messages with a friend
-async function loadFriendMessages(friendId) {
+// Without beforeId the newest page replaces the chat; with beforeId the
+// page of older messages is added on top
+const FRIEND_CHAT_PAGE_SIZE = 50;
+let friendChatOldestId = null; // id of the oldest message shown
+let friendChatHasMore = false; // whether older messages may exist
+
+async function loadFriendMessages(friendId, beforeId = null) {
   const user = getCurrentUser();
   if (!user || !friendId) { // Added a check for friendId
       console.error("Cannot load messages: user or friendId is missing.");
       return;
   }
-  const res = await fetch(`http://localhost:5000/api/friends/messages?user1=${user.id}&user2=${friendId}`);
+  let url = `http://localhost:5000/api/friends/messages?user1=${user.id}&user2=${friendId}&limit=${FRIEND_CHAT_PAGE_SIZE}`;
+  if (beforeId) url += `&before_id=${beforeId}`;
+  const res = await fetch(url);
   const messages = await res.json();
   const container = document.getElementById('friend-chat-messages');
   if (!container) { // Added a check for the container
       console.error("Chat messages container not found.");
       return;
   }
-  container.innerHTML = '';
+  const fragment = document.createDocumentFragment();
   messages.forEach(msg => {
     const msgDiv = document.createElement('div');
     msgDiv.className = msg.sender_id === user.id ? 'my-message' : 'their-message';
     msgDiv.textContent = msg.message;
-    container.appendChild(msgDiv);
+    fragment.appendChild(msgDiv);
+  });
+  if (beforeId) {
+    // Keep the view where it was while older messages go on top
+    const previousHeight = container.scrollHeight;
+    container.insertBefore(fragment, container.firstChild);
+    container.scrollTop = container.scrollHeight - previousHeight;
+  } else {
+    container.innerHTML = '';
+    container.appendChild(fragment);
+    container.scrollTop = container.scrollHeight;
+  }
+  if (messages.length) friendChatOldestId = messages[0].id;
+  else if (!beforeId) friendChatOldestId = null;
+  friendChatHasMore = messages.length === FRIEND_CHAT_PAGE_SIZE;
+}
+
+// Load older messages when the friend chat is scrolled to the top
+const friendChatMessagesContainer = document.getElementById('friend-chat-messages');
+if (friendChatMessagesContainer) {
+  friendChatMessagesContainer.addEventListener('scroll', () => {
+    if (friendChatMessagesContainer.scrollTop === 0 && friendChatHasMore && friendChatOldestId && currentChatFriend) {
+      friendChatHasMore = false; // one page at a time
+      loadFriendMessages(currentChatFriend.id, friendChatOldestId);
+    }
   });
-  container.scrollTop = container.scrollHeight;
 }
 
 // Listen for friend chat messages
@@ -948,6 +1010,19 @@ document.getElementById('submit-report').addEventListener('click', () => {
     geocoder.geocode(query);
   }
   
+// Unique key per alert submission, so the server can drop retries.
+// crypto.randomUUID() only exists in secure contexts (HTTPS, localhost).
+function newIdempotencyKey() {
+  if (window.crypto && crypto.randomUUID) {
+    return crypto.randomUUID();
+  }
+  if (window.crypto && crypto.getRandomValues) {
+    const bytes = crypto.getRandomValues(new Uint8Array(16));
+    return Array.from(bytes, b => b.toString(16).padStart(2, '0')).join('');
+  }
+  return `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}${Math.random().toString(36).slice(2)}`;
+}
+
 // Seek Help Button (Main Button)
 const seekHelpButton = document.getElementById('seek-help');
 let holdTimeout;
@@ -1015,6 +1090,7 @@ document.getElementById('confirm-seek-help').addEventListener('click', () => {
           details: emergencyDetails,
           location: location,
           user_id: user.id,
+          idempotency_key: newIdempotencyKey(), // Lets the server drop retries of this alert
         };
 
         // Send data to the backend
@@ -1096,6 +1172,7 @@ function sendEmergencyHelp() {
           details: 'Need help!!',
           location: location,
           user_id: user.id,
+          idempotency_key: newIdempotencyKey(), // Lets the server drop retries of this alert
         };
 
         // Send data to the backend
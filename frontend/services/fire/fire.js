@@ -208,10 +208,16 @@ function showProfileModal(profileData) {
   });
 
   // Fetch initial fire alerts
-  fetch('http://localhost:5000/api/fire/alerts')
+  // Ask for alerts sorted nearest first when our location is known
+  let alertsUrl = 'http://localhost:5000/api/fire/alerts';
+  if (fireServiceProfile && fireServiceProfile.lat && fireServiceProfile.lng) {
+    alertsUrl += `?lat=${fireServiceProfile.lat}&lng=${fireServiceProfile.lng}`;
+  }
+  fetch(alertsUrl)
     .then(res => res.json())
     .then(alerts => {
-      alerts.forEach(alert => addFireAlertToList(alert)); // Ensure addFireAlertToList is defined
+      // addFireAlertToList prepends, so add the farthest first to keep the nearest on top
+      alerts.slice().reverse().forEach(alert => addFireAlertToList(alert));
       updateAlertsUI(); // Call after alerts are loaded
     })
     .catch((err) => {
@@ -115,10 +115,16 @@ document.addEventListener('DOMContentLoaded', async function () {
   });
 
   // Fetch initial medical alerts
-  fetch('http://localhost:5000/api/medical/alerts')
+  // Ask for alerts sorted nearest first when our location is known
+  let alertsUrl = 'http://localhost:5000/api/medical/alerts';
+  if (medicalServiceProfile && medicalServiceProfile.lat && medicalServiceProfile.lng) {
+    alertsUrl += `?lat=${medicalServiceProfile.lat}&lng=${medicalServiceProfile.lng}`;
+  }
+  fetch(alertsUrl)
     .then(res => res.json())
     .then(alerts => {
-      alerts.forEach(alert => addMedicalAlertToList(alert));
+      // addMedicalAlertToList prepends, so add the farthest first to keep the nearest on top
+      alerts.slice().reverse().forEach(alert => addMedicalAlertToList(alert));
       updateAlertsUI();
     })
     .catch((err) => {
@@ -0,0 +1,37 @@
+-- ============================================
+-- FindMe Migration 001
+-- Spatial location columns (MySQL 8.0+)
+-- ============================================
+--
+-- Adds a POINT SRID 4326 column with a SPATIAL INDEX to users, services and
+-- emergency_alerts. The columns are STORED generated columns computed from
+-- the existing lat/lng DECIMAL columns, so every INSERT/UPDATE that writes
+-- lat/lng keeps them in sync without any change to the application writes.
+--
+-- Spatial indexes need NOT NULL columns; rows without a location are stored
+-- as POINT(0 0) and are filtered out by the lat/lng IS NOT NULL checks in the
+-- proximity queries.
+--
+-- Run with: mysql -u root -p safety_db < migrations/001_spatial_location.sql
+
+USE safety_db;
+
+-- Users
+ALTER TABLE users
+    ADD COLUMN location POINT SRID 4326
+        GENERATED ALWAYS AS (ST_SRID(POINT(COALESCE(lng, 0), COALESCE(lat, 0)), 4326)) STORED NOT NULL,
+    ADD SPATIAL INDEX idx_users_location (location);
+
+-- Services
+ALTER TABLE services
+    ADD COLUMN location POINT SRID 4326
+        GENERATED ALWAYS AS (ST_SRID(POINT(COALESCE(lng, 0), COALESCE(lat, 0)), 4326)) STORED NOT NULL,
+    ADD SPATIAL INDEX idx_services_location (location);
+
+-- Emergency alerts
+ALTER TABLE emergency_alerts
+    ADD COLUMN location POINT SRID 4326
+        GENERATED ALWAYS AS (ST_SRID(POINT(longitude, latitude), 4326)) STORED NOT NULL,
+    ADD SPATIAL INDEX idx_alerts_location_point (location);
+
+SELECT 'Migration 001 (spatial location) completed successfully!' as status;
@@ -0,0 +1,27 @@
+-- ============================================
+-- FindMe Migration 002
+-- Location history for users with active alerts
+-- ============================================
+--
+-- Append-only trail of positions, written only while a user has an
+-- unresolved alert. Rows are compact: unix seconds and coordinates as
+-- fixed-point integers (degrees * 1e7). The (user_id, ts) primary key is the
+-- InnoDB clustered key, so a trail is a single range scan.
+--
+-- The app downsamples old points (1 per minute after an hour, 1 per 10
+-- minutes after a day) and drops points past the retention period.
+--
+-- Run with: mysql -u root -p safety_db < migrations/002_location_history.sql
+
+USE safety_db;
+
+CREATE TABLE IF NOT EXISTS user_location_history (
+    user_id INT NOT NULL,
+    ts INT UNSIGNED NOT NULL,
+    lat_e7 INT NOT NULL,
+    lng_e7 INT NOT NULL,
+    PRIMARY KEY (user_id, ts),
+    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+);
+
+SELECT 'Migration 002 (location history) completed successfully!' as status;
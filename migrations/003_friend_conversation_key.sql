@@ -0,0 +1,22 @@
+-- ============================================
+-- FindMe Migration 003
+-- Conversation key for friend messages
+-- ============================================
+--
+-- A conversation between users a and b is stored in both directions, so
+-- reading it needed (sender = a AND receiver = b) OR (sender = b AND
+-- receiver = a). The generated (conversation_low, conversation_high) pair
+-- is the same for both directions, and the composite index on
+-- (conversation_low, conversation_high, id) serves the newest-first keyset
+-- pages of GET /api/friends/messages directly.
+--
+-- Run with: mysql -u root -p safety_db < migrations/003_friend_conversation_key.sql
+
+USE safety_db;
+
+ALTER TABLE friend_messages
+    ADD COLUMN conversation_low INT GENERATED ALWAYS AS (LEAST(sender_id, receiver_id)) STORED,
+    ADD COLUMN conversation_high INT GENERATED ALWAYS AS (GREATEST(sender_id, receiver_id)) STORED,
+    ADD INDEX idx_conversation_key (conversation_low, conversation_high, id);
+
+SELECT 'Migration 003 (friend conversation key) completed successfully!' as status;
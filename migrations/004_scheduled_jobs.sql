@@ -0,0 +1,25 @@
+-- ============================================
+-- FindMe Migration 004
+-- Persisted deadlines for the job scheduler
+-- ============================================
+--
+-- One-shot delayed jobs (e.g. closing an emergency room 30 seconds after
+-- the victim marks safe) are stored here while pending, so a restart picks
+-- them up again instead of leaving rooms open. A job is unique per
+-- (job_name, job_key); rescheduling it overwrites the deadline.
+--
+-- Run with: mysql -u root -p safety_db < migrations/004_scheduled_jobs.sql
+
+USE safety_db;
+
+CREATE TABLE IF NOT EXISTS scheduled_jobs (
+    job_name VARCHAR(64) NOT NULL,
+    job_key VARCHAR(255) NOT NULL DEFAULT '',
+    payload JSON NOT NULL,
+    run_at DOUBLE NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (job_name, job_key),
+    INDEX idx_run_at (run_at)
+);
+
+SELECT 'Migration 004 (scheduled jobs) completed successfully!' as status;
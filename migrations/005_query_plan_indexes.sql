@@ -0,0 +1,31 @@
+-- ============================================
+-- FindMe Migration 005
+-- Composite indexes for the query plan check
+-- ============================================
+--
+-- Indexes that backend/check_query_plans.py needs to pass against a seeded
+-- dataset (no full scans or large filesorts outside its documented
+-- exceptions):
+--   emergency_alerts (user_id, resolved, created_at)
+--       coalescing lookup, mark-safe and the per-owner open alert count
+--   emergency_alerts (resolved, created_at)
+--       open medical alerts newest first: the leading-wildcard LIKEs on
+--       type only filter the open rows, read in index order (no filesort)
+--   emergency_alerts (type, resolved)
+--       open fire alerts (type = 'fire' AND resolved = 0 OR NULL)
+--   user_location_history (ts)
+--       expiry and downsampling by age; the primary key leads with user_id
+--   services (company_name, service_type)
+--       phone lookup when a service responds to an alert
+--
+-- Run with: mysql -u root -p safety_db < migrations/005_query_plan_indexes.sql
+
+USE safety_db;
+
+CREATE INDEX idx_alerts_user_open ON emergency_alerts(user_id, resolved, created_at);
+CREATE INDEX idx_alerts_open_created ON emergency_alerts(resolved, created_at);
+CREATE INDEX idx_alerts_type_open ON emergency_alerts(type, resolved);
+CREATE INDEX idx_ts ON user_location_history(ts);
+CREATE INDEX idx_services_name_type ON services(company_name, service_type);
+
+SELECT 'Migration 005 (query plan indexes) completed successfully!' as status;
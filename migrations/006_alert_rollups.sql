@@ -0,0 +1,29 @@
+-- ============================================
+-- FindMe Migration 006
+-- Hourly and daily alert rollups
+-- ============================================
+--
+-- alert_rollups holds how many alerts of each type were created and
+-- resolved per hour and per day. The backend keeps it up to date as alerts
+-- are raised and resolved, and /api/alerts/over-time reads only this table.
+-- Buckets are in the database's time zone.
+--   emergency_alerts (resolved_at)
+--       recounting resolved alerts per hour (repair job and backfill)
+--
+-- Run with: mysql -u root -p safety_db < migrations/006_alert_rollups.sql
+-- then fill in existing alerts: cd backend && flask --app app backfill-alert-rollups
+
+USE safety_db;
+
+CREATE TABLE alert_rollups (
+    granularity ENUM('hour', 'day') NOT NULL,
+    bucket_start DATETIME NOT NULL,
+    type VARCHAR(100) NOT NULL,
+    created INT NOT NULL DEFAULT 0,
+    resolved INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (granularity, bucket_start, type)
+);
+
+CREATE INDEX idx_alerts_resolved_at ON emergency_alerts(resolved_at);
+
+SELECT 'Migration 006 (alert rollups) completed successfully!' as status;